@@ -0,0 +1,417 @@
+"""
+Benchmarks of the hot paths: backtest loop, runners, trades / history, stats, indicators, the TradingView parser
+and the data providers.
+
+Everything runs offline on synthetic data generated from a fixed seed, the providers against a
+local `StubServer` (bybit, fred) or a replayed recording (tradingview). Each benchmark is
+timed at every size (best of `--repeat` runs), with its throughput (bars/s, trades/s, ...)
+and its peak traced memory (measured in a separate run). The results are written as JSON
+and can be compared with a saved baseline.
+
+i.e:
+    uv run python benchmarks/bench.py                                   # default sizes, print the results
+    uv run python benchmarks/bench.py --sizes 1e3,1e5 -k stats -k echo  # some sizes / benchmarks only
+    uv run python benchmarks/bench.py --output benchmarks/baseline.json
+    uv run python benchmarks/bench.py --baseline benchmarks/baseline.json --threshold 0.2  # exit 1 on regressions
+"""
+
+import argparse
+import atexit
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from qfin.api.bybit import bybit
+from qfin.api.fred import fred_many
+from qfin.api.stub import StubServer, tv_recording
+from qfin.api.transport import ReplayTransport, use_transport
+from qfin.api.tv import TvDatafeed, _BarColumns, _FrameParser
+from qfin.backtester.backtester import Backtester
+from qfin.backtester.runners import bt_signal_change
+from qfin.backtester.stats import _compute_drawdown_duration_peaks, excursions, stats
+from qfin.indicators.common import continue_echo, crossover, direction, revert_echo
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+SEED = 42
+
+_benchmarks = []
+
+
+def benchmark(name: str, unit: str = "bars", max_size: int = None):
+    """Register a benchmark: the decorated `setup(size)` prepares the data (not timed) and returns the
+    timed function, which returns the number of `unit` processed.
+
+    Sizes above `max_size` are skipped (python loops), unless `--no-limit` is given.
+    """
+
+    def register(setup):
+        _benchmarks.append({"name": name, "unit": unit, "max_size": max_size, "setup": setup})
+        return setup
+
+    return register
+
+
+# ----------------
+#  data
+# ----------------
+
+
+def synthetic_ohlc(size: int, seed: int = SEED, mean_signal_bars: int = 50) -> pd.DataFrame:
+    """Random walk OHLCV bars with a -1/0/1 signal changing every `mean_signal_bars` bars on average."""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, size)))
+    open_ = np.r_[close[0], close[:-1]]
+    spread = np.abs(rng.normal(0, 0.0005, size)) * close
+    changes = rng.random(size) < 1 / mean_signal_bars
+    signal = rng.integers(-1, 2, size)[np.maximum.accumulate(np.where(changes, np.arange(size), 0))]
+    return pd.DataFrame(
+        {
+            "open": open_,
+            "high": np.maximum(open_, close) + spread,
+            "low": np.minimum(open_, close) - spread,
+            "close": close,
+            "volume": rng.integers(1, 1000, size).astype(np.float64),
+            "signal": signal.astype(np.int64),
+        },
+        index=pd.date_range("2000-01-01", periods=size, freq="1min", name="date"),
+    )
+
+
+def tv_messages(size: int, bars_per_frame: int = 100) -> list:
+    """Raw websocket messages of a TradingView history of `size` bars, cut at arbitrary points."""
+    rng = np.random.default_rng(SEED)
+    frames = []
+    for start in range(0, size, bars_per_frame):
+        end = min(start + bars_per_frame, size)
+        bars = [{"i": i, "v": [1.6e9 + 60 * i, 1.0, 2.0, 0.5, 1.5, 100.0]} for i in range(start, end)]
+        payload = json.dumps({"m": "timescale_update", "p": ["cs_bench", {"s1": {"s": bars}}]})
+        frames.append(f"~m~{len(payload)}~m~{payload}")
+        if len(frames) % 10 == 0:
+            frames.append("~m~4~m~~h~1")
+    data = "".join(frames)
+    cuts = np.sort(rng.integers(0, len(data), max(len(data) // 4096, 1)))
+    return [data[a:b] for a, b in zip(np.r_[0, cuts], np.r_[cuts, len(data)])]
+
+
+_cache = {}
+
+
+def _ohlc(size: int) -> pd.DataFrame:
+    if size not in _cache:
+        _cache.clear()
+        _cache[size] = synthetic_ohlc(size)
+    return _cache[size]
+
+
+def _finished(size: int) -> Backtester:
+    key = ("bt", size)
+    if key not in _cache:
+        _cache[key] = bt_signal_change(_ohlc(size))
+    return _cache[key]
+
+
+# ----------------
+#  benchmarks
+# ----------------
+
+
+@benchmark("backtester.run_loop", max_size=100_000)
+def _run_loop(size):
+    dataset = _ohlc(size)
+
+    def run():
+        bt = Backtester(dataset)
+        for _ in bt.run():
+            pass
+        return size
+
+    return run
+
+
+@benchmark("backtester.run_loop_events")
+def _run_loop_events(size):
+    dataset = _ohlc(size)
+
+    def run():
+        bt = Backtester(dataset)
+        for _ in bt.run(events=[]):
+            pass
+        return size
+
+    return run
+
+
+@benchmark("runners.bt_signal_change", max_size=1_000_000)
+def _bt_signal_change(size):
+    dataset = _ohlc(size)
+    return lambda: len(bt_signal_change(dataset).params.dataset)
+
+
+@benchmark("backtester.trades", unit="trades")
+def _trades(size):
+    bt = _finished(size)
+    return lambda: len(bt.trades())
+
+
+@benchmark("backtester.trades_excursions", unit="trades")
+def _trades_excursions(size):
+    bt = _finished(size)
+    trades, (high, low) = bt.trades(), bt._high_low()
+    return lambda: len(excursions(trades, high, low))
+
+
+@benchmark("backtester.history")
+def _history(size):
+    bt = _finished(size)
+    return lambda: len(bt.history())
+
+
+@benchmark("stats.stats")
+def _stats(size):
+    bt = _finished(size)
+    history, trades = bt.history(), bt.trades()
+
+    def run():
+        stats(history, trades.copy())
+        return size
+
+    return run
+
+
+@benchmark("stats.drawdown")
+def _drawdown(size):
+    equity = _finished(size).history()["equity"]
+
+    def run():
+        dd = 1 - equity / np.maximum.accumulate(equity)
+        _compute_drawdown_duration_peaks(dd)
+        return size
+
+    return run
+
+
+@benchmark("indicators.continue_echo", max_size=1_000_000)
+def _continue_echo(size):
+    changes = pd.Series(revert_echo(_ohlc(size)["signal"], empty_value=0))
+    return lambda: len(continue_echo(changes, skip_values=[0]))
+
+
+@benchmark("indicators.revert_echo", max_size=1_000_000)
+def _revert_echo(size):
+    signal = _ohlc(size)["signal"]
+    return lambda: len(revert_echo(signal))
+
+
+@benchmark("indicators.crossover")
+def _crossover(size):
+    close = _ohlc(size)["close"]
+    fast, slow = close.rolling(10).mean(), close.rolling(50).mean()
+    return lambda: len(crossover(fast, slow))
+
+
+@benchmark("indicators.direction")
+def _direction(size):
+    close = _ohlc(size)["close"]
+    return lambda: len(direction(close))
+
+
+@benchmark("tv.parse_history", max_size=1_000_000)
+def _tv_parse(size):
+    messages = tv_messages(size)
+
+    def run():
+        parser = _FrameParser()
+        bars = _BarColumns(size)
+        for message in messages:
+            for payload in parser.feed(message):
+                if payload.startswith("~h~"):
+                    continue
+                bars.add(json.loads(payload)["p"][1]["s1"]["s"])
+        return len(bars)
+
+    return run
+
+
+_stub = None
+_recordings = tempfile.mkdtemp(prefix="qfin-bench-")
+atexit.register(shutil.rmtree, _recordings, True)
+
+
+def _stub_server() -> StubServer:
+    global _stub
+    if _stub is None:
+        _stub = StubServer(fred_rows=100).start()
+    return _stub
+
+
+@benchmark("bybit.stub", max_size=10_000)
+def _bybit_stub(size):
+    stub = _stub_server()
+    start = (pd.Timestamp(stub.last_time, unit="s") - pd.Timedelta(days=size - 1)).strftime("%Y-%m-%d")
+
+    def run():
+        with use_transport(stub.transport()):
+            return len(bybit("BTCUSD", start=start, interval="D", sleep_time=0, BYBIT_API_KEY="-", BYBIT_API_SECRET="-"))
+
+    return run
+
+
+@benchmark("fred.stub", unit="requests", max_size=100_000)
+def _fred_stub(size):
+    stub = _stub_server()
+    series = [f"S{i}" for i in range(max(size // stub.fred_rows, 1))]
+
+    def run():
+        with use_transport(stub.transport()):
+            fred_many(series, cache_dir=False, batch_size=1)
+        return len(series)
+
+    return run
+
+
+@benchmark("tv.replay", max_size=1_000_000)
+def _tv_replay(size):
+    directory = os.path.join(_recordings, f"tv-{size}")
+    if not os.path.exists(directory):
+        tv_recording(directory, n_bars=size // 10, series=10, step=60)
+    symbols = [f"SYM{i}" for i in range(10)]
+
+    def run():
+        with use_transport(ReplayTransport(directory)), TvDatafeed() as tv:
+            return sum(len(df) for df in tv.get_hist_many(symbols, exchange="X", n_bars=size // 10))
+
+    return run
+
+
+# ----------------
+#  runner
+# ----------------
+
+
+def _measure(setup, size: int, repeat: int) -> dict:
+    run = setup(size)
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        count = run()
+        timings.append(time.perf_counter() - start)
+
+    # peak memory in a separate run, tracing slows the code down
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = min(timings)
+    return {"seconds": seconds, "count": int(count), "throughput": count / seconds if seconds else None, "peak_bytes": peak}
+
+
+def _environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "commit": commit,
+        "time": pd.Timestamp.now().isoformat(),
+        "seed": SEED,
+    }
+
+
+def run_benchmarks(sizes=None, patterns=None, repeat: int = 3, no_limit: bool = False, log=print) -> dict:
+    """Run the benchmarks whose name contains one of `patterns` (all if None) and return the results."""
+    results = []
+    for size in sizes or DEFAULT_SIZES:
+        for bench in _benchmarks:
+            if patterns and not any(pattern in bench["name"] for pattern in patterns):
+                continue
+            if bench["max_size"] and size > bench["max_size"] and not no_limit:
+                continue
+            result = {"name": bench["name"], "size": size, "unit": bench["unit"], **_measure(bench["setup"], size, repeat)}
+            results.append(result)
+            log(_format(result))
+        _cache.clear()
+    return {"environment": _environment(), "results": results}
+
+
+def _format(result: dict, extra: str = "") -> str:
+    throughput = f"{result['throughput']:>14,.0f} {result['unit']}/s" if result["throughput"] else " " * 20
+    return (
+        f"{result['name']:<34} {result['size']:>10,} {result['seconds'] * 1000:>11.2f} ms"
+        f" {throughput:<24} {result['peak_bytes'] / 2**20:>9.1f} MiB{extra}"
+    )
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.2, log=print) -> list:
+    """Compare with a baseline, a regression is a time or a peak memory more than `threshold` (0.2 = 20%) above it."""
+    previous = {(r["name"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        base = previous.get((result["name"], result["size"]))
+        if base is None:
+            continue
+        time_ratio = result["seconds"] / base["seconds"] if base["seconds"] else 1.0
+        memory_ratio = result["peak_bytes"] / base["peak_bytes"] if base["peak_bytes"] else 1.0
+        regressed = [name for name, ratio in (("time", time_ratio), ("memory", memory_ratio)) if ratio > 1 + threshold]
+        flag = f"  REGRESSION ({', '.join(regressed)})" if regressed else ""
+        log(_format(result, f"   time x{time_ratio:.2f}  memory x{memory_ratio:.2f}{flag}"))
+        if regressed:
+            regressions.append({**result, "time_ratio": time_ratio, "memory_ratio": memory_ratio})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="comma separated bar counts, i.e. 1e3,1e5")
+    parser.add_argument("-k", dest="patterns", action="append", help="only the benchmarks containing this text (repeatable)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark, the best one is kept")
+    parser.add_argument("--no-limit", action="store_true", help="run the python-loop benchmarks at every size")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results of this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="regression threshold, 0.2 = 20%% slower / larger")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for bench in _benchmarks:
+            print(bench["name"])
+        return 0
+
+    sizes = [int(float(size)) for size in args.sizes.split(",")]
+    results = run_benchmarks(sizes, args.patterns, args.repeat, args.no_limit)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\ncompared with {args.baseline} ({baseline['environment'].get('commit')}), threshold {args.threshold:.0%}")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s)")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Cold-start import times of qfin.
+
+Every statement is run in a fresh interpreter (no module cached), `--repeat` times, and
+the median wall time is kept. The heavy third-party modules loaded by each statement are
+listed, so an eager import of a plotting or provider library shows up here.
+
+i.e:
+    uv run python benchmarks/import_time.py
+    uv run python benchmarks/import_time.py --repeat 9 --output benchmarks/import_time.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+STATEMENTS = [
+    "import qfin",
+    "from qfin import Backtester",
+    "import qfin.backtester.backtester",
+    "import qfin.api.tv",
+    "import qfin.api.yahoo",
+    "import qfin.api.bybit",
+    "import qfin.api.fred",
+]
+HEAVY = ["pandas", "matplotlib", "plotly", "yfinance", "pybit", "requests", "websocket"]
+
+_probe = """
+import json, sys, time
+start = time.perf_counter()
+exec({statement!r})
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(statement: str, repeat: int = 5) -> dict:
+    """Median import time of `statement` over `repeat` fresh interpreters."""
+    runs = []
+    for _ in range(repeat):
+        code = _probe.format(statement=statement, heavy=HEAVY)
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, env=os.environ)
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        "statement": statement,
+        "seconds": statistics.median(run["seconds"] for run in runs),
+        "loaded": runs[-1]["loaded"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per statement, the median is kept")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("statements", nargs="*", help="statements to time, i.e. 'import qfin.api.tv'")
+    args = parser.parse_args(argv)
+
+    results = []
+    for statement in args.statements or STATEMENTS:
+        result = measure(statement, args.repeat)
+        results.append(result)
+        print(f"{statement:<36} {result['seconds'] * 1000:>9.1f} ms   {', '.join(result['loaded'])}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,33 @@
-from .backtester.backtester import Backtester
+"""
+The exports are loaded on first use, `import qfin` does not import the backtester, the
+plotting libraries (matplotlib, plotly) or the data providers (yfinance, pybit, requests).
+
+i.e:
+    import qfin
+    bt = qfin.Backtester(dataset=df)  # imports qfin.backtester.backtester here
+"""
+
+import importlib
+
+_exports = {"Backtester": ".backtester.backtester"}
+_submodules = ["api", "backtester", "data", "indicators"]
+
+__all__ = ["Backtester", "hello"]
+
+
+def __getattr__(name: str):
+    if name in _exports:
+        value = getattr(importlib.import_module(_exports[name], __name__), name)
+    elif name in _submodules:
+        value = importlib.import_module(f".{name}", __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value  # the next lookups do not go through __getattr__
+    return value
+
+
+def __dir__():
+    return sorted([*globals(), *_exports, *_submodules])
 
 
 def hello() -> str:
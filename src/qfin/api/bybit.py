@@ -3,7 +3,8 @@ import time
 from datetime import datetime, timedelta
 
 import pandas as pd
-from pybit.unified_trading import HTTP
+
+from .transport import get_transport
 
 
 # date to timestamp
@@ -21,6 +22,8 @@ def pybit(ticker, start=None, end=None, interval=720, limit=1000, BYBIT_API_KEY=
     doc: https://bybit-exchange.github.io/docs/v5/market/kline
     interval: 1,3,5,15,30,60,120,240,360,720,D,W,M
     """
+    from pybit.unified_trading import HTTP
+
     symbol = ticker.replace("-", "").replace("/", "")
     BYBIT_API_KEY = BYBIT_API_KEY or os.environ["BYBIT_API_KEY"]
     BYBIT_API_SECRET = BYBIT_API_SECRET or os.environ["BYBIT_API_SECRET"]
@@ -37,7 +40,7 @@ def pybit(ticker, start=None, end=None, interval=720, limit=1000, BYBIT_API_KEY=
         "D": "d",
     }
 
-    response = session.get_kline(
+    kwargs = dict(
         # category="inverse",
         symbol=symbol,
         interval=kLineIntervalDict.get(interval, interval),
@@ -45,6 +48,8 @@ def pybit(ticker, start=None, end=None, interval=720, limit=1000, BYBIT_API_KEY=
         end=to_timestamp_ms(end, True) if end else None,
         limit=limit,
     )
+    # through the transport: recorded / replayed, the credentials are not part of the recording
+    response = get_transport().call("bybit", "get_kline", session.get_kline, kwargs)
 
     meta_data = response["result"]["list"]
     pybit_df = pd.DataFrame(meta_data)
@@ -0,0 +1,236 @@
+"""
+Concurrent downloads across the data providers in `qfin.api`.
+
+`fetch_many` takes a list of requests (yahoo, bybit, fred or tv), runs the
+blocking provider functions in a thread pool with a bounded number of calls
+in flight per provider, retries failures with exponential backoff and yields
+each result as soon as it is ready. Only the network / provider errors are retried,
+the others (i.e. a TypeError in a provider) are raised.
+
+i.e:
+    requests = [
+        FetchRequest("yahoo", ticker="^SPX", start="2020-01-01"),
+        FetchRequest("fred", series="M2SL"),
+        {"provider": "tv", "symbol": "SPX", "exchange": "SP", "n_bars": 500},
+    ]
+
+    async for result in fetch_many(requests):
+        if result.ok:
+            process(result.key, result.data)
+"""
+
+import asyncio
+import functools
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# max calls in flight per provider
+DEFAULT_CONCURRENCY = {
+    "yahoo": 8,
+    "bybit": 4,
+    "fred": 8,
+    "tv": 4,
+}
+
+
+class _TvFeeds:
+    """helper class: one TvDatafeed per worker thread (a feed holds a single websocket), closed by `close`"""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.feeds = []
+
+    def __call__(self, **kwargs):
+        from .tv import Interval, TvDatafeed
+
+        feed = getattr(self.local, "feed", None)
+        if feed is None:
+            feed = self.local.feed = TvDatafeed()
+            with self.lock:
+                self.feeds.append(feed)
+
+        interval = kwargs.get("interval")
+        if isinstance(interval, str):
+            kwargs["interval"] = Interval(interval)
+
+        return feed.get_hist(**kwargs)
+
+    def close(self):
+        with self.lock:
+            feeds, self.feeds = self.feeds, []
+        for feed in feeds:
+            feed.close()
+
+
+def _provider_errors() -> tuple:
+    """helper function: the exceptions of a failed download (network / provider), the others are not retried"""
+    errors = [OSError, ValueError]
+    try:
+        from websocket import WebSocketException
+
+        errors.append(WebSocketException)
+    except ImportError:
+        pass
+    try:
+        from pybit.exceptions import FailedRequestError, InvalidRequestError
+
+        errors += [FailedRequestError, InvalidRequestError]
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def _loader(provider):
+    """Return the blocking download function of a provider."""
+    if provider == "yahoo":
+        from .yahoo import yahoo
+
+        return yahoo
+    if provider == "bybit":
+        from .bybit import bybit
+
+        return bybit
+    if provider == "fred":
+        from .fred import fred
+
+        return fred
+    if provider == "tv":
+        return _TvFeeds()
+
+    raise ValueError(f"unknown provider '{provider}', expected one of {list(DEFAULT_CONCURRENCY)}")
+
+
+class FetchRequest:
+    """A single download: provider name plus the keyword arguments of its function."""
+
+    def __init__(self, provider: str, key=None, **kwargs):
+        self.provider = provider
+        self.kwargs = kwargs
+        self.key = key if key is not None else self.__default_key(provider, kwargs)
+
+    @staticmethod
+    def __default_key(provider, kwargs):
+        name = kwargs.get("ticker") or kwargs.get("series") or kwargs.get("symbol")
+        if isinstance(name, (list, tuple)):
+            name = ",".join(name)
+        return f"{provider}:{name}"
+
+    @classmethod
+    def parse(cls, value):
+        """Accept a FetchRequest or a dict with a 'provider' item."""
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, dict):
+            value = dict(value)
+            return cls(value.pop("provider"), key=value.pop("key", None), **value)
+        raise TypeError(f"invalid request: {value!r}")
+
+    def __repr__(self):
+        return f"FetchRequest({self.key!r})"
+
+
+class FetchResult:
+    """Outcome of a FetchRequest: `data` on success, `error` after the last failed attempt."""
+
+    def __init__(self, request: FetchRequest, data=None, error: Exception = None, attempts: int = 0, elapsed: float = 0.0):
+        self.request = request
+        self.data = data
+        self.error = error
+        self.attempts = attempts
+        self.elapsed = elapsed
+
+    @property
+    def key(self):
+        return self.request.key
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"error={self.error!r}"
+        return f"FetchResult({self.key!r}, {status}, attempts={self.attempts})"
+
+
+def _is_empty(data):
+    return data is None or (hasattr(data, "__len__") and len(data) == 0)
+
+
+async def _fetch_one(request, loader, semaphore, executor, retries, backoff, max_backoff):
+    loop = asyncio.get_running_loop()
+    func = functools.partial(loader, **request.kwargs)
+    errors = _provider_errors()
+    error = None
+    started = loop.time()
+
+    for attempt in range(1, retries + 2):
+        async with semaphore:
+            try:
+                data = await loop.run_in_executor(executor, func)
+                if _is_empty(data):
+                    raise ValueError(f"no data returned for {request.key}")
+                return FetchResult(request, data=data, attempts=attempt, elapsed=loop.time() - started)
+            except errors as e:
+                error = e
+                logger.debug(f"{request.key} attempt {attempt} failed: {e!r}")
+
+        if attempt <= retries:
+            # exponential backoff with jitter, slept outside the semaphore so other requests can run
+            delay = min(backoff * 2 ** (attempt - 1), max_backoff)
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+    logger.warning(f"{request.key} failed after {retries + 1} attempts: {error!r}")
+    return FetchResult(request, error=error, attempts=retries + 1, elapsed=loop.time() - started)
+
+
+async def fetch_many(
+    requests,
+    concurrency: dict = None,
+    retries: int = 3,
+    backoff: float = 1.0,
+    max_backoff: float = 30.0,
+    raise_errors: bool = False,
+):
+    """Download many requests concurrently, yielding a FetchResult as each one completes.
+
+    Args:
+        requests (list): FetchRequest objects or dicts like {"provider": "yahoo", "ticker": "^SPX"}.
+        concurrency (dict, optional): max calls in flight per provider, merged over DEFAULT_CONCURRENCY.
+        retries (int, optional): extra attempts per request after the first failure. Defaults to 3.
+        backoff (float, optional): first retry delay in seconds, doubled on each retry. Defaults to 1.0.
+        max_backoff (float, optional): upper bound of the retry delay. Defaults to 30.0.
+        raise_errors (bool, optional): raise the error of the first failed request instead of yielding it.
+
+    Yields:
+        FetchResult: in completion order, not in request order.
+    """
+    requests = [FetchRequest.parse(r) for r in requests]
+    limits = {**DEFAULT_CONCURRENCY, **(concurrency or {})}
+
+    providers = {r.provider for r in requests}
+    loaders = {p: _loader(p) for p in providers}  # fail fast on unknown providers
+    semaphores = {p: asyncio.Semaphore(limits[p]) for p in providers}
+    executor = ThreadPoolExecutor(max_workers=max(1, sum(limits[p] for p in providers)), thread_name_prefix="qfin-fetch")
+
+    tasks = [
+        asyncio.ensure_future(_fetch_one(r, loaders[r.provider], semaphores[r.provider], executor, retries, backoff, max_backoff))
+        for r in requests
+    ]
+
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            if raise_errors and not result.ok:
+                raise result.error
+            yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+        if "tv" in loaders:
+            loaders["tv"].close()
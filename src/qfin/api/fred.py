@@ -1,13 +1,23 @@
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 
+from .transport import get_transport
+
+_fred_url = "https://fred.stlouisfed.org/graph/fredgraph.csv?id="
+_fred_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "qfin", "fred")
+
 
 def fred(series):
     """Download series from https://fred.stlouisfed.org
     Version: 1.1
     """
-    url = "https://fred.stlouisfed.org/graph/fredgraph.csv?id=" + series
+    csv = get_transport().get_text(_fred_url + series)
     df = pd.read_csv(
-        url,
+        io.StringIO(csv),
         index_col=0,
         parse_dates=True,
         header=None,
@@ -16,3 +26,53 @@ def fred(series):
         na_values=".",
     )
     return df
+
+
+def _fred_batch(series):
+    """helper function: several series in one request (columns in request order)"""
+    csv = get_transport().get_text(_fred_url + ",".join(series))
+    df = pd.read_csv(io.StringIO(csv), index_col=0, parse_dates=True, na_values=".")
+    df.columns = series
+    df.index.name = "Date"
+    return df
+
+
+def fred_many(series, cache_dir=None, max_age=24 * 3600, batch_size=20, max_workers=4, refresh=False):
+    """Download many FRED series, several per request, with a local CSV cache.
+
+    Args:
+        series (list): FRED series ids, i.e. ["M2SL", "CPIAUCSL", "DGS10"].
+        cache_dir (str, optional): cache folder. Defaults to ~/.cache/qfin/fred, False disables the cache.
+        max_age (float, optional): seconds a cached series stays fresh. Defaults to one day.
+        batch_size (int, optional): series per request. Defaults to 20.
+        max_workers (int, optional): requests in parallel. Defaults to 4.
+        refresh (bool, optional): ignore the cache and download everything again.
+
+    Returns:
+        dict: series id -> dataframe like `fred(series)`, each on its own dates without missing values
+    """
+    series = list(dict.fromkeys([series] if isinstance(series, str) else series))
+    cache_dir = _fred_cache_dir if cache_dir is None else cache_dir
+    result = {}
+
+    def cache_path(name):
+        return os.path.join(cache_dir, f"{name}.csv")
+
+    missing = []
+    for name in series:
+        path = cache_path(name) if cache_dir else None
+        if path and not refresh and os.path.exists(path) and time.time() - os.path.getmtime(path) < max_age:
+            result[name] = pd.read_csv(path, index_col=0, parse_dates=True)
+        else:
+            missing.append(name)
+
+    batches = [missing[i : i + batch_size] for i in range(0, len(missing), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        for df in executor.map(_fred_batch, batches):
+            for name in df.columns:
+                result[name] = df[[name]].dropna()
+                if cache_dir:
+                    os.makedirs(cache_dir, exist_ok=True)
+                    result[name].to_csv(cache_path(name))
+
+    return {name: result[name] for name in series}
@@ -0,0 +1,288 @@
+"""
+Local stub of the provider endpoints, for offline tests and throughput measurements.
+
+`StubServer` serves deterministic synthetic data in the formats of the real endpoints
+(FRED CSV, Bybit v5 kline JSON) from a local HTTP server, its transport sends the FRED
+requests and the pybit `get_kline` calls there. It can make it harder on the client:
+latency and jitter on every request, a rate limit (HTTP 429 for FRED, retCode 10006 for
+Bybit, like the real ones) and partial pages (fewer klines than `limit`).
+`tv_recording` writes a synthetic TradingView websocket session for `ReplayTransport`.
+
+i.e:
+    with StubServer(latency=0.02, rate_limit=50) as stub, use_transport(stub.transport()):
+        fred_many(["M2SL", "CPIAUCSL"], cache_dir=False)
+        bybit("BTCUSD", start="2020-01-01", interval="D", sleep_time=0)  # with the usual credentials
+    stub.stats  # {"requests": ..., "throttled": ..., "rows": ...}
+
+    tv_recording("./cassettes", n_bars=5000, series=10)
+    with use_transport(ReplayTransport("./cassettes")):
+        TvDatafeed().get_hist_many([f"SYM{i}" for i in range(10)], exchange="X", n_bars=5000)
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from .transport import LiveTransport, _Recording
+
+_intervals = {"D": 86400, "W": 7 * 86400, "M": 30 * 86400}  # bybit interval -> seconds, else minutes
+
+
+def _seed(name: str) -> int:
+    return int(hashlib.sha256(name.encode()).hexdigest()[:8], 16)
+
+
+def synthetic_bars(name: str, times: np.ndarray) -> pd.DataFrame:
+    """Deterministic OHLCV bars of a symbol at unix `times` (seconds): the same time always gives the same bar."""
+    seed = _seed(name)
+    times = np.asarray(times, dtype=np.int64)
+    noise = ((times.astype(np.uint64) * np.uint64(2654435761) + np.uint64(seed)) % np.uint64(2**32)) / 2**32
+    days = times / 86400
+    close = (50 + seed % 200) * (1 + 0.2 * np.sin(days / 90 + seed % 7) + 0.05 * (noise - 0.5))
+    open_ = close * (1 + 0.01 * (noise[::-1] - 0.5))
+    return pd.DataFrame(
+        {
+            "open": open_,
+            "high": np.maximum(open_, close) * (1 + 0.005 * noise),
+            "low": np.minimum(open_, close) * (1 - 0.005 * noise),
+            "close": close,
+            "volume": np.round(1000 * (1 + noise), 2),
+        },
+        index=times,
+    )
+
+
+class StubServer:
+    """Local HTTP server imitating the FRED and Bybit endpoints, see the module documentation."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_limit: float = None,
+        burst: int = None,
+        page_size: int = None,
+        fred_rows: int = 600,
+        last_time: str = "2025-01-01",
+        seed: int = 42,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        """
+        Args:
+            latency (float, optional): seconds added to every response. Defaults to 0.
+            jitter (float, optional): random seconds (0 to jitter) added to the latency. Defaults to 0.
+            rate_limit (float, optional): requests per second, the others are refused. Defaults to no limit.
+            burst (int, optional): requests allowed at once above the rate. Defaults to one second of requests.
+            page_size (int, optional): maximum klines per response, even if `limit` asks for more. Defaults to `limit`.
+            fred_rows (int, optional): monthly observations per FRED series, from 1960-01. Defaults to 600.
+            last_time (str, optional): time of the last kline. Defaults to "2025-01-01".
+            seed (int, optional): seed of the jitter. Defaults to 42.
+            host (str, optional): Defaults to "127.0.0.1".
+            port (int, optional): Defaults to a free port.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.burst = burst or max(1, int(rate_limit or 1))
+        self.page_size = page_size
+        self.fred_rows = fred_rows
+        self.last_time = int(pd.Timestamp(last_time).timestamp())
+        self.stats = {"requests": 0, "throttled": 0, "rows": 0}
+
+        self.__rng = random.Random(seed)
+        self.__dates = None
+        self.__fred = {}  # series id -> values, the same for every request
+        self.__lock = threading.Lock()
+        self.__tokens = float(self.burst)
+        self.__refill = time.monotonic()
+        self.__server = ThreadingHTTPServer((host, port), _handler(self))
+        self.__server.daemon_threads = True
+        self.__thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.__server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def transport(self, **kwargs) -> LiveTransport:
+        """A transport sending the FRED requests and the Bybit kline calls to this server."""
+        redirects = {"https://fred.stlouisfed.org": f"{self.url}/fred"}
+        return LiveTransport(redirects=redirects, calls={"bybit.get_kline": self.get_kline}, **kwargs)
+
+    def get_kline(self, **kwargs) -> dict:
+        """pybit `HTTP.get_kline` answered by this server: the same response, an error status raised like pybit does."""
+        response = LiveTransport().get_json(f"{self.url}/bybit/v5/market/kline", kwargs)
+        if response["retCode"] != 0:
+            raise OSError(f"{response['retMsg']} (ErrCode: {response['retCode']})")
+        return response
+
+    def start(self):
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__server.serve_forever, name="qfin-stub", daemon=True)
+            self.__thread.start()
+        return self
+
+    def stop(self):
+        if self.__thread is not None:
+            self.__server.shutdown()
+            self.__thread.join()
+            self.__thread = None
+        self.__server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def admit(self) -> bool:
+        """helper function: count a request, False when the rate limit refuses it"""
+        with self.__lock:
+            self.stats["requests"] += 1
+            delay = self.latency + (self.__rng.uniform(0, self.jitter) if self.jitter else 0)
+            admitted = True
+            if self.rate_limit:
+                now = time.monotonic()
+                self.__tokens = min(self.burst, self.__tokens + (now - self.__refill) * self.rate_limit)
+                self.__refill = now
+                admitted = self.__tokens >= 1
+                if admitted:
+                    self.__tokens -= 1
+                else:
+                    self.stats["throttled"] += 1
+        if delay:
+            time.sleep(delay)
+        return admitted
+
+    def served(self, rows: int):
+        with self.__lock:
+            self.stats["rows"] += rows
+
+    # ----------------
+    #  endpoints
+    # ----------------
+
+    def fred_csv(self, series: list) -> str:
+        if self.__dates is None:
+            index = pd.date_range("1960-01-01", periods=self.fred_rows, freq="MS")
+            self.__dates = (index.strftime("%Y-%m-%d").tolist(), (index.asi8 // 10**9).astype(np.int64))
+        dates, times = self.__dates
+        columns = []
+        for name in series:
+            if name not in self.__fred:
+                values = synthetic_bars(name, times)["close"].map("{:.3f}".format)
+                values[np.arange(len(values)) % 97 == 96] = "."  # missing observations
+                self.__fred[name] = values.tolist()
+            columns.append(self.__fred[name])
+        rows = ["observation_date," + ",".join(series)]
+        rows += [",".join(row) for row in zip(dates, *columns)]
+        self.served(len(dates) * len(series))
+        return "\n".join(rows) + "\n"
+
+    def bybit_kline(self, query: dict) -> dict:
+        interval = str(query.get("interval", "D")).upper()
+        step = _intervals.get(interval) or int(interval) * 60
+        limit = max(1, min(int(query.get("limit", 200)), 1000))
+        first = -(-int(query.get("start", 0)) // 1000 // step) * step
+        last = min(int(query["end"]) // 1000 if "end" in query else self.last_time, self.last_time) // step * step
+        count = max(0, (last - first) // step + 1)
+        if "end" in query:
+            times = last - step * np.arange(min(limit, count))  # the newest bars before end
+        else:
+            times = first + step * np.arange(min(limit, count))[::-1]  # the oldest bars after start
+        if self.page_size:
+            times = times[: self.page_size]
+
+        bars = synthetic_bars(query.get("symbol", ""), times)
+        klines = [
+            [str(t * 1000), *(f"{v:.2f}" for v in row), f"{row[3] * row[4]:.2f}"]
+            for t, row in zip(times.tolist(), bars.to_numpy().tolist())
+        ]
+        self.served(len(klines))
+        result = {"category": query.get("category", "linear"), "symbol": query.get("symbol"), "list": klines}
+        return {"retCode": 0, "retMsg": "OK", "result": result, "retExtInfo": {}, "time": int(time.time() * 1000)}
+
+
+def _handler(stub: StubServer):
+    """helper function: request handler class of a stub"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # headers and body are written separately
+
+        def log_message(self, *args):
+            pass
+
+        def __reply(self, status: int, body: str, content_type: str):
+            data = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            query = dict(urllib.parse.parse_qsl(url.query))
+            admitted = stub.admit()
+
+            if url.path == "/fred/graph/fredgraph.csv":
+                if not admitted:
+                    return self.__reply(429, "Too Many Requests", "text/plain")
+                return self.__reply(200, stub.fred_csv(query.get("id", "").split(",")), "text/csv")
+
+            if url.path == "/bybit/v5/market/kline":
+                if not admitted:
+                    body = {"retCode": 10006, "retMsg": "Too many visits!", "result": {}, "retExtInfo": {}}
+                else:
+                    body = stub.bybit_kline(query)
+                return self.__reply(200, json.dumps(body), "application/json")
+
+            self.__reply(404, "Not Found", "text/plain")
+
+    return Handler
+
+
+def tv_recording(directory: str, n_bars: int = 1000, series: int = 1, bars_per_message: int = 500, step: int = 86400) -> str:
+    """Write a synthetic TradingView websocket session, replayed by `ReplayTransport(directory)`.
+
+    The session answers the first `get_hist_many` call of a new `TvDatafeed`: `series` symbols
+    (any names), `n_bars` bars each, `bars_per_message` bars per websocket message. Returns
+    the file written.
+    """
+    from .tv import _ws_url
+
+    chart, quote = "cs_" + "a" * 12, "qs_" + "a" * 12
+    times = (1_700_000_000 // step - np.arange(n_bars)[::-1]) * step
+
+    def message(func: str, params: list) -> str:
+        return frame({"m": func, "p": params})
+
+    def frame(data: dict) -> str:
+        payload = json.dumps(data, separators=(",", ":"))
+        return f"~m~{len(payload)}~m~{payload}"
+
+    events = [
+        {"send": message("chart_create_session", [chart, ""])},
+        {"send": message("quote_create_session", [quote])},
+        {"recv": frame({"session_id": "<0.0.0>", "timestamp": 1_700_000_000})},
+    ]
+    for number in range(1, series + 1):
+        values = synthetic_bars(f"SYM{number}", times).to_numpy().round(4).tolist()
+        for start in range(0, n_bars, bars_per_message):
+            bars = [{"i": i, "v": [int(times[i]), *values[i]]} for i in range(start, min(start + bars_per_message, n_bars))]
+            events.append({"recv": message("timescale_update", [chart, {f"s{number}": {"s": bars}}])})
+        events.append({"recv": message("series_completed", [chart, f"s{number}", "streaming"]) + "~m~4~m~~h~1"})
+
+    path = _Recording(directory).next_connection(_ws_url)
+    with open(path, "w") as f:
+        f.writelines(json.dumps(event) + "\n" for event in events)
+    return path
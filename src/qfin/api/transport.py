@@ -0,0 +1,323 @@
+"""
+Network access of the data providers: live, recorded or replayed.
+
+The providers of `qfin.api` do not open connections themselves, they go through the
+current transport:
+
+    http_get(url, params)                   fred (CSV)
+    call(provider, name, function, kwargs)  library calls (yfinance downloads, pybit klines)
+    connect(url, **options)                 websockets (tradingview)
+
+    LiveTransport:    the network, the urls / library calls can be redirected (i.e. to a `StubServer`)
+    RecordTransport:  the network, and every response is saved to a folder
+    ReplayTransport:  the saved responses, offline, with an optional latency
+
+A recording is a folder of files named by a hash of the request, so the same requests
+replay the same responses. Websocket sessions are replayed message by message, with the
+random TradingView session ids of the recording replaced by the new ones.
+
+i.e:
+    with use_transport(RecordTransport("./cassettes")):
+        fred("M2SL")
+        tv.get_hist("SPX", "SP")
+
+    with use_transport(ReplayTransport("./cassettes", latency=0.05)):  # offline
+        fred("M2SL")
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+_sessions = re.compile(r"\b[cq]s_[a-z]{12}\b")  # tradingview chart / quote session ids
+
+
+class TransportError(IOError):
+    """HTTP error status of a request."""
+
+    def __init__(self, url: str, status: int, body: bytes = b""):
+        super().__init__(f"HTTP {status} for {url}")
+        self.url = url
+        self.status = status
+        self.body = body
+
+
+def _key(*parts) -> str:
+    """helper function: file name of a request"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+
+def _query(url: str, params: dict = None) -> str:
+    params = {k: v for k, v in (params or {}).items() if v is not None}
+    return url if not params else url + ("&" if "?" in url else "?") + urllib.parse.urlencode(params)
+
+
+class Transport(ABC):
+    """Interface of the transports."""
+
+    @abstractmethod
+    def http_get(self, url: str, params: dict = None, headers: dict = None) -> bytes:
+        """Body of a GET request, raises `TransportError` on an error status."""
+
+    @abstractmethod
+    def call(self, provider: str, name: str, function, kwargs: dict):
+        """Result of `function(**kwargs)`, a download done by a library."""
+
+    @abstractmethod
+    def connect(self, url: str, **options):
+        """A websocket (send / recv / close / connected)."""
+
+    def get_text(self, url: str, params: dict = None, headers: dict = None) -> str:
+        return self.http_get(url, params, headers).decode()
+
+    def get_json(self, url: str, params: dict = None, headers: dict = None):
+        return json.loads(self.http_get(url, params, headers))
+
+
+class LiveTransport(Transport):
+    """The network."""
+
+    def __init__(self, redirects: dict = None, calls: dict = None, timeout: float = 30.0):
+        """
+        Args:
+            redirects (dict, optional): url prefix -> replacement, i.e. {"https://fred.stlouisfed.org": stub.url + "/fred"}.
+            calls (dict, optional): "provider.name" -> function called instead of the library, i.e. {"bybit.get_kline": ...}.
+            timeout (float, optional): seconds of the HTTP requests. Defaults to 30.
+        """
+        self.redirects = redirects or {}
+        self.calls = calls or {}
+        self.timeout = timeout
+
+    def url(self, url: str) -> str:
+        for prefix, target in self.redirects.items():
+            if url.startswith(prefix):
+                return target + url[len(prefix) :]
+        return url
+
+    def http_get(self, url: str, params: dict = None, headers: dict = None) -> bytes:
+        url = _query(self.url(url), params)
+        request = urllib.request.Request(url, headers=headers or {})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            raise TransportError(url, e.code, e.read()) from None
+
+    def call(self, provider: str, name: str, function, kwargs: dict):
+        return self.calls.get(f"{provider}.{name}", function)(**kwargs)
+
+    def connect(self, url: str, **options):
+        from websocket import create_connection
+
+        return create_connection(self.url(url), **options)
+
+
+class _Recording:
+    """helper class: the files of a recording folder"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.connections = {}  # url -> websockets opened so far
+
+    def path(self, kind: str, name: str) -> str:
+        folder = os.path.join(self.directory, kind)
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, name)
+
+    def next_connection(self, url: str) -> str:
+        with self.lock:
+            number = self.connections[url] = self.connections.get(url, 0) + 1
+        return self.path("ws", f"{_key(url)}-{number}.jsonl")
+
+
+class RecordTransport(Transport):
+    """The network through `inner`, saving every response to `directory`."""
+
+    def __init__(self, directory: str, inner: Transport = None):
+        self.inner = inner or LiveTransport()
+        self.recording = _Recording(directory)
+
+    def http_get(self, url: str, params: dict = None, headers: dict = None) -> bytes:
+        try:
+            body = self.inner.http_get(url, params, headers)
+        except TransportError as e:
+            self.__save(url, params, e.status, e.body)
+            raise
+        self.__save(url, params, 200, body)
+        return body
+
+    def __save(self, url: str, params: dict, status: int, body: bytes):
+        # bytes as latin-1 text round-trip exactly through JSON
+        record = {"url": url, "params": params, "status": status, "body": (body or b"").decode("latin-1")}
+        with open(self.recording.path("http", f"{_key(url, params)}.json"), "w") as f:
+            json.dump(record, f)
+
+    def call(self, provider: str, name: str, function, kwargs: dict):
+        result = self.inner.call(provider, name, function, kwargs)
+        with open(self.recording.path("call", f"{provider}.{name}.{_key(provider, name, kwargs)}.pkl"), "wb") as f:
+            pickle.dump(result, f)
+        return result
+
+    def connect(self, url: str, **options):
+        return _RecordingSocket(self.inner.connect(url, **options), self.recording.next_connection(url))
+
+
+class _RecordingSocket:
+    """helper class: a websocket writing what it sends and receives, one JSON line per message
+
+    The file is opened for each message, so no file stays open whether the socket is closed or not.
+    """
+
+    def __init__(self, ws, path: str):
+        self.ws = ws
+        self.path = path
+        self.closed = False
+        with open(path, "w"):
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self.ws, name)
+
+    def __write(self, kind: str, message: str):
+        if not self.closed:
+            with open(self.path, "a") as f:
+                f.write(json.dumps({kind: message}) + "\n")
+
+    def send(self, message, *args, **kwargs):
+        self.__write("send", message)
+        return self.ws.send(message, *args, **kwargs)
+
+    def recv(self):
+        message = self.ws.recv()
+        self.__write("recv", message)
+        return message
+
+    def close(self, *args, **kwargs):
+        self.closed = True
+        return self.ws.close(*args, **kwargs)
+
+
+class ReplayTransport(Transport):
+    """The responses saved by a `RecordTransport`, without network."""
+
+    def __init__(self, directory: str, latency: float = 0.0):
+        """
+        Args:
+            directory (str): recording folder.
+            latency (float, optional): seconds added to every response / websocket message. Defaults to 0.
+        """
+        self.recording = _Recording(directory)
+        self.latency = latency
+
+    def __missing(self, what: str):
+        return LookupError(f"{what} was not recorded in {self.recording.directory}, record it with RecordTransport")
+
+    def http_get(self, url: str, params: dict = None, headers: dict = None) -> bytes:
+        path = os.path.join(self.recording.directory, "http", f"{_key(url, params)}.json")
+        if not os.path.exists(path):
+            raise self.__missing(_query(url, params))
+        with open(path) as f:
+            record = json.load(f)
+        if self.latency:
+            time.sleep(self.latency)
+        body = record["body"].encode("latin-1")
+        if record["status"] != 200:
+            raise TransportError(url, record["status"], body)
+        return body
+
+    def call(self, provider: str, name: str, function, kwargs: dict):
+        path = os.path.join(self.recording.directory, "call", f"{provider}.{name}.{_key(provider, name, kwargs)}.pkl")
+        if not os.path.exists(path):
+            raise self.__missing(f"{provider}.{name}({kwargs})")
+        if self.latency:
+            time.sleep(self.latency)
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def connect(self, url: str, **options):
+        path = self.recording.next_connection(url)
+        if not os.path.exists(path):
+            raise self.__missing(f"websocket {url} #{os.path.basename(path).rsplit('-', 1)[1].split('.')[0]}")
+        with open(path) as f:
+            events = [json.loads(line) for line in f]
+        return _ReplaySocket(events, self.latency, options.get("timeout"))
+
+
+class _ReplaySocket:
+    """helper class: a websocket returning the recorded messages in order"""
+
+    def __init__(self, events: list, latency: float, timeout: float = None):
+        self.messages = [event["recv"] for event in events if "recv" in event]
+        self.recorded_sessions = []  # session ids in the order the recording sent them
+        for event in events:
+            for session in _sessions.findall(event.get("send", "")):
+                if session not in self.recorded_sessions:
+                    self.recorded_sessions.append(session)
+        self.sessions = {}  # recorded session id -> session id of this replay
+        self.latency = latency
+        self.timeout = timeout
+        self.position = 0
+        self.connected = True
+
+    def send(self, message, *args, **kwargs):
+        for session in _sessions.findall(message):
+            if session not in self.sessions.values() and len(self.sessions) < len(self.recorded_sessions):
+                self.sessions[self.recorded_sessions[len(self.sessions)]] = session
+
+    def recv(self) -> str:
+        from websocket import WebSocketConnectionClosedException, WebSocketTimeoutException
+
+        if not self.connected:
+            raise WebSocketConnectionClosedException("socket is already closed.")
+        if self.position >= len(self.messages):
+            # end of the recording: a quiet connection
+            time.sleep(min(self.timeout or 0.05, 0.05))
+            raise WebSocketTimeoutException("end of the recording")
+        if self.latency:
+            time.sleep(self.latency)
+        message = self.messages[self.position]
+        self.position += 1
+        if self.sessions:
+            message = _sessions.sub(lambda m: self.sessions.get(m.group(0), m.group(0)), message)
+        return message
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def close(self, *args, **kwargs):
+        self.connected = False
+
+
+_transport = LiveTransport()
+
+
+def get_transport() -> Transport:
+    """The transport used by the providers."""
+    return _transport
+
+
+def set_transport(transport: Transport) -> Transport:
+    """Use `transport` for every provider call (all threads), return the previous one."""
+    global _transport
+    previous, _transport = _transport, transport or LiveTransport()
+    return previous
+
+
+@contextmanager
+def use_transport(transport: Transport):
+    """Use `transport` inside a with block."""
+    previous = set_transport(transport)
+    try:
+        yield transport
+    finally:
+        set_transport(previous)
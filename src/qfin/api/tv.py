@@ -3,20 +3,32 @@
 # https://github.com/rongardF/tvdatafeed
 # ========================================
 
+import asyncio
+import copy
 import datetime
 import enum
+import itertools
 import json
 import logging
 import random
 import re
 import string
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
 
+import numpy as np
 import pandas as pd
-import requests
-from websocket import create_connection
+from dateutil.tz import tzlocal
+from websocket import WebSocketException, WebSocketTimeoutException
+
+from .transport import get_transport
 
 logger = logging.getLogger(__name__)
 
+_ws_url = "wss://data.tradingview.com/socket.io/websocket"
+
 
 class Interval(enum.Enum):
     in_1_minute = "1"
@@ -42,6 +54,32 @@ class TvDatafeed:
     __ws_headers = json.dumps({"Origin": "https://data.tradingview.com"})
     __signin_headers = {"Referer": "https://www.tradingview.com"}
     __ws_timeout = 5
+    __max_reconnects = 3
+    __quote_fields = (
+        "ch",
+        "chp",
+        "current_session",
+        "description",
+        "local_description",
+        "language",
+        "exchange",
+        "fractional",
+        "is_tradable",
+        "lp",
+        "lp_time",
+        "minmov",
+        "minmove2",
+        "original_name",
+        "pricescale",
+        "pro_name",
+        "short_name",
+        "type",
+        "update_mode",
+        "volume",
+        "currency_code",
+        "rchp",
+        "rtc",
+    )
 
     def __init__(
         self,
@@ -66,12 +104,31 @@ class TvDatafeed:
         self.ws = None
         self.session = self.__generate_session()
         self.chart_session = self.__generate_chart_session()
+        self.__lock = threading.RLock()
+        self.__series_numbers = itertools.count()  # series / symbol ids are never reused on a chart session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close the websocket connection, a new one is opened on the next request."""
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            except (WebSocketException, OSError) as e:
+                logger.debug(f"error while closing the websocket: {e!r}")
+        self.ws = None
 
     def __auth(self, username, password):
         if username is None or password is None:
             token = None
 
         else:
+            import requests
+
             data = {"username": username, "password": password, "remember": "on"}
             try:
                 response = requests.post(url=self.__sign_in_url, data=data, headers=self.__signin_headers)
@@ -83,10 +140,36 @@ class TvDatafeed:
         return token
 
     def __create_connection(self):
-        logging.debug("creating websocket connection")
-        self.ws = create_connection(
-            "wss://data.tradingview.com/socket.io/websocket", headers=self.__ws_headers, timeout=self.__ws_timeout
-        )
+        logger.debug("creating websocket connection")
+        self.ws = get_transport().connect(_ws_url, headers=self.__ws_headers, timeout=self.__ws_timeout)
+        self.__parser = _FrameParser()
+        self.session = self.__generate_session()
+        self.chart_session = self.__generate_chart_session()
+
+        # session setup is sent once per connection, the sessions are reused by every request
+        self.__send_message("set_auth_token", [self.token])
+        self.__send_message("chart_create_session", [self.chart_session, ""])
+        self.__send_message("switch_timezone", [self.chart_session, "exchange"])
+        self.__send_message("quote_create_session", [self.session])
+        self.__send_message("quote_set_fields", [self.session, *self.__quote_fields])
+
+    def __ensure_connection(self):
+        if self.ws is None or not self.ws.connected:
+            self.close()
+            self.__create_connection()
+
+    def __read_frames(self):
+        """Receive one websocket message and return its decoded frames, answering heartbeats (keepalive)."""
+        frames = []
+        for payload in self.__parser.feed(self.ws.recv()):
+            if payload.startswith("~h~"):
+                self.ws.send(self.__prepend_header(payload))
+                continue
+            try:
+                frames.append(json.loads(payload))
+            except ValueError:
+                logger.debug(f"skipping undecodable frame: {payload[:80]}")
+        return frames
 
     @staticmethod
     def __filter_raw_message(text):
@@ -129,43 +212,6 @@ class TvDatafeed:
             print(m)
         self.ws.send(m)
 
-    @staticmethod
-    def __create_df(raw_data, symbol):
-        try:
-            out = re.search('"s":\[(.+?)\}\]', raw_data).group(1)
-            x = out.split(',{"')
-            data = list()
-            volume_data = True
-
-            for xi in x:
-                xi = re.split("\[|:|,|\]", xi)
-                ts = datetime.datetime.fromtimestamp(float(xi[4]))
-
-                row = [ts]
-
-                for i in range(5, 10):
-                    # skip converting volume data if does not exists
-                    if not volume_data and i == 9:
-                        row.append(0.0)
-                        continue
-                    try:
-                        row.append(float(xi[i]))
-
-                    except ValueError:
-                        volume_data = False
-                        row.append(0.0)
-                        logger.debug("no volume data")
-
-                data.append(row)
-
-            data = pd.DataFrame(data, columns=["datetime", "open", "high", "low", "close", "volume"]).set_index(
-                "datetime"
-            )
-            data.insert(0, "symbol", value=symbol)
-            return data
-        except AttributeError:
-            logger.error("no data, please check the exchange and symbol")
-
     @staticmethod
     def __format_symbol(symbol, exchange, contract: int = None):
         if ":" in symbol:
@@ -203,78 +249,520 @@ class TvDatafeed:
         Returns:
             pd.Dataframe: dataframe with sohlcv as columns
         """
-        symbol = self.__format_symbol(symbol=symbol, exchange=exchange, contract=fut_contract)
+        return self.get_hist_many(
+            [symbol],
+            exchange=exchange,
+            interval=interval,
+            n_bars=n_bars,
+            fut_contract=fut_contract,
+            extended_session=extended_session,
+        )[0]
+
+    def get_hist_many(
+        self,
+        requests: list,
+        exchange: str = "NSE",
+        interval: Interval = Interval.in_daily,
+        n_bars: int = 10,
+        fut_contract: int = None,
+        extended_session: bool = False,
+        max_in_flight: int = 20,
+    ) -> list:
+        """get historical data for many symbols over the same websocket
 
-        interval = interval.value
+        The series are multiplexed on one chart session, at most `max_in_flight` at a time,
+        and each response is routed back to its request by series id.
 
-        self.__create_connection()
+        Args:
+            requests (list): symbols (str) or dicts with `get_hist` arguments, missing keys take the defaults below.
+            exchange (str, optional): default exchange. Defaults to 'NSE'.
+            interval (Interval, optional): default chart interval. Defaults to daily.
+            n_bars (int, optional): default no of bars to download, max 5000. Defaults to 10.
+            fut_contract (int, optional): default futures contract. Defaults to None.
+            extended_session (bool, optional): default session. Defaults to False.
+            max_in_flight (int, optional): max series requested at the same time. Defaults to 20.
 
-        self.__send_message("set_auth_token", [self.token])
-        self.__send_message("chart_create_session", [self.chart_session, ""])
-        self.__send_message("quote_create_session", [self.session])
-        self.__send_message(
-            "quote_set_fields",
-            [
-                self.session,
-                "ch",
-                "chp",
-                "current_session",
-                "description",
-                "local_description",
-                "language",
-                "exchange",
-                "fractional",
-                "is_tradable",
-                "lp",
-                "lp_time",
-                "minmov",
-                "minmove2",
-                "original_name",
-                "pricescale",
-                "pro_name",
-                "short_name",
-                "type",
-                "update_mode",
-                "volume",
-                "currency_code",
-                "rchp",
-                "rtc",
-            ],
+        Returns:
+            list: one dataframe per request, in request order (None when there is no data)
+        """
+        defaults = dict(
+            exchange=exchange,
+            interval=interval,
+            n_bars=n_bars,
+            fut_contract=fut_contract,
+            extended_session=extended_session,
         )
 
-        self.__send_message("quote_add_symbols", [self.session, symbol, {"flags": ["force_permission"]}])
-        self.__send_message("quote_fast_symbols", [self.session, symbol])
+        series = self.__build_series(requests, defaults)
+
+        with self.__lock:
+            self.__run_series(series, max_in_flight)
+
+        for s in series:
+            if not len(s.bars):
+                logger.error(f"no data for {s.symbol}, please check the exchange and symbol")
+
+        return [s.bars.to_frame(s.symbol) if len(s.bars) else None for s in series]
+
+    def subscribe(
+        self,
+        requests,
+        exchange: str = "NSE",
+        interval: Interval = Interval.in_1_minute,
+        n_bars: int = 2,
+        fut_contract: int = None,
+        extended_session: bool = False,
+        max_pending: int = 1000,
+    ) -> "TvSubscription":
+        """subscribe to real-time bars
+
+        The series stay open on a dedicated connection and every bar update pushed by
+        TradingView (`du` messages) is delivered as a `TvBar`. Iterate the subscription
+        (for / async for) and close it when done.
 
+        Args:
+            requests (str | list): a symbol, or symbols / dicts with `get_hist` arguments.
+            exchange (str, optional): default exchange. Defaults to 'NSE'.
+            interval (Interval, optional): default chart interval. Defaults to 1 minute.
+            n_bars (int, optional): history bars sent first, all but the last one as closed bars. Defaults to 2.
+            fut_contract (int, optional): default futures contract. Defaults to None.
+            extended_session (bool, optional): default session. Defaults to False.
+            max_pending (int, optional): max bars waiting for the consumer before the reader blocks. Defaults to 1000.
+
+        Returns:
+            TvSubscription: iterator of TvBar
+        """
+        requests = [requests] if isinstance(requests, (str, dict)) else requests
+        defaults = dict(
+            exchange=exchange,
+            interval=interval,
+            n_bars=n_bars,
+            fut_contract=fut_contract,
+            extended_session=extended_session,
+        )
+        return TvSubscription(self.__clone(), self.__build_series(requests, defaults), max_pending=max_pending)
+
+    def __clone(self):
+        """A feed with the same credentials and its own connection."""
+        feed = copy.copy(self)
+        feed.ws = None
+        feed.__lock = threading.RLock()
+        return feed
+
+    def __build_series(self, requests, defaults):
+        series = []
+        for request in requests:
+            request = {"symbol": request} if isinstance(request, str) else request
+            args = {**defaults, **request}
+            symbol = self.__format_symbol(symbol=args["symbol"], exchange=args["exchange"], contract=args["fut_contract"])
+            number = next(self.__series_numbers)
+            series.append(_Series(number, symbol, args["interval"], args["n_bars"], args["extended_session"]))
+        return series
+
+    def _stream(self, series, on_bars, stop: threading.Event):
+        """Keep the series open and pass every bar update to `on_bars(series, bars)` until `stop` is set."""
+        by_id = {s.series_id: s for s in series}
+        reconnects = 0
+
+        with self.__lock:
+            while not stop.is_set():
+                try:
+                    if self.ws is None or not self.ws.connected:
+                        self.__ensure_connection()
+                        for s in series:
+                            self.__request_series(s)
+                    frames = self.__read_frames()
+                    reconnects = 0
+                except WebSocketTimeoutException:
+                    # quiet market, the heartbeats keep the connection alive
+                    continue
+                except (WebSocketException, OSError) as e:
+                    if stop.is_set():
+                        break
+                    logger.warning(f"websocket error: {e!r}")
+                    self.close()
+                    reconnects += 1
+                    if reconnects > self.__max_reconnects:
+                        raise
+                    time.sleep(min(2**reconnects, 30))
+                    continue
+
+                for frame in frames:
+                    func = frame.get("m")
+                    params = frame.get("p") or []
+
+                    if func in ("timescale_update", "du"):
+                        for series_id, update in params[1].items():
+                            s = by_id.get(series_id)
+                            if s is not None and isinstance(update, dict) and update.get("s"):
+                                on_bars(s, update["s"])
+
+                    elif func in ("symbol_error", "series_error"):
+                        logger.error(f"{func}: {params[1:]}")
+
+                    elif func in ("critical_error", "protocol_error"):
+                        logger.error(f"{func}: {params}")
+                        self.close()
+
+            self.close()
+
+    def __run_series(self, series, max_in_flight):
+        pending = list(reversed(series))
+        in_flight = {}
+        reconnects = 0
+
+        def submit():
+            while pending and len(in_flight) < max_in_flight:
+                s = pending.pop()
+                s.bars = _BarColumns(s.n_bars)
+                in_flight[s.series_id] = s
+                self.__request_series(s)
+
+        while pending or in_flight:
+            try:
+                self.__ensure_connection()
+                submit()
+                frames = self.__read_frames()
+            except WebSocketTimeoutException as e:
+                # the series in flight fail (no partial bars), and are removed from the chart session
+                logger.error(f"{e}: no response for {[s.symbol for s in in_flight.values()]}")
+                for s in in_flight.values():
+                    self.__fail_series(s, remove=True)
+                in_flight.clear()
+                continue
+            except (WebSocketException, OSError) as e:
+                # dropped connection: reconnect and ask again for the series in flight
+                logger.warning(f"websocket error: {e!r}")
+                self.close()
+                reconnects += 1
+                if reconnects > self.__max_reconnects:
+                    logger.error("too many reconnects, giving up")
+                    for s in [*pending, *in_flight.values()]:
+                        self.__fail_series(s)
+                    break
+                pending.extend(in_flight.values())
+                in_flight.clear()
+                continue
+
+            for frame in frames:
+                self.__route_frame(frame, in_flight)
+
+    def __fail_series(self, s, remove: bool = False):
+        """helper function: drop the bars received for a series, and remove it from the chart session"""
+        s.bars = _BarColumns(0)
+        if remove:
+            try:
+                self.__send_message("remove_series", [self.chart_session, s.series_id])
+            except (WebSocketException, OSError):
+                self.close()
+
+    def __request_series(self, s):
+        logger.debug(f"getting data for {s.symbol}...")
+        self.__send_message("quote_add_symbols", [self.session, s.symbol, {"flags": ["force_permission"]}])
+        self.__send_message("quote_fast_symbols", [self.session, s.symbol])
         self.__send_message(
             "resolve_symbol",
             [
                 self.chart_session,
-                "symbol_1",
+                s.symbol_id,
                 '={"symbol":"'
-                + symbol
+                + s.symbol
                 + '","adjustment":"splits","session":'
-                + ('"regular"' if not extended_session else '"extended"')
+                + ('"regular"' if not s.extended_session else '"extended"')
                 + "}",
             ],
         )
         self.__send_message(
             "create_series",
-            [self.chart_session, "s1", "s1", "symbol_1", interval, n_bars],
+            [self.chart_session, s.series_id, s.series_id, s.symbol_id, s.interval.value, s.n_bars],
         )
-        self.__send_message("switch_timezone", [self.chart_session, "exchange"])
 
-        raw_data = ""
+    def __route_frame(self, frame, in_flight):
+        func = frame.get("m")
+        params = frame.get("p") or []
+
+        if func == "timescale_update":
+            for series_id, update in params[1].items():
+                s = in_flight.get(series_id)
+                if s is not None and isinstance(update, dict):
+                    s.bars.add(update.get("s", []))
+
+        elif func == "series_completed":
+            s = in_flight.pop(params[1], None)
+            if s is not None:
+                self.__send_message("remove_series", [self.chart_session, s.series_id])
+
+        elif func in ("symbol_error", "series_error"):
+            for s in list(in_flight.values()):
+                if params[1] in (s.symbol_id, s.series_id):
+                    logger.error(f"{func} for {s.symbol}: {params[2:]}")
+                    s.bars = _BarColumns(0)
+                    in_flight.pop(s.series_id)
+
+        elif func in ("critical_error", "protocol_error"):
+            logger.error(f"{func}: {params}")
+            raise WebSocketException(func)
+
+
+class TvBar(NamedTuple):
+    """A real-time bar. `closed` is False while the bar is still forming."""
+
+    symbol: str
+    datetime: datetime.datetime
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    closed: bool
+
+
+class TvSubscription:
+    """Stream of real-time bars, see `TvDatafeed.subscribe`.
+
+    A reader thread keeps the websocket open and pushes bars into a bounded queue.
+    Updates of a bar still waiting in the queue are coalesced into the latest one,
+    and the reader blocks (backpressure) when `max_pending` closed bars are waiting.
+    """
+
+    def __init__(self, feed: TvDatafeed, series: list, max_pending: int = 1000):
+        self.feed = feed
+        self.series = series
+        self.error = None
+        self.__last = {}  # series_id -> (time, row) of the forming bar
+        self.__queue = _CoalescingQueue(max_pending)
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name="qfin-tv-subscription", daemon=True)
+        self.__thread.start()
+
+    def __run(self):
+        try:
+            self.feed._stream(self.series, self.__on_bars, self.__stop)
+        except Exception as e:
+            # raised again by get() in the consumer thread
+            logger.exception("subscription stopped")
+            self.error = e
+        finally:
+            self.__queue.close()
+
+    def __on_bars(self, s, bars):
+        last_time, last_row = self.__last.get(s.series_id, (None, None))
+
+        for bar in bars:
+            row = bar["v"]
+            ts = row[0]
+            if last_time is not None and ts < last_time:
+                # history sent again after a reconnect
+                continue
+            if last_time is not None and ts > last_time:
+                self.__put(s, last_row, closed=True)
+            last_time, last_row = ts, row
+
+        self.__last[s.series_id] = (last_time, last_row)
+        self.__put(s, last_row, closed=False)
+
+    def __put(self, s, row, closed):
+        volume = float(row[5]) if len(row) > 5 and row[5] is not None else 0.0
+        bar = TvBar(s.symbol, datetime.datetime.fromtimestamp(row[0]), *map(float, row[1:5]), volume, closed)
+        # a closed bar supersedes its last forming update still waiting in the queue
+        replaces = (s.series_id, row[0], False) if closed else None
+        self.__queue.put((s.series_id, row[0], closed), bar, self.__stop, replaces=replaces)
+
+    def get(self, timeout: float = None) -> TvBar:
+        """Next bar, or None on timeout. Raises StopIteration once the subscription is closed."""
+        try:
+            return self.__queue.get(timeout)
+        except StopIteration:
+            if self.error is not None:
+                raise self.error
+            raise
+
+    def close(self):
+        """Stop the reader thread and close the connection."""
+        self.__stop.set()
+        self.feed.close()
+        self.__queue.close()
+        if self.__thread is not threading.current_thread():
+            self.__thread.join(timeout=10)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> TvBar:
+        while True:
+            bar = self.get(timeout=1.0)
+            if bar is not None:
+                return bar
+
+    def __aiter__(self):
+        return self
 
-        logger.debug(f"getting data for {symbol}...")
+    async def __anext__(self) -> TvBar:
+        loop = asyncio.get_running_loop()
         while True:
             try:
-                result = self.ws.recv()
-                raw_data = raw_data + result + "\n"
-            except Exception as e:
-                logger.error(e)
+                bar = await loop.run_in_executor(None, self.get, 1.0)
+            except StopIteration:
+                raise StopAsyncIteration
+            if bar is not None:
+                return bar
+
+
+class _CoalescingQueue:
+    """Bounded FIFO where an item put with a key already waiting replaces the waiting one."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, key, item, stop: threading.Event, replaces=None):
+        with self.condition:
+            if replaces is not None:
+                self.items.pop(replaces, None)
+            if key in self.items:
+                self.items[key] = item
+                return
+            while len(self.items) >= self.maxsize and not self.closed and not stop.is_set():
+                self.condition.wait(0.5)
+            if self.closed:
+                return
+            self.items[key] = item
+            self.condition.notify_all()
+
+    def get(self, timeout: float = None):
+        with self.condition:
+            if not self.items and not self.closed:
+                self.condition.wait(timeout)
+            if self.items:
+                _, item = self.items.popitem(last=False)
+                self.condition.notify_all()
+                return item
+            if self.closed:
+                raise StopIteration
+            return None
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class _Series:
+    """A requested series and the bars received for it."""
+
+    def __init__(self, number, symbol, interval, n_bars, extended_session):
+        self.symbol = symbol
+        self.symbol_id = f"symbol_{number + 1}"
+        self.series_id = f"s{number + 1}"
+        self.interval = interval
+        self.n_bars = n_bars
+        self.extended_session = extended_session
+        self.bars = _BarColumns(0)
+
+
+class _FrameParser:
+    """Incremental parser for the `~m~<len>~m~<payload>` framing.
+
+    Each call to `feed` scans only the new data once and keeps an incomplete
+    trailing frame for the next call, so the cost is linear in the bytes received.
+    """
+
+    __header = "~m~"
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, data: str) -> list:
+        """Add received data and return the payloads of the complete frames."""
+        buffer = self.buffer + data if self.buffer else data
+        payloads = []
+        pos = 0
+        size = len(buffer)
+
+        while pos < size:
+            if not buffer.startswith(self.__header, pos):
+                # out of sync: skip to the next header
+                pos = buffer.find(self.__header, pos + 1)
+                if pos < 0:
+                    pos = size
+                continue
+
+            length_end = buffer.find(self.__header, pos + 3)
+            if length_end < 0:
                 break
-
-            if "series_completed" in result:
+            try:
+                length = int(buffer[pos + 3 : length_end])
+            except ValueError:
+                pos = length_end
+                continue
+
+            start = length_end + 3
+            end = start + length
+            if end > size:
                 break
 
-        return self.__create_df(raw_data, symbol)
+            payloads.append(buffer[start:end])
+            pos = end
+
+        self.buffer = buffer[pos:] if pos < size else ""
+        return payloads
+
+
+class _BarColumns:
+    """OHLCV columns of a series, written straight into preallocated arrays.
+
+    Bars are placed by their index `i`, so repeated updates of the same bar overwrite it.
+    """
+
+    columns = ("open", "high", "low", "close", "volume")
+
+    def __init__(self, capacity: int):
+        self.values = np.full((max(capacity, 0), 6), np.nan)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, bars: list):
+        """Store the `s` array of a timescale_update: [{"i": 0, "v": [time, open, high, low, close, volume]}, ...]"""
+        if not bars:
+            return
+
+        index = np.fromiter((bar["i"] for bar in bars), dtype=np.int64, count=len(bars))
+        rows = [bar["v"] for bar in bars]
+        try:
+            values = np.array(rows, dtype=np.float64)
+        except ValueError:
+            # rows of different lengths (no volume data)
+            values = np.full((len(rows), 6), np.nan)
+            for k, row in enumerate(rows):
+                values[k, : len(row)] = np.array(row[:6], dtype=np.float64)
+
+        needed = int(index.max()) + 1
+        if needed > len(self.values):
+            grown = np.full((max(needed, 2 * len(self.values)), 6), np.nan)
+            grown[: len(self.values)] = self.values
+            self.values = grown
+
+        self.values[index, : values.shape[1]] = values[:, :6]
+        self.size = max(self.size, needed)
+
+    def to_frame(self, symbol: str) -> pd.DataFrame:
+        values = self.values[: self.size]
+        values = values[~np.isnan(values[:, 0])]
+        values[:, 5] = np.nan_to_num(values[:, 5], nan=0.0)
+
+        index = pd.to_datetime(values[:, 0], unit="s", utc=True).tz_convert(tzlocal()).tz_localize(None)
+        index.name = "datetime"
+
+        data = pd.DataFrame(values[:, 1:], index=index, columns=list(self.columns))
+        data.insert(0, "symbol", value=symbol)
+        return data
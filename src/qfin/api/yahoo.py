@@ -1,4 +1,17 @@
-import yfinance as yf
+import numpy as np
+import pandas as pd
+
+from ..data.panel import Panel
+from .transport import get_transport
+
+_yahoo_fields = {
+    "open": "Open",
+    "high": "High",
+    "low": "Low",
+    "close": "Close",
+    "adj_close": "Adj Close",
+    "volume": "Volume",
+}
 
 
 def yahoo(
@@ -12,8 +25,10 @@ def yahoo(
     progress=False,
     group_by="ticker",
 ):
-    yf_data = yf.download(
-        ticker,
+    import yfinance as yf
+
+    kwargs = dict(
+        tickers=ticker,
         start=start,
         end=end,
         group_by=group_by,
@@ -22,6 +37,7 @@ def yahoo(
         interval=interval,
         period=period,  # use "period" instead of start/end
     )
+    yf_data = get_transport().call("yahoo", "download", yf.download, kwargs)
 
     if lowercase:
         yf_data.drop(["Adj Close"], axis=1, level=1, inplace=True)
@@ -32,3 +48,69 @@ def yahoo(
         return yf_data[ticker]
     else:
         return yf_data
+
+
+def yahoo_panel(
+    tickers,
+    start=None,
+    end=None,
+    interval="1d",
+    period="max",
+    auto_adjust=False,
+    fields=("open", "high", "low", "close", "volume"),
+    dtype=np.float64,
+    batch_size=100,
+    progress=False,
+):
+    """Download many tickers into one aligned Panel (field x time x symbol).
+
+    Tickers are downloaded `batch_size` at a time and each batch is copied into the
+    panel right after its download, so the wide yfinance frame is never held for the
+    whole universe. The panel is allocated with the first batch and only grows (one copy)
+    when a batch brings dates the others do not have.
+
+    fields: any of open, high, low, close, adj_close, volume
+    """
+    import yfinance as yf
+
+    tickers = [tickers] if isinstance(tickers, str) else list(dict.fromkeys(tickers))
+    columns = [_yahoo_fields[field] for field in fields]
+    index, panel = None, None
+
+    for offset in range(0, len(tickers), batch_size):
+        batch = tickers[offset : offset + batch_size]
+        kwargs = dict(
+            tickers=batch,
+            start=start,
+            end=end,
+            group_by="column",
+            auto_adjust=auto_adjust,
+            progress=progress,
+            interval=interval,
+            period=period,
+            multi_level_index=True,
+        )
+        yf_data = get_transport().call("yahoo", "download", yf.download, kwargs)
+        # (field x time x symbol) for this batch, missing tickers/fields stay NaN
+        yf_data = yf_data.reindex(columns=pd.MultiIndex.from_product([columns, batch]))
+
+        if index is None:
+            index = yf_data.index
+            panel = np.full((len(columns), len(index), len(tickers)), np.nan, dtype=dtype)
+        elif not yf_data.index.isin(index).all():
+            # new dates: move the rows already written onto the union of the indexes
+            union = index.union(yf_data.index)
+            grown = np.full((len(columns), len(union), len(tickers)), np.nan, dtype=dtype)
+            grown[:, union.get_indexer(index), :] = panel
+            index, panel = union, grown
+            del grown
+
+        values = yf_data.to_numpy(dtype=dtype).reshape(len(yf_data), len(columns), len(batch)).transpose(1, 0, 2)
+        panel[:, index.get_indexer(yf_data.index), offset : offset + len(batch)] = values
+        del yf_data, values
+
+    if index is None:
+        index, panel = pd.DatetimeIndex([]), np.full((len(columns), 0, len(tickers)), np.nan, dtype=dtype)
+    index = index.rename("date")
+
+    return Panel(index, tickers, list(fields), panel)
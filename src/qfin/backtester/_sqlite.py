@@ -0,0 +1,23 @@
+"""
+SQLite helpers shared by the sweep queue and the experiment store.
+
+i.e:
+    with Transaction(db) as db:
+        db.execute("UPDATE ...")
+"""
+
+import sqlite3
+
+
+class Transaction:
+    """BEGIN IMMEDIATE ... COMMIT / ROLLBACK, the write lock is taken at the start."""
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
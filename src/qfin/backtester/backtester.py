@@ -5,13 +5,23 @@ It provides a way to run backtesting on historical data, perform trades,
 and calculate profit/loss.
 """
 
+import os
+import shutil
+import tempfile
+import weakref
 from typing import List
 
 import numpy as np
 import pandas as pd
 
-from .plot import plot_basic, plot_thumbnail
+from .events import event_bars
+from .history import dense, new_history
+from .orders import LIMIT, STOP, STOP_LOSS, TAKE_PROFIT, TRAILING, OrderBook
+from .positions import PositionStore
+from .profiling import Profiler
+from .stats import excursions as _excursions
 from .stats import stats
+from .timeframes import Timeframe
 
 
 class Trade:
@@ -30,6 +40,7 @@ class Trade:
         self.exit_bar: int = None
         self.exit_time: str = None
         self.exit_commission: float = 0.0
+        self.slot: int = None  # slot in the account PositionStore while open
 
     @property
     def pl_value(self):
@@ -65,6 +76,10 @@ class Params:
     Configuration parameters for the backtester.
 
     These parameters control various aspects of the backtesting process.
+
+    `history_dir`: every run writes its memory-mapped histories to a new run-* folder of
+    `history_dir`, deleted with the `Broker` of the run (garbage collected, or at exit)
+    unless `keep_history` is True.
     """
 
     def __init__(
@@ -74,13 +89,28 @@ class Params:
         commission: float = 0.01,  # Default commission rate
         default_entry_value: float = 1,  # Between 0.01 and 1 (percent)
         default_entry_value_max: float = 1000000.0,
+        copy: bool = True,  # False: use the dataset as given (i.e. views of a Panel), it is never modified
+        timeframes: dict = None,  # higher timeframes, name -> rule (i.e. {"h4": "4h"})
+        hedging: bool = False,  # True: several positions can be open at once
+        history_dtype="float64",  # dtype of the balance / equity / commission histories
+        history_dir: str = None,  # memory-mapped history files in a new run-* folder of this folder
+        sparse_history: bool = False,  # record only the bars where the history values change
+        keep_history: bool = False,  # True: the run-* folders of history_dir are not deleted
     ) -> None:
-        self.dataset = dataset.copy()
+        self.dataset = dataset.copy() if copy else dataset
         self.initial_balance = initial_balance
         self.commission = commission
         self.default_entry_value = default_entry_value
         self.default_entry_value_max = default_entry_value_max
         self.close_column = "close"
+        if isinstance(timeframes, (list, tuple)):
+            timeframes = {rule: rule for rule in timeframes}
+        self.timeframes = timeframes or {}
+        self.hedging = hedging
+        self.history_dtype = np.dtype(history_dtype)
+        self.history_dir = history_dir
+        self.sparse_history = sparse_history
+        self.keep_history = keep_history
 
 
 class BrokerState:
@@ -92,6 +122,7 @@ class BrokerState:
 
     def __init__(self, current_bar: int, is_last_bar: bool, last_price: float, total_bar: int):
         self.data = []
+        self.time = None  # index label of the current bar
         self.current_bar = current_bar
         self.is_last_bar = is_last_bar
         self.last_price = last_price
@@ -112,27 +143,41 @@ class BrokerAccount:
         self.params: Params = params
         self.balance: float = params.initial_balance
         self.equity: float = params.initial_balance
-        self.hedging: bool = False  # opening multiple positions
-        self.netting: bool = True  # opening one position
-        self.opened_trades: List[Trade] = []
+        self.hedging: bool = params.hedging  # opening multiple positions
+        self.netting: bool = not params.hedging  # opening one position
+        self.opened_trades: PositionStore = PositionStore()
         self.closed_trades: List[Trade] = []
-        self.history_balance: np.ndarray = np.tile(params.initial_balance, len(params.dataset))
-        self.history_equity: np.ndarray = np.tile(params.initial_balance, len(params.dataset))
-        self.history_commission: np.ndarray = np.tile(0, len(params.dataset))
+        self.closed_commission: float = 0  # commissions of the closed trades
+        self.history_balance: np.ndarray = broker.new_history("balance", params.initial_balance)
+        self.history_equity: np.ndarray = broker.new_history("equity", params.initial_balance)
+        self.history_commission: np.ndarray = broker.new_history("commission", 0.0)
         self.commission_spent: float = 0
+        self.orders: OrderBook = OrderBook(self)
 
     def refresh_values(self):
-        self.commission_spent = sum(trade.commissions for trade in self.opened_trades)
-        self.commission_spent += sum(trade.commissions for trade in self.closed_trades)
-        self.equity = round(self.balance + sum(trade.pl_value - trade.commissions for trade in self.opened_trades), 2)
+        self.commission_spent = self.opened_trades.commissions() + self.closed_commission
+        self.equity = round(self.balance + self.opened_trades.open_value(self.broker.state.last_price), 2)
         self.history_balance[self.broker.state.current_bar] = self.balance
         self.history_equity[self.broker.state.current_bar] = self.equity
         self.history_commission[self.broker.state.current_bar] = round(self.commission_spent, 2)
 
+    def fill_history(self, start: int, end: int, prices: np.ndarray):
+        """Write the history of bars [start, end) where nothing happens, marking the open trades to `prices`."""
+        self.commission_spent = self.opened_trades.commissions() + self.closed_commission
+
+        open_value = np.zeros(end - start)
+        for trade in self.opened_trades:
+            perc = prices / trade.entry_price if trade.is_long else trade.entry_price / prices
+            open_value += trade.entry_value * (perc - 1) - trade.commissions
+
+        self.history_balance[start:end] = self.balance
+        self.history_equity[start:end] = np.round(self.balance + open_value, 2)
+        self.history_commission[start:end] = round(self.commission_spent, 2)
+
     def __open(self, is_long: bool = False, value: float = None, price: float = None):
         """Open a new trade."""
         if self.netting:
-            self.close()
+            self.close(price)
 
         if self.broker.state.is_last_bar:
             # refrain from opening a new trade on the final bar.
@@ -155,9 +200,10 @@ class BrokerAccount:
         opened_trade.entry_value = entry_value - opened_trade.entry_commission
         opened_trade.entry_price = price or self.broker.state.last_price
         opened_trade.entry_bar = self.broker.state.current_bar
-        opened_trade.entry_time = self.params.dataset.iloc[opened_trade.entry_bar].name
+        opened_trade.entry_time = self.broker.state.time
         opened_trade.is_long = is_long
-        self.opened_trades.append(opened_trade)
+        self.opened_trades.add(opened_trade)
+        return opened_trade
 
     def __close(self, trade: Trade, exit_price: float = None):
         """Close an existing trade."""
@@ -168,23 +214,42 @@ class BrokerAccount:
         closed_trade.exit_price = exit_price or self.broker.state.last_price
         closed_trade.exit_commission = (trade.entry_value + trade.pl_value) * self.params.commission
         closed_trade.exit_value = trade.pl_value + trade.entry_value
-        closed_trade.exit_time = self.params.dataset.iloc[closed_trade.exit_bar].name
+        closed_trade.exit_time = self.broker.state.time
         self.closed_trades.append(closed_trade)
+        self.closed_commission += closed_trade.commissions
         self.balance += round(closed_trade.pl_value - closed_trade.exit_commission, 2)
-        pass
+        self.orders.cancel_trade(closed_trade)
 
-    def close(self):
+    def close(self, price: float = None):
         """Close all open trades."""
         for trade in list(self.opened_trades):
-            self.__close(trade)
+            self.__close(trade, price)
+
+    def close_trade(self, trade: Trade, price: float = None):
+        """Close one open trade."""
+        self.__close(trade, price)
+
+    def close_lots(self, count: int = 1, policy: str = "fifo", is_long: bool = None, price: float = None) -> List[Trade]:
+        """Close `count` open trades, the oldest (fifo) or the newest (lifo) first, of one side if `is_long` is given."""
+        if policy not in ("fifo", "lifo"):
+            raise ValueError(f"unknown close policy '{policy}', use 'fifo' or 'lifo'")
 
-    def buy(self):
-        self.__open(is_long=True)
-        pass
+        trades = []
+        for trade in self.opened_trades.ordered(reverse=policy == "lifo"):
+            if len(trades) == count:
+                break
+            if is_long is None or trade.is_long == is_long:
+                trades.append(trade)
 
-    def sell(self):
-        self.__open(is_long=False)
-        pass
+        for trade in trades:
+            self.__close(trade, price)
+        return trades
+
+    def buy(self, value: float = None, price: float = None) -> Trade:
+        return self.__open(is_long=True, value=value, price=price)
+
+    def sell(self, value: float = None, price: float = None) -> Trade:
+        return self.__open(is_long=False, value=value, price=price)
 
 
 class Broker:
@@ -194,15 +259,34 @@ class Broker:
     It provides a way to set up and run the backtesting process.
     """
 
-    def __init__(self, params: Params):
+    def __init__(self, params: Params, total_bar: int = None, profiler: Profiler = None):
         self.params = params
+        self.offset = 0  # position of params.dataset first row in the whole dataset (chunked runs)
+        self.history_dir = None  # folder of the memory-mapped histories of this run, inside params.history_dir
+        if params.history_dir is not None:
+            # a new folder per run: runs sharing a history_dir never write to the same files
+            os.makedirs(params.history_dir, exist_ok=True)
+            self.history_dir = tempfile.mkdtemp(prefix="run-", dir=params.history_dir)
+            if not params.keep_history:
+                weakref.finalize(self, shutil.rmtree, self.history_dir, ignore_errors=True)
         self.state: BrokerState = BrokerState(
             current_bar=0,
             is_last_bar=False,
             last_price=False,
-            total_bar=len(params.dataset),
+            total_bar=len(params.dataset) if total_bar is None else total_bar,
         )
         self.account_main: BrokerAccount = BrokerAccount(self)
+        self.timeframes = {
+            name: Timeframe(params.dataset, rule, params.close_column) for name, rule in params.timeframes.items()
+        }
+        if profiler is not None:
+            profiler.instrument(self)
+
+    def new_history(self, name: str, fill) -> np.ndarray:
+        """Allocate a history buffer of one value per bar, see `qfin.backtester.history`."""
+        params = self.params
+        path = None if self.history_dir is None else os.path.join(self.history_dir, f"{name}.npy")
+        return new_history(self.state.total_bar, fill, params.history_dtype, path, params.sparse_history)
 
     def set_next_bar(self, index: int):
         """Set the next bar to process."""
@@ -210,26 +294,103 @@ class Broker:
         _end = index + 1
 
         self.state.current_bar = index
-        self.state.data = self.params.dataset.iloc[_start:_end]
+        self.state.data = self.params.dataset.iloc[_start - self.offset : _end - self.offset]
+        self.state.time = self.state.data.index[-1]
+        for timeframe in self.timeframes.values():
+            timeframe.set_bar(index)
         self.state.is_last_bar = index + 1 == self.state.total_bar
-        self.state.last_price = self.state.data.iloc[-1][self.params.close_column]  # fmt: off
+        bar = self.state.data.iloc[-1]
+        self.state.last_price = bar[self.params.close_column]  # fmt: off
+        if self.account_main.orders:
+            price = self.state.last_price
+            self.account_main.orders.match(bar.get("open", price), bar.get("high", price), bar.get("low", price))
         self.refresh()
 
     def refresh(self):
         self.account_main.refresh_values()
 
-    def buy(self):
+    def __column(self, name: str, start: int, end: int) -> np.ndarray:
+        dataset = self.params.dataset
+        name = name if name in dataset.columns else self.params.close_column
+        return dataset[name].to_numpy()[start - self.offset : end - self.offset].astype(np.float64)
+
+    def skip_bars(self, start: int, end: int):
+        """Fill the history of bars [start, end) without visiting them, except the bars filling pending orders."""
+        orders = self.account_main.orders
+        while end > start:
+            stop = end
+            if orders:
+                stop = start + orders.first_hit(self.__column("high", start, end), self.__column("low", start, end))
+            if stop > start:
+                self.account_main.fill_history(start, stop, self.__column(self.params.close_column, start, stop))
+            if stop < end:
+                self.set_next_bar(stop)
+            start = stop + 1
+
+    def timeframe(self, name: str) -> Timeframe:
+        """Higher timeframe declared in the Backtester `timeframes`."""
+        return self.timeframes[name]
+
+    def buy(self, value: float = None) -> Trade:
         """Start buying."""
-        self.account_main.buy()
+        return self.account_main.buy(value)
 
-    def sell(self):
+    def sell(self, value: float = None) -> Trade:
         """Start selling."""
-        self.account_main.sell()
+        return self.account_main.sell(value)
 
     def close(self):
         """Close all trades."""
         self.account_main.close()
 
+    def close_trade(self, trade: Trade):
+        """Close one open trade (a specific lot in hedging mode)."""
+        self.account_main.close_trade(trade)
+
+    def close_lots(self, count: int = 1, policy: str = "fifo", is_long: bool = None) -> List[Trade]:
+        """Close `count` open trades, the oldest (fifo) or the newest (lifo) first, of one side if `is_long` is given."""
+        return self.account_main.close_lots(count, policy, is_long)
+
+    @property
+    def orders(self) -> OrderBook:
+        """Pending orders of the main account."""
+        return self.account_main.orders
+
+    def buy_stop(self, price: float, value: float = None, stop_loss=None, take_profit=None, trailing=None) -> int:
+        """Buy when the price rises to `price`, returns the order id."""
+        return self.orders.place(STOP, True, price, value, stop_loss, take_profit, trailing)
+
+    def buy_limit(self, price: float, value: float = None, stop_loss=None, take_profit=None, trailing=None) -> int:
+        """Buy when the price falls to `price`, returns the order id."""
+        return self.orders.place(LIMIT, True, price, value, stop_loss, take_profit, trailing)
+
+    def sell_stop(self, price: float, value: float = None, stop_loss=None, take_profit=None, trailing=None) -> int:
+        """Sell when the price falls to `price`, returns the order id."""
+        return self.orders.place(STOP, False, price, value, stop_loss, take_profit, trailing)
+
+    def sell_limit(self, price: float, value: float = None, stop_loss=None, take_profit=None, trailing=None) -> int:
+        """Sell when the price rises to `price`, returns the order id."""
+        return self.orders.place(LIMIT, False, price, value, stop_loss, take_profit, trailing)
+
+    def stop_loss(self, trade: Trade, price: float) -> int:
+        """Close `trade` when the price goes against it to `price`."""
+        return self.orders.place(STOP_LOSS, trade.is_long, price, trade=trade)
+
+    def take_profit(self, trade: Trade, price: float) -> int:
+        """Close `trade` when the price goes in its favor to `price`."""
+        return self.orders.place(TAKE_PROFIT, trade.is_long, price, trade=trade)
+
+    def trailing_stop(self, trade: Trade, distance: float) -> int:
+        """Close `trade` when the price moves back `distance` from its best level since now."""
+        return self.orders.place(TRAILING, trade.is_long, trailing=distance, trade=trade)
+
+    def cancel(self, order: int = None):
+        """Cancel a pending order, all of them if `order` is None."""
+        if order is None:
+            self.orders.cancel_all()
+        else:
+            self.orders.cancel(order)
+
 
 class Backtester:
     """
@@ -245,6 +406,15 @@ class Backtester:
         commission: float = 0.001,
         default_entry_value: float = 1,  # between 0.01 and 1 (percent)
         default_entry_value_max: float = 20000,
+        copy: bool = True,
+        timeframes: dict = None,  # i.e. {"h4": "4h", "d1": "1D"} or ["4h"], see broker.timeframe(name)
+        hedging: bool = False,  # True: buy() / sell() add positions instead of replacing the open one
+        history_dtype="float64",  # i.e. "float32" to halve the history size
+        history_dir: str = None,  # memory-mapped history files (in a new run-* subfolder), for very long runs
+        sparse_history: bool = False,  # record only the changes, the columns are rebuilt by history()
+        profile=False,  # True or a qfin.backtester.profiling.Profiler: time the run, see bt.profiler.report()
+        stop_when=None,  # callable(broker) -> bool checked after each bar, True ends the run there (i.e. pruning)
+        keep_history: bool = False,  # True: keep the history files of the runs, else deleted with bt.broker
     ) -> None:
         self.params: Params = Params(
             dataset,
@@ -252,12 +422,32 @@ class Backtester:
             commission,
             default_entry_value,
             default_entry_value_max,
+            copy,
+            timeframes,
+            hedging,
+            history_dtype,
+            history_dir,
+            sparse_history,
+            keep_history,
         )
-
-    def trades(self) -> pd.DataFrame:
-        """Get the list of trades."""
+        self.profiler: Profiler = _profiler(self, profile)
+        self.stop_when = stop_when
+        self.stopped_bar: int = None  # bar where stop_when ended the run, the later bars are not computed
+
+    @classmethod
+    def from_store(cls, store, symbol: str, interval: str, columns: list = None, **kwargs) -> "Backtester":
+        """Backtest a dataset of a `qfin.data.store.DatasetStore`, memory-mapped and without copies."""
+        return cls(dataset=store.open(symbol, interval, columns=columns), copy=False, **kwargs)
+
+    def trades(self, excursions: bool = False) -> pd.DataFrame:
+        """Get the list of trades.
+
+        Args:
+            excursions (bool, optional): add the MAE / MFE, bars held and bars to peak columns,
+                see `qfin.backtester.stats.excursions`. Defaults to False.
+        """
         trades = self.broker.account_main.closed_trades
-        return pd.DataFrame(
+        trades = pd.DataFrame(
             {
                 "is_long": [t.is_long for t in trades],
                 "entry_value": [t.entry_value for t in trades],
@@ -274,18 +464,28 @@ class Backtester:
                 "return_pct": [t.pl_pct for t in trades],
             }
         )
+        if excursions:
+            trades = _excursions(trades, *self._high_low())
+        return trades
+
+    def _high_low(self):
+        """High and low prices of every bar (the close when there are no such columns)."""
+        dataset = self.params.dataset
+        close = dataset[self.params.close_column]
+        return dataset.get("high", close).to_numpy(), dataset.get("low", close).to_numpy()
 
     def history(self) -> pd.DataFrame:
         """Get the list of history."""
         indexs = self.params.dataset.index
+        account = self.broker.account_main
         data = {
             "close": self.params.dataset[self.params.close_column],
-            "balance": self.broker.account_main.history_balance,
-            "equity": self.broker.account_main.history_equity,
-            "commission": self.broker.account_main.history_commission,
-            "long": np.tile(False, len(indexs)),
-            "short": np.tile(False, len(indexs)),
-            "signal": np.tile(0, len(indexs)),
+            "balance": dense(account.history_balance),
+            "equity": dense(account.history_equity),
+            "commission": dense(account.history_commission),
+            "long": np.zeros(len(indexs), dtype=bool),
+            "short": np.zeros(len(indexs), dtype=bool),
+            "signal": np.zeros(len(indexs), dtype=np.int8),
         }
 
         history = pd.DataFrame(data, index=indexs)
@@ -309,16 +509,47 @@ class Backtester:
 
         return history
 
-    def run(self):
-        """Run the backtesting process."""
-        self.broker = Broker(self.params)
+    def run(self, events: list = None):
+        """Run the backtesting process.
+
+        Args:
+            events (list, optional): wake-up conditions (see `qfin.backtester.events`), only the bars
+                where one of them happens are yielded and the other bars are skipped. Defaults to None (every bar).
+        """
+        bars = self.__run(events)
+        return bars if self.profiler is None else self.profiler.iterate(self, bars)
+
+    def __run(self, events: list = None):
+        self.broker = Broker(self.params, profiler=self.profiler)
+        self.stopped_bar = None
+        stop_when = self.stop_when
         total = len(self.params.dataset)
         current = 1
 
-        while current < total:
-            self.broker.set_next_bar(current)
-            yield self.broker
-            current += 1
+        if events is None:
+            while current < total:
+                self.broker.set_next_bar(current)
+                yield self.broker
+                if stop_when is not None and stop_when(self.broker):
+                    self.stopped_bar = current
+                    break
+                current += 1
+        else:
+            bars = event_bars(events, self.params.dataset)
+            previous = 0
+            for current in bars[(bars >= 1) & (bars < total)]:
+                self.broker.skip_bars(previous + 1, current)
+                self.broker.set_next_bar(current)
+                yield self.broker
+                previous = current
+                if stop_when is not None and stop_when(self.broker):
+                    self.stopped_bar = current
+                    break
+
+            # move to the last bar without yielding
+            if self.stopped_bar is None and previous < total - 1:
+                self.broker.skip_bars(previous + 1, total - 1)
+                self.broker.set_next_bar(total - 1)
 
         self.broker.refresh()
 
@@ -330,13 +561,36 @@ class Backtester:
     def stats(self):
         return stats(self.history(), self.trades())
 
-    def plot(self, w=1024, h=900, show_signals=False):
-        return plot_basic(history=self.history(), params=self.params, w=w, h=h, show_signals=show_signals)
+    def plot(self, w=1024, h=900, show_signals=False, max_points="auto", downsample="minmax"):
+        from .plot import plot_basic
+
+        return plot_basic(
+            history=self.history(),
+            params=self.params,
+            w=w,
+            h=h,
+            show_signals=show_signals,
+            trades=self.trades(),
+            max_points=max_points,
+            downsample=downsample,
+        )
 
     def thumbnail(self, title=None, w=4, h=1):
+        from .plot import plot_thumbnail
+
         return plot_thumbnail(history=self.history(), params=self.params, stats=self.stats(), title=title, w=w, h=h)
 
 
+def _profiler(backtester: Backtester, profile) -> Profiler:
+    """helper function: the profiler of a backtester (None when profiling is off), timing its results too"""
+    if not profile:
+        return None
+    profiler = profile if isinstance(profile, Profiler) else Profiler()
+    for method in ("history", "trades", "stats"):
+        profiler.wrap(backtester, method, f"backtester.{method}")
+    return profiler
+
+
 # Example usage:
 # if __name__ == "__main__":
 # Create a dataset
@@ -0,0 +1,339 @@
+"""
+Batch backtests from a config file, the `qfin-bt` command.
+
+The config (TOML or JSON) lists the datasets, the strategy, the `Backtester` parameters
+and the output folder. Every dataset is a job, run on a process pool: each worker loads
+its dataset, runs the strategy and writes the results, and only a small summary goes back
+to the main process. At most `2 * processes` jobs are in flight and the workers are
+replaced after `max_tasks_per_child` jobs, so the memory stays bounded whatever the
+number of jobs.
+
+    <output>/<job>/trades.csv        (or .parquet with format = "parquet", needs pyarrow)
+    <output>/<job>/history.csv
+    <output>/<job>/stats.json
+    <output>/<job>/job.json          fingerprint of the inputs, written last
+
+A job is skipped when its `job.json` has the same fingerprint (dataset path, size and
+modification time, strategy, parameters, qfin version) and its outputs exist.
+
+i.e:
+    # nightly.toml
+    strategy = "bt_signal_change"             # a qfin.backtester.runners function, or "package.module:function"
+    output = "./results"
+    datasets = ["./data/*.csv"]               # one job per file, named after it
+    processes = 4
+
+    [params]                                  # keyword arguments of the strategy / Backtester
+    initial_balance = 10000
+    commission = 0.001
+
+    [[jobs]]                                  # jobs with their own settings
+    name = "spx-fast"
+    dataset = "./data/_^spx.csv"
+    params = { commission = 0.0005 }
+
+    qfin-bt nightly.toml --processes 8
+    qfin-bt nightly.toml --dry-run            # list the jobs and their status
+"""
+
+import argparse
+import glob
+import hashlib
+import importlib
+import json
+import logging
+import math
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+TABLES = ["trades", "history"]
+_manifest_file = "job.json"
+_stats_file = "stats.json"
+
+
+def load_config(path: str) -> dict:
+    """Read a TOML or JSON config, the relative paths are relative to the config folder."""
+    if path.endswith(".toml"):
+        import tomllib
+
+        with open(path, "rb") as f:
+            config = tomllib.load(f)
+    else:
+        with open(path) as f:
+            config = json.load(f)
+    config.setdefault("base_dir", os.path.dirname(os.path.abspath(path)))
+    return config
+
+
+def _path(config: dict, path: str) -> str:
+    return os.path.normpath(os.path.join(config["base_dir"], os.path.expanduser(path)))
+
+
+def _version() -> str:
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("qfin")
+    except PackageNotFoundError:
+        return None
+
+
+def plan_jobs(config: dict) -> list:
+    """Expand a config into jobs (dicts of name, dataset, strategy, params, columns, output, format)."""
+    defaults = {
+        "strategy": config.get("strategy", "bt_signal_change"),
+        "params": dict(config.get("params", {})),
+        "columns": config.get("columns"),
+        "format": config.get("format", "csv"),
+        "excursions": config.get("excursions", False),
+    }
+    output = _path(config, config.get("output", "./results"))
+
+    entries = []
+    for pattern in config.get("datasets", []):
+        paths = sorted(glob.glob(_path(config, pattern)))
+        if not paths:
+            logger.warning(f"no dataset matches {pattern}")
+        entries += [{"dataset": path} for path in paths]
+    entries += config.get("jobs", [])
+
+    jobs, names = [], set()
+    for entry in entries:
+        dataset = _path(config, entry["dataset"])
+        name = str(entry.get("name") or os.path.splitext(os.path.basename(dataset))[0])
+        if name in names:
+            raise ValueError(f"two jobs are named '{name}', give them a 'name'")
+        names.add(name)
+        job = {**defaults, **{k: v for k, v in entry.items() if k != "params"}, "name": name, "dataset": dataset}
+        job["params"] = {**defaults["params"], **entry.get("params", {})}
+        job["output"] = os.path.join(output, name.replace(os.sep, "_"))
+        if job["format"] not in ("csv", "parquet"):
+            raise ValueError(f"unknown format '{job['format']}' of job '{name}', expected \"csv\" or \"parquet\"")
+        jobs.append(job)
+    if any(job["format"] == "parquet" for job in jobs):
+        require_parquet()
+    return jobs
+
+
+def require_parquet():
+    """Raise an ImportError explaining how to get Parquet outputs when pyarrow is not installed."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError('Parquet outputs need pyarrow (uv add pyarrow), or use the default format = "csv"') from None
+
+
+def fingerprint(job: dict) -> str:
+    """Hash of everything the outputs of a job depend on."""
+    stat = os.stat(job["dataset"])
+    inputs = {
+        "dataset": job["dataset"],
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "version": _version(),
+        **{key: job[key] for key in ("strategy", "params", "columns", "format", "excursions")},
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _outputs(job: dict) -> list:
+    extension = "parquet" if job["format"] == "parquet" else "csv"
+    return [os.path.join(job["output"], f"{table}.{extension}") for table in TABLES] + [
+        os.path.join(job["output"], _stats_file)
+    ]
+
+
+def is_up_to_date(job: dict) -> bool:
+    """True when the outputs of the job were written from the same inputs."""
+    try:
+        with open(os.path.join(job["output"], _manifest_file)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return manifest.get("fingerprint") == fingerprint(job) and all(os.path.exists(path) for path in _outputs(job))
+
+
+def resolve_strategy(name):
+    """The strategy function: a callable, a function of `qfin.backtester.runners` or "package.module:function".
+
+    A strategy takes the dataset and keyword parameters and returns the finished `Backtester`.
+    """
+    if callable(name):
+        return name
+    if ":" not in name and "." not in name:
+        module, attribute = "qfin.backtester.runners", name
+    elif ":" in name:
+        module, attribute = name.split(":", 1)
+    else:
+        module, attribute = name.rsplit(".", 1)
+    return getattr(importlib.import_module(module), attribute)
+
+
+def load_dataset(path: str, columns: list = None):
+    """Read a CSV (first column as the date index) or Parquet dataset."""
+    import pandas as pd
+
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, columns=columns)
+    usecols = None if columns is None else [pd.read_csv(path, nrows=0).columns[0], *columns]
+    return pd.read_csv(path, index_col=0, parse_dates=[0], usecols=usecols)
+
+
+def _json_value(value):
+    """helper function: a stats value as JSON (timestamps in ISO format, durations as text, NaN as null)"""
+    import pandas as pd
+
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, pd.Timedelta):
+        return str(value)
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def _write(path: str, write):
+    """helper function: write through a temporary file, so a crash never leaves a partial output"""
+    tmp = f"{path}.tmp-{os.getpid()}"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def run_job(job: dict) -> dict:
+    """Run one job and write its outputs, return a summary (name, status, seconds, stats)."""
+    start = time.perf_counter()
+    os.makedirs(job["output"], exist_ok=True)
+    manifest = os.path.join(job["output"], _manifest_file)
+    if os.path.exists(manifest):
+        os.remove(manifest)
+    key = fingerprint(job)
+
+    dataset = load_dataset(job["dataset"], job["columns"])
+    bt = resolve_strategy(job["strategy"])(dataset, **job["params"])
+    del dataset
+
+    trades_path, history_path, stats_path = _outputs(job)
+    trades, history = bt.trades(excursions=job["excursions"]), bt.history()
+    stats = {name: _json_value(value) for name, value in bt.stats().items() if not name.startswith("_")}
+    for table, path in ((trades, trades_path), (history, history_path)):
+        if job["format"] == "parquet":
+            _write(path, table.to_parquet)
+        else:
+            _write(path, table.to_csv)
+    _write(stats_path, lambda tmp: _dump(stats, tmp))
+
+    summary = {"name": job["name"], "status": "done", "seconds": time.perf_counter() - start, "stats": stats}
+    _write(manifest, lambda tmp: _dump({"fingerprint": key, "job": job, "seconds": summary["seconds"]}, tmp))
+    return summary
+
+
+def _dump(data: dict, path: str):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, default=str)
+
+
+def _safe_run_job(job: dict) -> dict:
+    try:
+        return run_job(job)
+    except Exception as e:
+        # any error of a job (strategy included) fails that job only, the batch goes on
+        logger.exception(f"job {job['name']} failed")
+        return {"name": job["name"], "status": "failed", "error": f"{type(e).__name__}: {e}"}
+
+
+def run_batch(jobs: list, processes: int = None, max_tasks_per_child: int = 20, force: bool = False, log=None):
+    """Run the jobs on a process pool and yield their summaries as they finish.
+
+    Args:
+        jobs (list): jobs of `plan_jobs`.
+        processes (int, optional): worker processes. Defaults to the number of CPUs.
+        max_tasks_per_child (int, optional): jobs run by a worker before it is replaced. Defaults to 20.
+        force (bool, optional): run the jobs that are up to date too. Defaults to False.
+        log (optional): callable receiving each summary. Defaults to None.
+    """
+    pending = []
+    for job in jobs:
+        if not force and is_up_to_date(job):
+            summary = {"name": job["name"], "status": "skipped"}
+            log and log(summary)
+            yield summary
+        else:
+            pending.append(job)
+
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(pending) < 2:
+        for job in pending:
+            summary = _safe_run_job(job)
+            log and log(summary)
+            yield summary
+        return
+
+    jobs_iter = iter(pending)
+    with ProcessPoolExecutor(max_workers=processes, max_tasks_per_child=max_tasks_per_child) as pool:
+        running = set()
+        while True:
+            # a bounded number of jobs in flight, the next ones are submitted as these finish
+            for job in jobs_iter:
+                running.add(pool.submit(_safe_run_job, job))
+                if len(running) >= 2 * processes:
+                    break
+            if not running:
+                break
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                summary = future.result()
+                log and log(summary)
+                yield summary
+
+
+def _log(summary: dict):
+    if summary["status"] == "done":
+        print(f"{summary['name']:<32} done     {summary['seconds']:>8.2f}s  return {summary['stats'].get('Equity Return [%]')}")
+    elif summary["status"] == "failed":
+        print(f"{summary['name']:<32} failed   {summary['error']}")
+    else:
+        print(f"{summary['name']:<32} {summary['status']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="qfin-bt", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("config", help="TOML or JSON config file")
+    parser.add_argument("-p", "--processes", type=int, help="worker processes (default: config, else the CPU count)")
+    parser.add_argument("--max-tasks-per-child", type=int, help="jobs run by a worker before it is replaced")
+    parser.add_argument("-k", dest="patterns", action="append", help="only the jobs whose name contains this text")
+    parser.add_argument("--force", action="store_true", help="run the jobs even if their outputs are up to date")
+    parser.add_argument("--dry-run", action="store_true", help="list the jobs and their status without running them")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    config = load_config(args.config)
+    jobs = plan_jobs(config)
+    if args.patterns:
+        jobs = [job for job in jobs if any(pattern in job["name"] for pattern in args.patterns)]
+
+    if args.dry_run:
+        for job in jobs:
+            status = "up to date" if is_up_to_date(job) and not args.force else "to run"
+            print(f"{job['name']:<32} {status:<12} {job['dataset']}")
+        return 0
+
+    processes = args.processes or config.get("processes")
+    max_tasks = args.max_tasks_per_child or config.get("max_tasks_per_child", 20)
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+    start = time.perf_counter()
+    for summary in run_batch(jobs, processes, max_tasks, args.force, log=_log):
+        counts[summary["status"]] += 1
+    print(f"{len(jobs)} jobs in {time.perf_counter() - start:.1f}s: " + ", ".join(f"{n} {s}" for s, n in counts.items()))
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""
+Out-of-core backtesting for datasets larger than memory.
+
+`ChunkedBacktester` runs the same per-bar loop as `Backtester`, but reads the dataset
+in blocks of `chunk_size` bars (CSV, Parquet, a `DatasetStore` dataset or a dataframe)
+and writes the history arrays to memory-mapped files. The account and the open trades
+carry over from one block to the next, and the last bars of the previous block are kept
+so `broker.state.data` has the same lookback window at the block seams.
+
+i.e:
+    bt = ChunkedBacktester("./ticks_1s.csv", chunk_size=1_000_000, initial_balance=10000)
+    for broker in bt.run():
+        ...
+    bt.stats()  # same as an in-memory run
+"""
+
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from .backtester import Backtester, Broker, Params, _profiler
+
+
+def _count_csv_rows(path: str) -> int:
+    with open(path, "rb") as f:
+        lines = sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 24), b""))
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            lines += 1
+    return lines - 1  # header
+
+
+def _open_source(source, chunk_size: int, columns: list = None):
+    """Return (total bars, iterator of dataframe chunks) of a dataset source."""
+    if isinstance(source, pd.DataFrame):
+        frame = source if columns is None else source[columns]
+        return len(frame), (frame.iloc[i : i + chunk_size] for i in range(0, len(frame), chunk_size))
+
+    if isinstance(source, tuple):
+        store, symbol, interval = source
+        total = store.meta(symbol, interval)["length"]
+        chunks = (store.open(symbol, interval, columns=columns, start=i, end=i + chunk_size) for i in range(0, total, chunk_size))
+        return total, chunks
+
+    path = str(source)
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(path)
+        if columns is not None:
+            # the index is stored as column(s), read them too so it is restored
+            metadata = parquet.schema_arrow.pandas_metadata or {}
+            columns = [*columns, *(c for c in metadata.get("index_columns", []) if isinstance(c, str))]
+        chunks = (batch.to_pandas() for batch in parquet.iter_batches(batch_size=chunk_size, columns=columns))
+        return parquet.metadata.num_rows, chunks
+
+    usecols = None if columns is None else [pd.read_csv(path, nrows=0).columns[0], *columns]
+    reader = pd.read_csv(path, index_col=0, parse_dates=[0], chunksize=chunk_size, usecols=usecols)
+    return _count_csv_rows(path), iter(reader)
+
+
+class ChunkedBacktester(Backtester):
+    """
+    Backtester reading the dataset block by block.
+
+    It gives the same `trades()` and `stats()` as `Backtester` on the whole dataset,
+    while only one block (plus the lookback bars) is held in memory.
+    """
+
+    def __init__(
+        self,
+        source,
+        chunk_size: int = 1_000_000,
+        columns: list = None,
+        history_dir: str = None,
+        initial_balance: float = 10000.0,
+        commission: float = 0.001,
+        default_entry_value: float = 1,  # between 0.01 and 1 (percent)
+        default_entry_value_max: float = 20000,
+        history_dtype="float64",
+        profile=False,
+        stop_when=None,
+        keep_history: bool = False,
+    ) -> None:
+        """
+        Args:
+            source: CSV path, Parquet path, (DatasetStore, symbol, interval) or a dataframe.
+            chunk_size (int, optional): bars per block. Defaults to 1_000_000.
+            columns (list, optional): columns to read, must include the close column. Defaults to all.
+            history_dir (str, optional): folder of the history files, each run writes to a new run-* subfolder
+                deleted with the run. Defaults to a new temporary folder, deleted with the backtester.
+            history_dtype (optional): dtype of the balance / equity / commission histories. Defaults to "float64".
+            profile (optional): True or a `Profiler`, see `Backtester`. Defaults to False.
+            stop_when (optional): callable(broker) -> bool checked after each bar, see `Backtester`. Defaults to None.
+            keep_history (bool, optional): keep the history files after the backtester is deleted. Defaults to False.
+        """
+        self.source = source
+        self.chunk_size = chunk_size
+        self.columns = columns
+        self.history_dir = history_dir or tempfile.mkdtemp(prefix="qfin-bt-")
+        os.makedirs(self.history_dir, exist_ok=True)
+        if history_dir is None and not keep_history:
+            # after the runs: their memmaps stay readable until the backtester is deleted
+            weakref.finalize(self, shutil.rmtree, self.history_dir, ignore_errors=True)
+        self.params: Params = Params(
+            pd.DataFrame(),
+            initial_balance,
+            commission,
+            default_entry_value,
+            default_entry_value_max,
+            copy=False,
+            history_dtype=history_dtype,
+            history_dir=self.history_dir,
+            keep_history=keep_history,
+        )
+        self.index: np.ndarray = None
+        self.close: np.ndarray = None
+        self.high: np.ndarray = None
+        self.low: np.ndarray = None
+        self.profiler = _profiler(self, profile)
+        self.stop_when = stop_when
+        self.stopped_bar: int = None  # bar where stop_when ended the run, the later bars are not computed
+
+    def __memmap(self, name, dtype, total):
+        path = os.path.join(self.broker.history_dir, f"{name}.npy")
+        return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(total,))
+
+    def run(self, events: list = None):
+        """Run the backtesting process, block by block."""
+        if events is not None:
+            raise ValueError("ChunkedBacktester runs every bar, run(events=...) needs the whole dataset: use Backtester")
+        bars = self.__run()
+        return bars if self.profiler is None else self.profiler.iterate(self, bars)
+
+    def __run(self):
+        total, chunks = _open_source(self.source, self.chunk_size, self.columns)
+        self.broker = Broker(self.params, total_bar=total, profiler=self.profiler)
+        self.index = self.close = self.high = self.low = None  # written to the folder of this run
+        nbars = self.broker.state._nbars
+        close_column = self.params.close_column
+        self.stopped_bar = None
+        stop_when = self.stop_when
+
+        tail = None
+        start = 0
+        for chunk in chunks:
+            end = start + len(chunk)
+            if self.index is None:
+                self.index = self.__memmap("index", chunk.index.to_numpy().dtype, total)
+                self.index_name = chunk.index.name
+                self.close = self.__memmap("close", np.float64, total)
+                if "high" in chunk.columns and "low" in chunk.columns:
+                    self.high = self.__memmap("high", np.float64, total)
+                    self.low = self.__memmap("low", np.float64, total)
+            self.index[start:end] = chunk.index.to_numpy()
+            self.close[start:end] = chunk[close_column].to_numpy()
+            if self.high is not None:
+                self.high[start:end] = chunk["high"].to_numpy()
+                self.low[start:end] = chunk["low"].to_numpy()
+
+            # keep the lookback bars of the previous block in front of this one
+            frame = chunk if tail is None else pd.concat([tail, chunk])
+            self.params.dataset = frame
+            self.broker.offset = start - (0 if tail is None else len(tail))
+
+            for current in range(max(start, 1), end):
+                self.broker.set_next_bar(current)
+                yield self.broker
+                if stop_when is not None and stop_when(self.broker):
+                    self.stopped_bar = current
+                    break
+            if self.stopped_bar is not None:
+                break
+
+            tail = frame.iloc[-nbars:]
+            start = end
+
+        if self.stopped_bar is not None:
+            # only the bars up to the stop were read
+            bars = self.stopped_bar + 1
+            self.index, self.close = self.index[:bars], self.close[:bars]
+            if self.high is not None:
+                self.high, self.low = self.high[:bars], self.low[:bars]
+
+        self.broker.refresh()
+
+        should_exit_on_last_bar = True
+        if should_exit_on_last_bar:
+            self.broker.close()
+            self.broker.refresh()
+
+        for history in (self.index, self.close, *self.__account_histories()):
+            history.flush()
+
+    def _high_low(self):
+        if self.high is None:
+            return self.close, self.close
+        return self.high, self.low
+
+    def __account_histories(self):
+        account = self.broker.account_main
+        return account.history_balance, account.history_equity, account.history_commission
+
+    def history(self) -> pd.DataFrame:
+        """Get the list of history, the columns are backed by the files of the run in `history_dir`."""
+        total = len(self.index)
+        balance, equity, commission = (history[:total] for history in self.__account_histories())
+        long = self.__memmap("long", bool, total)
+        short = self.__memmap("short", bool, total)
+        signal = self.__memmap("signal", np.int8, total)
+        long[:], short[:], signal[:] = False, False, 0
+
+        for row in self.trades().itertuples():
+            if row.is_long:
+                long[row.entry_bar : row.exit_bar] = True
+                signal[row.entry_bar : row.exit_bar] = 1
+            else:
+                short[row.entry_bar : row.exit_bar] = True
+                signal[row.entry_bar : row.exit_bar] = -1
+
+        # -- buy and hold
+        buy_hold = self.__memmap("buy_hold", np.float64, total)
+        np.multiply(self.close, self.params.initial_balance / self.close[0], out=buy_hold)
+
+        data = {
+            "close": self.close,
+            "balance": balance,
+            "equity": equity,
+            "commission": commission,
+            "long": long,
+            "short": short,
+            "signal": signal,
+            "buy_hold": buy_hold,
+        }
+        index = pd.Index(self.index, name=self.index_name, copy=False)
+        return pd.DataFrame(data, index=index, copy=False)
@@ -0,0 +1,80 @@
+"""
+Wake-up conditions for sparse strategies.
+
+`Backtester.run(events=[...])` only yields on the bars where one of the events
+happens; the balance, equity and commission histories of the skipped bars are
+filled with a vectorized mark-to-market. The results are the same as a full run
+as long as the strategy only acts on those bars.
+
+i.e:
+    for broker in bt.run(events=[on_change("signal"), every(500)]):
+        ...
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class Event:
+    """A wake-up condition, `indices(dataset)` returns the positions of the bars where it happens."""
+
+    def __init__(self, indices, name: str = "event"):
+        self.__indices = indices
+        self.name = name
+
+    def indices(self, dataset: pd.DataFrame) -> np.ndarray:
+        return np.asarray(self.__indices(dataset), dtype=np.int64)
+
+    def __repr__(self):
+        return f"Event({self.name})"
+
+
+def _values(dataset, column):
+    return dataset[column].to_numpy() if isinstance(column, str) else np.asarray(column)
+
+
+def on_change(column: str = "signal") -> Event:
+    """Bars where `column` differs from the previous bar."""
+
+    def indices(dataset):
+        values = _values(dataset, column)
+        return np.flatnonzero(values[1:] != values[:-1]) + 1
+
+    return Event(indices, f"on_change({column})")
+
+
+def on_cross(column: str = "close", level=0.0) -> Event:
+    """Bars where `column` crosses (or touches) `level`, a number or another column."""
+
+    def indices(dataset):
+        a = _values(dataset, column).astype(np.float64)
+        b = _values(dataset, level).astype(np.float64) if isinstance(level, str) else level
+        side = np.sign(a - b)
+        valid = ~np.isnan(side)
+        return np.flatnonzero((side[1:] != side[:-1]) & valid[1:] & valid[:-1]) + 1
+
+    return Event(indices, f"on_cross({column}, {level})")
+
+
+def every(n: int, offset: int = 0) -> Event:
+    """Every `n` bars, starting at bar `offset`."""
+    return Event(lambda dataset: np.arange(offset, len(dataset), n), f"every({n})")
+
+
+def when(mask) -> Event:
+    """Bars where `mask` is true: a boolean column name, array, or a function of the dataset."""
+
+    def indices(dataset):
+        values = mask(dataset) if callable(mask) else _values(dataset, mask)
+        return np.flatnonzero(np.asarray(values, dtype=bool))
+
+    return Event(indices, "when")
+
+
+def event_bars(events: list, dataset: pd.DataFrame) -> np.ndarray:
+    """Sorted, unique bar positions of all the events."""
+    if isinstance(events, Event):
+        events = [events]
+    if not events:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate([event.indices(dataset) for event in events]))
@@ -0,0 +1,326 @@
+"""
+Local store of backtest results, keyed by a content hash of the inputs.
+
+The key of an experiment hashes the dataset content, the strategy code (its source and
+the qfin version) and the parameter values, so the same run is never paid twice: `run`
+looks the key up first and only runs the strategy on a miss. The stats are kept in a
+SQLite database, with the numeric metrics in an indexed table for queries, and the
+trades / history optionally in CSV files (or Parquet with format="parquet", needs pyarrow).
+
+    <root>/experiments.db
+    <root>/blobs/<key[:2]>/<key>/trades.csv
+    <root>/blobs/<key[:2]>/<key>/history.csv
+
+i.e:
+    store = ExperimentStore("./experiments")
+    for commission in [0.001, 0.0005]:
+        experiment = store.run(bt_signal_change, df, {"commission": commission}, trades=True)
+        experiment.stats, experiment.cached
+
+    # top 50 by Sharpe with a max drawdown under 20%
+    store.query(order_by="Sharpe Ratio", where=[("Max. Drawdown [%]", ">", -20)], limit=50)
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from ._sqlite import Transaction
+from .batch import _json_value, _version, _write, load_dataset, require_parquet, resolve_strategy
+
+_operators = {"<", "<=", ">", ">=", "=", "!="}
+_formats = ["csv", "parquet"]
+_fingerprints = {}  # (path, size, mtime) -> content hash of a dataset file
+
+
+def dataset_fingerprint(dataset, columns: list = None) -> str:
+    """Content hash of a dataframe, or of a dataset file (CSV / Parquet path) and the columns read from it."""
+    if isinstance(dataset, pd.DataFrame):
+        digest = hashlib.sha256(pd.util.hash_pandas_object(dataset, index=True).to_numpy().tobytes())
+        digest.update(json.dumps([[str(c), str(t)] for c, t in dataset.dtypes.items()]).encode())
+        return digest.hexdigest()
+
+    path = os.path.abspath(str(dataset))
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if key not in _fingerprints:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 24), b""):
+                digest.update(block)
+        _fingerprints[key] = digest.hexdigest()
+    return hashlib.sha256(f"{_fingerprints[key]}:{json.dumps(columns)}".encode()).hexdigest()
+
+
+def strategy_version(strategy) -> str:
+    """Hash of the source code of a strategy function and of the qfin version."""
+    function = resolve_strategy(strategy)
+    try:
+        source = inspect.getsource(function)
+    except (OSError, TypeError):
+        source = ""
+    name = f"{getattr(function, '__module__', '')}.{getattr(function, '__qualname__', repr(function))}"
+    return hashlib.sha256(f"{name}\n{_version()}\n{source}".encode()).hexdigest()
+
+
+def _name(strategy) -> str:
+    return strategy if isinstance(strategy, str) else f"{strategy.__module__}:{strategy.__qualname__}"
+
+
+def _stats_series(stats: dict) -> pd.Series:
+    """helper function: the stats as returned by `Backtester.stats()`, from their JSON values"""
+    values = {}
+    for name, value in stats.items():
+        if isinstance(value, str) and name in ("Start", "End"):
+            value = pd.Timestamp(value)
+        elif isinstance(value, str) and "Duration" in name:
+            value = pd.Timedelta(value)
+        values[name] = float("nan") if value is None else value
+    return pd.Series(values, dtype=object)
+
+
+class Experiment:
+    """A stored run: its key, parameters and stats, the trades / history are read on demand."""
+
+    def __init__(self, key: str, params: dict, stats: pd.Series, path: str, cached: bool):
+        self.key = key
+        self.params = params
+        self.stats = stats
+        self.path = path
+        self.cached = cached  # True when the result comes from the store
+
+    def __repr__(self):
+        return f"Experiment({self.key[:12]}, {self.params}, cached={self.cached})"
+
+    def __file(self, table: str) -> str:
+        for extension in _formats:
+            path = os.path.join(self.path, f"{table}.{extension}")
+            if os.path.exists(path):
+                return path
+        return None
+
+    def has(self, table: str) -> bool:
+        """True when the "trades" / "history" of the run were stored."""
+        return self.__file(table) is not None
+
+    def __read(self, table: str) -> pd.DataFrame:
+        path = self.__file(table)
+        if path is None:
+            raise KeyError(f"the {table} of experiment {self.key[:12]} were not stored, run it with {table}=True")
+        if path.endswith(".parquet"):
+            return pd.read_parquet(path)
+        # the CSV files lose the datetime types of the index (history) and of the trade times
+        frame = pd.read_csv(path, index_col=0)
+        if table == "history":
+            frame.index = pd.to_datetime(frame.index)
+        for column in frame.columns:
+            if column.endswith("_time"):
+                frame[column] = pd.to_datetime(frame[column])
+        return frame
+
+    def trades(self) -> pd.DataFrame:
+        return self.__read("trades")
+
+    def history(self) -> pd.DataFrame:
+        return self.__read("history")
+
+
+class ExperimentStore:
+    """Backtest results on disk, see the module documentation."""
+
+    def __init__(self, root: str, format: str = "csv"):
+        """
+        Args:
+            root (str): folder of the store.
+            format (str, optional): "csv" or "parquet" (needs pyarrow), file format of the stored trades / history.
+                Defaults to "csv".
+        """
+        if format not in _formats:
+            raise ValueError(f"unknown format '{format}', expected one of {_formats}")
+        if format == "parquet":
+            require_parquet()
+        self.root = root
+        self.format = format
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(root, "experiments.db"), timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS experiments (
+                key TEXT PRIMARY KEY,
+                created REAL NOT NULL,
+                dataset TEXT NOT NULL,
+                strategy TEXT NOT NULL,
+                version TEXT NOT NULL,
+                params TEXT NOT NULL,
+                stats TEXT NOT NULL,
+                seconds REAL
+            );
+            CREATE TABLE IF NOT EXISTS metrics (
+                key TEXT NOT NULL,
+                name TEXT NOT NULL,
+                value REAL,
+                PRIMARY KEY (key, name)
+            );
+            CREATE INDEX IF NOT EXISTS metrics_value ON metrics (name, value);
+            """
+        )
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM experiments").fetchone()[0]
+
+    def __contains__(self, key: str) -> bool:
+        return self.db.execute("SELECT 1 FROM experiments WHERE key = ?", (key,)).fetchone() is not None
+
+    def __blobs(self, key: str) -> str:
+        return os.path.join(self.root, "blobs", key[:2], key)
+
+    def key(self, strategy, dataset, params: dict = None, columns: list = None) -> str:
+        """Content hash of a run: dataset fingerprint, strategy version and parameter values."""
+        inputs = {
+            "dataset": dataset_fingerprint(dataset, columns),
+            "strategy": strategy_version(strategy),
+            "params": params or {},
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key: str) -> Experiment:
+        """The stored experiment of a key, None if there is none."""
+        row = self.db.execute("SELECT params, stats FROM experiments WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return Experiment(key, json.loads(row[0]), _stats_series(json.loads(row[1])), self.__blobs(key), cached=True)
+
+    def put(
+        self,
+        key: str,
+        bt,
+        strategy,
+        dataset,
+        params: dict = None,
+        trades: bool = False,
+        history: bool = False,
+        seconds: float = None,
+    ) -> Experiment:
+        """Store the results of a finished `Backtester`."""
+        params = params or {}
+        stats = {name: _json_value(value) for name, value in bt.stats().items() if not name.startswith("_")}
+
+        path = self.__blobs(key)
+        if trades or history:
+            os.makedirs(path, exist_ok=True)
+        for table, wanted in (("trades", trades), ("history", history)):
+            if wanted:
+                frame = getattr(bt, table)()
+                write = frame.to_parquet if self.format == "parquet" else frame.to_csv
+                _write(os.path.join(path, f"{table}.{self.format}"), write)
+
+        numeric = {
+            name: value for name, value in stats.items() if isinstance(value, (int, float)) and not isinstance(value, bool)
+        }
+        metrics = [(key, name, value) for name, value in numeric.items()]
+        with Transaction(self.db) as db:
+            db.execute(
+                "INSERT OR REPLACE INTO experiments VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    time.time(),
+                    dataset if isinstance(dataset, str) else "<dataframe>",
+                    _name(strategy),
+                    strategy_version(strategy),
+                    json.dumps(params, default=str),
+                    json.dumps(stats),
+                    seconds,
+                ),
+            )
+            db.execute("DELETE FROM metrics WHERE key = ?", (key,))
+            db.executemany("INSERT INTO metrics VALUES (?, ?, ?)", metrics)
+        return Experiment(key, params, _stats_series(stats), path, cached=False)
+
+    def run(
+        self,
+        strategy,
+        dataset,
+        params: dict = None,
+        columns: list = None,
+        trades: bool = False,
+        history: bool = False,
+    ) -> Experiment:
+        """The experiment of a run, from the store if it was run before, else run and stored.
+
+        Args:
+            strategy: function or name (see `qfin.backtester.batch.resolve_strategy`) returning the finished `Backtester`.
+            dataset: dataframe, or CSV / Parquet path (only read on a miss).
+            params (dict, optional): keyword arguments of the strategy. Defaults to None.
+            columns (list, optional): columns read from a dataset path. Defaults to all.
+            trades (bool, optional): store the trades too. Defaults to False.
+            history (bool, optional): store the history too. Defaults to False.
+        """
+        params = params or {}
+        key = self.key(strategy, dataset, params, columns)
+        experiment = self.get(key)
+        tables = [table for table, wanted in (("trades", trades), ("history", history)) if wanted]
+        if experiment is not None and all(experiment.has(table) for table in tables):
+            return experiment
+
+        start = time.perf_counter()
+        data = dataset if isinstance(dataset, pd.DataFrame) else load_dataset(str(dataset), columns)
+        bt = resolve_strategy(strategy)(data, **params)
+        return self.put(key, bt, strategy, dataset, params, trades, history, time.perf_counter() - start)
+
+    def query(
+        self,
+        order_by: str = None,
+        ascending: bool = False,
+        where: list = None,
+        limit: int = None,
+        strategy: str = None,
+    ) -> pd.DataFrame:
+        """Stored experiments filtered and sorted on their metrics, one row per experiment (parameters + stats).
+
+        Args:
+            order_by (str, optional): metric to sort on, i.e. "Sharpe Ratio". Defaults to the creation order.
+            ascending (bool, optional): sort order. Defaults to False (best first).
+            where (list, optional): (metric, operator, value) conditions, i.e. [("Max. Drawdown [%]", ">", -20)].
+            limit (int, optional): maximum number of rows. Defaults to all.
+            strategy (str, optional): only the experiments of this strategy name. Defaults to all.
+        """
+        joins, conditions, args = [], [], []
+        for k, (metric, operator, value) in enumerate(where or []):
+            if operator not in _operators:
+                raise ValueError(f"unknown operator '{operator}', expected one of {sorted(_operators)}")
+            joins.append(f"JOIN metrics w{k} ON w{k}.key = e.key AND w{k}.name = ? AND w{k}.value {operator} ?")
+            args += [metric, value]
+        if order_by is not None:
+            joins.append("JOIN metrics o ON o.key = e.key AND o.name = ?")
+            args.append(order_by)
+        if strategy is not None:
+            conditions.append("e.strategy = ?")
+            args.append(strategy)
+
+        sql = f"SELECT e.key, e.strategy, e.dataset, e.params, e.stats FROM experiments e {' '.join(joins)}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY o.value {'ASC' if ascending else 'DESC'}" if order_by is not None else " ORDER BY e.created"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+
+        rows = []
+        for key, strategy_name, dataset, params, stats in self.db.execute(sql, args):
+            params = {f"param.{name}": value for name, value in json.loads(params).items()}
+            rows.append({"key": key, "strategy": strategy_name, "dataset": dataset, **params, **json.loads(stats)})
+        return pd.DataFrame(rows).set_index("key") if rows else pd.DataFrame()
+
+    def delete(self, key: str):
+        import shutil
+
+        with Transaction(self.db) as db:
+            db.execute("DELETE FROM experiments WHERE key = ?", (key,))
+            db.execute("DELETE FROM metrics WHERE key = ?", (key,))
+        shutil.rmtree(self.__blobs(key), ignore_errors=True)
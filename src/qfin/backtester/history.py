@@ -0,0 +1,122 @@
+"""
+Per-bar history buffers of an account (balance, equity, commission).
+
+    dense:  one value per bar, of an explicit dtype (float64 by default, float32 halves the size)
+    memmap: same, backed by a `.npy` file, for runs longer than memory
+    sparse: only the bars where the value changes are recorded, the dense column is
+            rebuilt when it is read (i.e. by `Backtester.history()`)
+
+A balance only changes when a trade is closed, so a sparse balance / commission history
+is a few records per trade instead of one value per bar.
+
+i.e:
+    bt = Backtester(dataset=df, history_dtype="float32", sparse_history=True)
+    bt = Backtester(dataset=df, history_dir="./history")  # memory-mapped files, in ./history/run-*/
+"""
+
+import os
+
+import numpy as np
+
+
+class SparseHistory:
+    """Values recorded only where they change, written in bar order."""
+
+    def __init__(self, length: int, fill, dtype=np.float64, capacity: int = 64):
+        self.length = length
+        self.fill = fill
+        self.dtype = np.dtype(dtype)
+        self.bars = np.empty(capacity, dtype=np.int64)
+        self.values = np.empty(capacity, dtype=self.dtype)
+        self.__count = 0
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def nbytes(self) -> int:
+        return self.bars.nbytes + self.values.nbytes
+
+    @property
+    def __last(self):
+        return self.values[self.__count - 1] if self.__count else self.dtype.type(self.fill)
+
+    def __append(self, bars: np.ndarray, values: np.ndarray):
+        count = self.__count + len(bars)
+        if count > len(self.bars):
+            capacity = max(count, 2 * len(self.bars))
+            self.bars = np.resize(self.bars, capacity)
+            self.values = np.resize(self.values, capacity)
+        self.bars[self.__count : count] = bars
+        self.values[self.__count : count] = values
+        self.__count = count
+
+    def __set(self, bar: int, value):
+        value = self.dtype.type(value)
+        last_bar = self.bars[self.__count - 1] if self.__count else -1
+        if bar < last_bar:
+            raise ValueError(f"sparse history is written in bar order, bar {bar} is before bar {last_bar}")
+
+        if bar == last_bar:
+            # overwrite the value of the bar, dropping the record if it is no more a change
+            self.__count -= 1
+        if value != self.__last:
+            self.__append([bar], [value])
+
+    def __setitem__(self, key, value):
+        if not isinstance(key, slice):
+            return self.__set(int(key), value)
+
+        start, stop, step = key.indices(self.length)
+        if step != 1:
+            raise ValueError("sparse history slices must be contiguous")
+        if stop <= start:
+            return
+        if np.ndim(value) == 0:
+            return self.__set(start, value)
+
+        values = np.asarray(value).astype(self.dtype, copy=False)
+        self.__set(start, values[0])
+        changed = np.flatnonzero(values[1:] != values[:-1]) + 1
+        self.__append(start + changed, values[changed])
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.to_numpy()[key]
+        position = np.searchsorted(self.bars[: self.__count], key, side="right") - 1
+        return self.values[position] if position >= 0 else self.dtype.type(self.fill)
+
+    def to_numpy(self) -> np.ndarray:
+        """The dense column, one value per bar."""
+        values = np.r_[np.array([self.fill], dtype=self.dtype), self.values[: self.__count]]
+        positions = np.searchsorted(self.bars[: self.__count], np.arange(self.length), side="right")
+        return values[positions]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.to_numpy() if dtype is None else self.to_numpy().astype(dtype)
+
+
+def new_history(length: int, fill, dtype=np.float64, path: str = None, sparse: bool = False):
+    """Allocate a history buffer of `length` bars initialized to `fill`.
+
+    Args:
+        length (int): number of bars.
+        fill: value before the first write.
+        dtype (optional): dtype of the values. Defaults to np.float64.
+        path (str, optional): `.npy` file backing the values (memory-mapped). Defaults to None (in memory).
+        sparse (bool, optional): record only the changes, see `SparseHistory`. Defaults to False.
+    """
+    if sparse:
+        return SparseHistory(length, fill, dtype)
+    if path is None:
+        return np.full(length, fill, dtype=dtype)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    history = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(length,))
+    history[:] = fill
+    return history
+
+
+def dense(history) -> np.ndarray:
+    """The history as one value per bar (sparse histories are rebuilt)."""
+    return history.to_numpy() if isinstance(history, SparseHistory) else history
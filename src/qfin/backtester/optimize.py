@@ -0,0 +1,363 @@
+"""
+Parameter search with early stopping of the losing candidates.
+
+    random:  `n_trials` random candidates, each run on the whole dataset
+    halving: successive halving, `n_trials` random candidates are run on a prefix of the
+             dataset, the best 1 / eta are run again on a prefix eta times longer, and so
+             on until the whole dataset
+    tpe:     Bayesian-style search (tree-structured Parzen estimator), the next candidates
+             are drawn where the best results so far are denser than the others
+
+Every run is watched by an `EquityGuard` (the `stop_when` of the `Backtester`), reading
+the equity history mid-run: a candidate whose equity falls under `min_equity` or whose
+drawdown goes over `max_drawdown` is stopped there and pruned. The runs are evaluated in
+parallel processes, the dataset is sent once to each of them.
+
+The search space maps each parameter to a list of values (choice), a (low, high) pair
+of ints (integer range, inclusive) or of floats (uniform), (low, high, "log") for a log scale.
+The strategy is a function or name (see `qfin.backtester.batch.resolve_strategy`) taking
+the dataset and keyword parameters, passing `stop_when` on to its `Backtester`, and
+returning the finished `Backtester`.
+
+i.e:
+    result = optimize(
+        "my_strategies:ma_cross",
+        df,
+        space={"fast": (5, 50), "slow": (20, 200), "commission": [0.001, 0.0005]},
+        method="halving",
+        n_trials=81,
+        max_drawdown=0.2,
+    )
+    result.best_params, result.best_score
+    result.trials  # one row per run: parameters, bars, score, pruned
+"""
+
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .batch import resolve_strategy
+from .history import SparseHistory
+
+
+class EquityGuard:
+    """`stop_when` of a `Backtester`: True when the equity falls too low or the drawdown goes too deep."""
+
+    def __init__(self, min_equity: float = None, max_drawdown: float = None, every: int = 100, warmup: int = 0):
+        """
+        Args:
+            min_equity (float, optional): stop under this fraction of the initial balance, i.e. 0.8. Defaults to None.
+            max_drawdown (float, optional): stop over this drawdown from the equity peak, i.e. 0.2 for 20%. Defaults to None.
+            every (int, optional): bars between two checks. Defaults to 100.
+            warmup (int, optional): bars before the first check. Defaults to 0.
+        """
+        self.min_equity = min_equity
+        self.max_drawdown = max_drawdown
+        self.every = every
+        self.warmup = warmup
+        self.checked = 0  # bars already read from the history
+        self.peak = -np.inf
+        self.equity = None  # last equity read
+
+    def __call__(self, broker) -> bool:
+        bar = broker.state.current_bar
+        if bar < self.warmup or bar - self.checked < self.every:
+            return False
+
+        history = broker.account_main.history_equity
+        start, self.checked = self.checked, bar + 1
+        if isinstance(history, SparseHistory):
+            # only the current value, rebuilding the dense column at every check would cost the whole history
+            equity = np.array([history[bar]], dtype=np.float64)
+        else:
+            equity = np.asarray(history[start : bar + 1], dtype=np.float64)
+        self.equity = float(equity[-1])
+
+        peaks = np.maximum.accumulate(np.r_[self.peak, equity])[1:]
+        self.peak = peaks[-1]
+        if self.min_equity is not None and equity.min() < self.min_equity * broker.params.initial_balance:
+            return True
+        return self.max_drawdown is not None and (1 - equity / peaks).max() > self.max_drawdown
+
+
+# ----------------
+#  search space
+# ----------------
+
+
+def _dimension(values):
+    """helper function: ("choice", values) or ("int" / "float", low, high, log) of a space entry"""
+    if isinstance(values, list):
+        return ("choice", values)
+    low, high, *scale = values
+    kind = "int" if isinstance(low, int) and isinstance(high, int) else "float"
+    return (kind, low, high, scale == ["log"])
+
+
+def _to_unit(dimension, value) -> float:
+    """helper function: a numeric value in [0, 1]"""
+    _, low, high, log = dimension
+    if log:
+        return (math.log(value) - math.log(low)) / (math.log(high) - math.log(low))
+    return (value - low) / (high - low) if high > low else 0.5
+
+
+def _from_unit(dimension, unit: float):
+    kind, low, high, log = dimension
+    unit = min(max(unit, 0.0), 1.0)
+    if log:
+        value = math.exp(math.log(low) + unit * (math.log(high) - math.log(low)))
+    else:
+        value = low + unit * (high - low)
+    return round(value) if kind == "int" else float(value)
+
+
+def _sample(space: dict, rng: np.random.Generator) -> dict:
+    params = {}
+    for name, dimension in space.items():
+        if dimension[0] == "choice":
+            params[name] = dimension[1][rng.integers(len(dimension[1]))]
+        else:
+            params[name] = _from_unit(dimension, rng.random())
+    return params
+
+
+def _tpe(space: dict, observed: list, rng: np.random.Generator, n: int, gamma: float = 0.25, candidates: int = 64) -> list:
+    """helper function: `n` candidates maximizing good(x) / bad(x), the Parzen densities of the best `gamma`
+    fraction of the observed (params, score) and of the others"""
+    observed = sorted(observed, key=lambda o: o[1], reverse=True)
+    split = max(1, math.ceil(gamma * len(observed)))
+    good, bad = [o[0] for o in observed[:split]], [o[0] for o in observed[split:]] or [o[0] for o in observed]
+
+    draws = [{} for _ in range(candidates)]
+    log_ratio = np.zeros(candidates)
+    for name, dimension in space.items():
+        if dimension[0] == "choice":
+            choices = dimension[1]
+            good_density = np.array([1 + sum(p[name] == c for p in good) for c in choices], dtype=np.float64)
+            bad_density = np.array([1 + sum(p[name] == c for p in bad) for c in choices], dtype=np.float64)
+            picks = rng.choice(len(choices), size=candidates, p=good_density / good_density.sum())
+            log_ratio += np.log(good_density[picks] / good_density.sum()) - np.log(bad_density[picks] / bad_density.sum())
+            for draw, pick in zip(draws, picks):
+                draw[name] = choices[pick]
+            continue
+
+        good_centers = np.array([_to_unit(dimension, p[name]) for p in good])
+        bad_centers = np.array([_to_unit(dimension, p[name]) for p in bad])
+        good_sigma = max(0.05, 0.5 * len(good_centers) ** -0.2)
+        bad_sigma = max(0.05, 0.5 * len(bad_centers) ** -0.2)
+        x = np.clip(rng.choice(good_centers, size=candidates) + rng.normal(0, good_sigma, candidates), 0, 1)
+        log_ratio += np.log(_parzen(x, good_centers, good_sigma)) - np.log(_parzen(x, bad_centers, bad_sigma))
+        for draw, unit in zip(draws, x):
+            draw[name] = _from_unit(dimension, unit)
+
+    return [draws[k] for k in np.argsort(-log_ratio)[:n]]
+
+
+def _parzen(x: np.ndarray, centers: np.ndarray, sigma: float) -> np.ndarray:
+    """helper function: gaussian kernel density on [0, 1], mixed with a uniform prior"""
+    kernels = np.exp(-0.5 * ((x[:, None] - centers[None, :]) / sigma) ** 2) / (sigma * math.sqrt(2 * math.pi))
+    return (kernels.sum(axis=1) + 1) / (len(centers) + 1)
+
+
+# ----------------
+#  evaluation
+# ----------------
+
+_dataset = None  # dataset of the worker process
+
+
+def _init(dataset):
+    global _dataset
+    _dataset = dataset
+
+
+def _evaluate(task: dict) -> dict:
+    """helper function: run one candidate on the first `bars` bars, return its score or where it was stopped"""
+    start = time.perf_counter()
+    guard = EquityGuard(**task["guard"])
+    bt = resolve_strategy(task["strategy"])(_dataset.iloc[: task["bars"]], stop_when=guard, **task["params"])
+    result = {"bars": task["bars"], "stopped_bar": bt.stopped_bar, "pruned": bt.stopped_bar is not None}
+
+    if result["pruned"]:
+        result["score"] = np.nan
+    else:
+        stats = bt.stats()
+        objective = task["objective"]
+        score = objective(stats) if callable(objective) else stats[objective]
+        result["score"] = float(score) if task["maximize"] else -float(score)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+class OptimizeResult:
+    """Trials of a search and the best parameters found."""
+
+    def __init__(self, trials: pd.DataFrame, total_bars: int, maximize: bool):
+        self.trials = trials
+        if not maximize:
+            # the scores are maximized internally
+            self.trials["score"] = -self.trials["score"]
+        finals = trials[(trials["bars"] == total_bars) & ~trials["pruned"] & trials["score"].notna()]
+        best = finals.loc[finals["score"].idxmax() if maximize else finals["score"].idxmin()] if len(finals) else None
+        params = [c for c in trials.columns if c.startswith("param.")]
+        self.best_params = None if best is None else {c[len("param.") :]: _plain(best[c]) for c in params}
+        self.best_score = None if best is None else float(best["score"])
+        self.backtests = len(trials)
+        self.bars = int(trials["bars_run"].sum())  # bars actually run, stopped runs count up to their stop
+        self.full_bars = len(trials.drop_duplicates(params)) * total_bars  # the same candidates on the whole dataset
+
+    def __repr__(self):
+        return (
+            f"OptimizeResult(best_score={self.best_score}, best_params={self.best_params}, "
+            f"backtests={self.backtests}, bars={self.bars:,} ({self.bars / max(self.full_bars, 1):.0%} of full runs))"
+        )
+
+
+def _plain(value):
+    return value.item() if hasattr(value, "item") else value
+
+
+class _Runner:
+    """helper class: evaluates tasks in a process pool (or in this process), records the trials"""
+
+    def __init__(self, strategy, dataset, objective, maximize, guard, params, processes):
+        self.strategy = strategy
+        self.objective = objective
+        self.maximize = maximize
+        self.guard = guard
+        self.params = params
+        self.processes = processes or os.cpu_count() or 1
+        self.trials = []
+        self.pool = None
+        if self.processes > 1:
+            self.pool = ProcessPoolExecutor(max_workers=self.processes, initializer=_init, initargs=(dataset,))
+        else:
+            _init(dataset)
+
+    def run(self, candidates: list, bars: int, rung: int = 0) -> list:
+        task = {"strategy": self.strategy, "bars": bars, "guard": self.guard, "objective": self.objective}
+        task["maximize"] = self.maximize
+        tasks = [{**task, "params": {**self.params, **candidate}} for candidate in candidates]
+        results = list(self.pool.map(_evaluate, tasks)) if self.pool else [_evaluate(task) for task in tasks]
+        for candidate, result in zip(candidates, results):
+            bars_run = result["bars"] if result["stopped_bar"] is None else result["stopped_bar"] + 1
+            self.trials.append({**{f"param.{k}": v for k, v in candidate.items()}, "rung": rung, **result, "bars_run": bars_run})
+        return results
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def optimize(
+    strategy,
+    dataset: pd.DataFrame,
+    space: dict,
+    method: str = "halving",
+    n_trials: int = 50,
+    objective="Equity Return [%]",
+    maximize: bool = True,
+    min_equity: float = None,
+    max_drawdown: float = None,
+    check_every: int = 100,
+    warmup: int = 0,
+    eta: int = 3,
+    min_fraction: float = None,
+    n_startup: int = None,
+    params: dict = None,
+    processes: int = None,
+    seed: int = 42,
+) -> OptimizeResult:
+    """Search the parameters of a strategy maximizing (or minimizing) a statistic.
+
+    Args:
+        strategy: function or name of the strategy, see the module documentation.
+        dataset (pd.DataFrame): the bars.
+        space (dict): parameter -> values, see the module documentation.
+        method (str, optional): "random", "halving" or "tpe". Defaults to "halving".
+        n_trials (int, optional): candidates drawn. Defaults to 50.
+        objective (optional): name of a `stats()` value or callable(stats) -> float. Defaults to "Equity Return [%]".
+        maximize (bool, optional): maximize the objective, else minimize it. Defaults to True.
+        min_equity (float, optional): prune under this fraction of the initial balance. Defaults to None.
+        max_drawdown (float, optional): prune over this drawdown, i.e. 0.2. Defaults to None.
+        check_every (int, optional): bars between two checks of the equity. Defaults to 100.
+        warmup (int, optional): bars before the first check. Defaults to 0.
+        eta (int, optional): halving: 1 / eta of the candidates go to the next rung, on eta times more bars. Defaults to 3.
+        min_fraction (float, optional): halving: fraction of the dataset of the first rung. Defaults to enough rungs
+            to bring the candidates down to eta.
+        n_startup (int, optional): tpe: random candidates before the model is used. Defaults to max(10, n_trials // 5).
+        params (dict, optional): fixed keyword parameters of the strategy. Defaults to None.
+        processes (int, optional): worker processes. Defaults to the number of CPUs.
+        seed (int, optional): seed of the candidate draws. Defaults to 42.
+    """
+    space = {name: _dimension(values) for name, values in space.items()}
+    rng = np.random.default_rng(seed)
+    total = len(dataset)
+    guard = {"min_equity": min_equity, "max_drawdown": max_drawdown, "every": check_every, "warmup": warmup}
+    runner = _Runner(strategy, dataset, objective, maximize, guard, params or {}, processes)
+
+    try:
+        if method == "random":
+            runner.run([_sample(space, rng) for _ in range(n_trials)], total)
+        elif method == "halving":
+            _halving(runner, space, rng, total, n_trials, eta, min_fraction)
+        elif method == "tpe":
+            _search_tpe(runner, space, rng, total, n_trials, n_startup or max(10, n_trials // 5))
+        else:
+            raise ValueError(f"unknown method '{method}', expected 'random', 'halving' or 'tpe'")
+    finally:
+        runner.close()
+
+    return OptimizeResult(pd.DataFrame(runner.trials), total, maximize)
+
+
+def _halving(runner: _Runner, space: dict, rng, total: int, n_trials: int, eta: int, min_fraction: float):
+    candidates = [_sample(space, rng) for _ in range(n_trials)]
+    if min_fraction is not None:
+        rungs = max(0, math.ceil(math.log(1 / min_fraction, eta)))
+    else:
+        rungs = max(0, math.ceil(math.log(max(n_trials, 1), eta)) - 1)
+
+    for rung in range(rungs + 1):
+        # the last rung runs the whole dataset, the previous ones 1 / eta of the next one
+        bars = total if rung == rungs else max(2, int(total * eta ** (rung - rungs)))
+        results = runner.run(candidates, bars, rung)
+        ranked = sorted((r["score"], k) for k, r in enumerate(results) if not r["pruned"] and not np.isnan(r["score"]))
+        keep = max(1, math.ceil(len(candidates) / eta))
+        candidates = [candidates[k] for _, k in reversed(ranked[-keep:])]
+        if not candidates or rung == rungs:
+            break
+
+
+def _search_tpe(runner: _Runner, space: dict, rng, total: int, n_trials: int, n_startup: int):
+    seen, observed, runs = set(), [], 0
+    while runs < n_trials:
+        size = min(runner.processes, n_trials - runs)
+        if runs < n_startup or not observed:
+            proposals = [_sample(space, rng) for _ in range(4 * size)]
+        else:
+            # the random draws are a fallback when the model only proposes known candidates (small discrete spaces)
+            proposals = _tpe(space, observed, rng, 4 * size) + [_sample(space, rng) for _ in range(4 * size)]
+
+        candidates = []
+        for candidate in proposals:
+            key = json.dumps(candidate, sort_keys=True)
+            if key not in seen and len(candidates) < size:
+                seen.add(key)
+                candidates.append(candidate)
+        if not candidates:
+            break
+
+        results = runner.run(candidates, total)
+        runs += len(candidates)
+        scores = [r["score"] for r in results if not np.isnan(r["score"])]
+        worst = min([o[1] for o in observed] + scores, default=0.0)
+        for candidate, result in zip(candidates, results):
+            # pruned candidates count as the worst result
+            observed.append((candidate, worst if np.isnan(result["score"]) else result["score"]))
@@ -0,0 +1,269 @@
+"""
+Pending orders: stop, limit, stop-loss, take-profit and trailing stop.
+
+The order fields are stored in one record array indexed by order id. The resting levels
+are kept in two price-sorted books:
+
+    rising:  filled when the price rises to the level (buy stops, sell limits,
+             take-profits of longs, stop-losses of shorts), a bar fills the levels <= high
+    falling: filled when the price falls to the level (sell stops, buy limits,
+             stop-losses of longs, take-profits of shorts), a bar fills the levels >= low
+
+so the fills of a bar are a prefix / suffix of the books found by binary search, and
+matching costs O(log n + fills) whatever the number of resting orders. Trailing stops
+move on every bar and are updated together with vectorized operations.
+
+Orders placed on a bar are matched from the next bar on. A level the bar opens beyond
+is filled at the open, and the fills of a bar are executed in order of distance from
+the open. The stop-loss / take-profit / trailing stop of a trade are cancelled when
+the trade is closed.
+
+i.e:
+    for broker in bt.run():
+        if ...:
+            broker.buy_limit(3950, stop_loss=3900, take_profit=4100)
+        if ...:
+            trade = broker.sell()
+            broker.trailing_stop(trade, distance=50)
+"""
+
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+import pandas as pd
+
+STOP, LIMIT, STOP_LOSS, TAKE_PROFIT, TRAILING = range(5)
+_kinds = ["stop", "limit", "stop_loss", "take_profit", "trailing"]
+
+_order = np.dtype(
+    [
+        ("kind", np.int8),
+        ("is_long", bool),  # direction of the trade opened (entry orders) or closed (exit orders)
+        ("active", bool),
+        ("bar", np.int64),  # bar the order was placed on
+        ("price", np.float64),  # level (NaN for trailing stops)
+        ("value", np.float64),  # entry value, NaN for the default entry value
+        ("stop_loss", np.float64),  # levels / distance attached to the trade opened by an entry order
+        ("take_profit", np.float64),
+        ("trailing", np.float64),  # trailing distance
+        ("extreme", np.float64),  # best price since a trailing stop was placed
+    ]
+)
+
+
+def _nan(value) -> float:
+    return np.nan if value is None else float(value)
+
+
+class OrderBook:
+    """Pending orders of a `BrokerAccount`."""
+
+    def __init__(self, account, capacity: int = 1024):
+        self.account = account
+        self.orders: np.ndarray = np.zeros(capacity, dtype=_order)
+        self.__count = 0  # orders placed so far, the next order id
+        self.__pending = 0
+        self.filled = 0
+        self.__rising = ([], [])  # (sorted levels, order ids)
+        self.__falling = ([], [])
+        self.__trailing = np.empty(0, dtype=np.int64)  # ids of the trailing stops
+        self.__trade = {}  # exit order id -> trade
+        self.__trade_orders = {}  # id(trade) -> exit order ids
+
+    def __len__(self):
+        return self.__pending
+
+    @property
+    def placed(self) -> int:
+        """Number of orders placed so far."""
+        return self.__count
+
+    def __grow(self):
+        orders = np.zeros(len(self.orders) * 2, dtype=_order)
+        orders[: self.__count] = self.orders[: self.__count]
+        self.orders = orders
+
+    def __book(self, kind: int, is_long: bool):
+        rising = (kind in (STOP, TAKE_PROFIT)) == is_long
+        return self.__rising if rising else self.__falling
+
+    def place(
+        self,
+        kind: int,
+        is_long: bool,
+        price: float = None,
+        value: float = None,
+        stop_loss: float = None,
+        take_profit: float = None,
+        trailing: float = None,
+        trade=None,
+    ) -> int:
+        """Add a pending order and return its id.
+
+        Args:
+            kind (int): STOP or LIMIT (entry orders), STOP_LOSS, TAKE_PROFIT or TRAILING (exit orders of `trade`).
+            is_long (bool): direction of the trade to open, ignored for exit orders.
+            price (float, optional): level of the order, the current price for trailing stops.
+            value (float, optional): entry value. Defaults to the account default entry value.
+            stop_loss (float, optional): stop-loss level of the trade opened by an entry order.
+            take_profit (float, optional): take-profit level of the trade opened by an entry order.
+            trailing (float, optional): trailing distance of a trailing stop or of the trade opened by an entry order.
+            trade (Trade, optional): trade closed by an exit order.
+        """
+        if kind >= STOP_LOSS:
+            if trade is None or trade not in self.account.opened_trades:
+                raise ValueError("exit orders need an open trade")
+            is_long = trade.is_long
+        if kind == TRAILING and not trailing:
+            raise ValueError("trailing stops need a 'trailing' distance")
+
+        if self.__count == len(self.orders):
+            self.__grow()
+        order = self.__count
+        self.__count += 1
+        self.__pending += 1
+
+        state = self.account.broker.state
+        self.orders[order] = (
+            kind,
+            is_long,
+            True,
+            state.current_bar,
+            np.nan if kind == TRAILING else price,
+            _nan(value),
+            _nan(stop_loss),
+            _nan(take_profit),
+            _nan(trailing),
+            state.last_price if price is None else price,
+        )
+
+        if trade is not None:
+            self.__trade[order] = trade
+            self.__trade_orders.setdefault(id(trade), []).append(order)
+
+        if kind == TRAILING:
+            self.__trailing = np.append(self.__trailing, order)
+        else:
+            levels, ids = self.__book(kind, is_long)
+            position = bisect_right(levels, price)
+            levels.insert(position, price)
+            ids.insert(position, order)
+        return order
+
+    def cancel(self, order: int):
+        """Cancel a pending order (no-op if it is filled or cancelled)."""
+        record = self.orders[order]
+        if not record["active"]:
+            return
+        self.orders["active"][order] = False
+        self.__pending -= 1
+        self.__trade.pop(order, None)
+
+        if record["kind"] == TRAILING:
+            self.__trailing = self.__trailing[self.__trailing != order]
+            return
+
+        # the order may already be out of the book (filled on this bar)
+        levels, ids = self.__book(record["kind"], record["is_long"])
+        position = bisect_left(levels, record["price"])
+        while position < len(levels) and levels[position] == record["price"]:
+            if ids[position] == order:
+                del levels[position], ids[position]
+                break
+            position += 1
+
+    def cancel_trade(self, trade):
+        """Cancel the exit orders of a trade."""
+        for order in self.__trade_orders.pop(id(trade), []):
+            self.cancel(order)
+
+    def cancel_all(self):
+        for order in np.flatnonzero(self.orders["active"][: self.__count]):
+            self.cancel(order)
+
+    def first_hit(self, high: np.ndarray, low: np.ndarray) -> int:
+        """Position of the first bar of `high` / `low` that may fill an order, len(high) if none."""
+        if len(self.__trailing):
+            return 0
+        hit = np.zeros(len(high), dtype=bool)
+        if self.__rising[0]:
+            hit |= high >= self.__rising[0][0]
+        if self.__falling[0]:
+            hit |= low <= self.__falling[0][-1]
+        return int(np.argmax(hit)) if hit.any() else len(high)
+
+    def match(self, open_: float, high: float, low: float):
+        """Fill the orders reached by a bar."""
+        fills = []  # (order id, fill price)
+
+        levels, ids = self.__rising
+        end = bisect_right(levels, high)
+        if end:
+            fills += [(order, max(level, open_)) for level, order in zip(levels[:end], ids[:end])]
+            del levels[:end], ids[:end]
+
+        levels, ids = self.__falling
+        start = bisect_left(levels, low)
+        if start < len(levels):
+            fills += [(order, min(level, open_)) for level, order in zip(levels[start:], ids[start:])]
+            del levels[start:], ids[start:]
+
+        if len(self.__trailing):
+            fills += self.__match_trailing(open_, high, low)
+
+        fills.sort(key=lambda fill: abs(fill[1] - open_))
+        for order, price in fills:
+            self.__fill(order, price)
+
+    def __match_trailing(self, open_, high, low):
+        orders = self.__trailing
+        is_long = self.orders["is_long"][orders]
+        extreme = self.orders["extreme"][orders]
+        distance = self.orders["trailing"][orders]
+
+        # the level comes from the previous bars, the bar extreme only moves it for the next one
+        level = np.where(is_long, extreme - distance, extreme + distance)
+        hit = np.where(is_long, low <= level, high >= level)
+        self.orders["extreme"][orders] = np.where(is_long, np.maximum(extreme, high), np.minimum(extreme, low))
+        if not hit.any():
+            return []
+
+        self.__trailing = orders[~hit]
+        price = np.where(is_long, np.minimum(level, open_), np.maximum(level, open_))
+        return list(zip(orders[hit].tolist(), price[hit].tolist()))
+
+    def __fill(self, order: int, price: float):
+        record = self.orders[order].copy()
+        if not record["active"]:
+            # cancelled by a previous fill of the same bar
+            return
+        self.orders["active"][order] = False
+        self.__pending -= 1
+        self.filled += 1
+
+        if record["kind"] >= STOP_LOSS:
+            self.account.close_trade(self.__trade.pop(order), price)
+            return
+
+        value = None if np.isnan(record["value"]) else record["value"]
+        if record["is_long"]:
+            trade = self.account.buy(value=value, price=price)
+        else:
+            trade = self.account.sell(value=value, price=price)
+        if trade is None:
+            return
+
+        if not np.isnan(record["stop_loss"]):
+            self.place(STOP_LOSS, trade.is_long, record["stop_loss"], trade=trade)
+        if not np.isnan(record["take_profit"]):
+            self.place(TAKE_PROFIT, trade.is_long, record["take_profit"], trade=trade)
+        if not np.isnan(record["trailing"]):
+            self.place(TRAILING, trade.is_long, price, trailing=record["trailing"], trade=trade)
+
+    def pending(self) -> pd.DataFrame:
+        """The pending orders, by order id."""
+        ids = np.flatnonzero(self.orders["active"][: self.__count])
+        orders = self.orders[ids]
+        data = {name: orders[name] for name in _order.names if name not in ("active", "extreme")}
+        data["kind"] = np.asarray(_kinds)[orders["kind"]]
+        return pd.DataFrame(data, index=pd.Index(ids, name="order"))
@@ -1,10 +1,106 @@
 import datetime as datetime
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+
+# ----------------
+#  downsampling
+# ----------------
+
+
+def _minmax_indices(y: np.ndarray, buckets: int) -> np.ndarray:
+    """Positions of the min and max of each of `buckets` equal buckets (plus the first and last points)."""
+    n = len(y)
+    size = -(-n // buckets)
+    padded = np.pad(y.astype(np.float64), (0, size * buckets - n), mode="edge").reshape(buckets, size)
+    nan = np.isnan(padded)
+    offsets = np.arange(buckets) * size
+    lows = np.argmin(np.where(nan, np.inf, padded), axis=1) + offsets
+    highs = np.argmax(np.where(nan, -np.inf, padded), axis=1) + offsets
+    return np.unique(np.r_[0, np.minimum(lows, n - 1), np.minimum(highs, n - 1), n - 1])
+
+
+def _lttb_indices(y: np.ndarray, points: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: the point of each bucket making the largest triangle with its neighbours."""
+    n = len(y)
+    y = np.nan_to_num(y.astype(np.float64))
+    x = np.arange(n, dtype=np.float64)
+    bounds = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    previous = 0
+    for k in range(points - 2):
+        start, end = bounds[k], bounds[k + 1]
+        next_end = bounds[k + 2] if k + 2 < len(bounds) else n
+        # the next bucket average is the third vertex
+        next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous]) - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        selected[k + 1] = previous
+    return selected
+
+
+def downsample_indices(y, points: int, method: str = "minmax") -> np.ndarray:
+    """Positions of the points to draw so a series of any length keeps about `points` points.
+
+    Args:
+        y: values of the series.
+        points (int): number of points to keep (about 2 per pixel keeps every peak visible).
+        method (str, optional): "minmax" (the min and max of each pixel bucket, exact peaks and drawdowns)
+            or "lttb" (Largest-Triangle-Three-Buckets, smoother shape). Defaults to "minmax".
+    """
+    y = np.asarray(y)
+    if points is None or len(y) <= points or points < 3:
+        return np.arange(len(y))
+    if method == "minmax":
+        return _minmax_indices(y, max(points // 2, 1))
+    if method == "lttb":
+        return _lttb_indices(y, points)
+    raise ValueError(f"unknown downsampling method '{method}', use 'minmax' or 'lttb'")
+
+
+def _intervals(trades: pd.DataFrame, history: pd.DataFrame, side: str):
+    """(first, last) bars of the merged position intervals of one side, from the trades or the history column."""
+    if trades is not None:
+        side_trades = trades[trades["is_long"] == (side == "long")]
+        starts = side_trades["entry_bar"].to_numpy(dtype=np.int64)
+        ends = side_trades["exit_bar"].to_numpy(dtype=np.int64)
+        order = np.argsort(starts, kind="stable")
+        starts, ends = starts[order], ends[order]
+    else:
+        mask = np.r_[False, history[side].to_numpy(dtype=bool), False]
+        changes = np.flatnonzero(mask[1:] != mask[:-1])
+        starts, ends = changes[::2], np.minimum(changes[1::2], len(history) - 1)
+
+    if not len(starts):
+        return starts, ends
+    # merge the intervals touching or overlapping the previous ones (consecutive or hedged trades)
+    reach = np.maximum.accumulate(ends)
+    new = np.r_[True, starts[1:] > reach[:-1]]
+    return starts[new], reach[np.r_[np.flatnonzero(new)[1:] - 1, len(starts) - 1]]
+
+
+def _segments(positions: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+    """Positions inside the [start, end] intervals (with their bounds), and -1 between two intervals (a gap)."""
+    if not len(starts):
+        return np.empty(0, dtype=np.int64)
+    positions = np.union1d(positions, np.r_[starts, ends])
+    interval = np.searchsorted(starts, positions, side="right") - 1
+    inside = (interval >= 0) & (positions <= ends[np.maximum(interval, 0)])
+    positions, interval = positions[inside], interval[inside]
+    gaps = np.flatnonzero(np.diff(interval)) + 1
+    return np.insert(positions, gaps, -1)
+
+
+def _line(index, values: np.ndarray, positions: np.ndarray):
+    """x, y of the points at `positions` (-1: a gap, y is NaN)."""
+    gap = positions < 0
+    x = index[np.where(gap, np.maximum.accumulate(np.maximum(positions, 0)), positions)]
+    y = np.where(gap, np.nan, values[np.maximum(positions, 0)].astype(np.float64))
+    return x, y
 
 
 def plot_basic(
@@ -14,6 +110,10 @@ def plot_basic(
     w: int = 1024,
     h: int = 900,
     show_signals: bool = False,
+    trades: pd.DataFrame = None,
+    max_points="auto",
+    downsample: str = "minmax",
+    gl_threshold: int = 20_000,
 ):
     """
     Generate a basic backtesting plot.
@@ -25,10 +125,19 @@ def plot_basic(
     - width (int): Plot width.
     - height (int): Plot height.
     - show_signals (bool): Show signals in the plot. Default is False.
+    - trades (pandas.DataFrame): Trades, the long/short overlays are built from their intervals.
+      Default is None (from the history).
+    - max_points (int | "auto" | None): Points per trace above which the series are downsampled. Default is "auto" (2 per pixel).
+    - downsample (str): "minmax" or "lttb", see `downsample_indices`. Default is "minmax".
+    - gl_threshold (int): Points per trace above which the traces are drawn with WebGL (Scattergl). Default is 20_000.
 
     Returns:
     None
     """
+    # plotly is only loaded when plotting
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
     _s = "&#36;"
     hdf = history
 
@@ -48,21 +157,45 @@ def plot_basic(
     rows = 3 if show_signals else 2
 
     # create the subplots
-    fig = make_subplots(rows=rows, cols=1, shared_xaxes=True, vertical_spacing=0.05, row_heights=row_heights, subplot_titles=subplot_titles)  # fmt: off
+    fig = make_subplots(
+        rows=rows, cols=1, shared_xaxes=True, vertical_spacing=0.05, row_heights=row_heights, subplot_titles=subplot_titles
+    )
+
+    # downsample every series to about `max_points` points, keeping its peaks and drawdowns
+    max_points = 2 * w if max_points == "auto" else max_points
+    index = hdf.index
+
+    def series(column):
+        values = hdf[column].to_numpy()
+        return _line(index, values, downsample_indices(values, max_points, downsample))
+
+    def trace(x, **kwargs):
+        return (go.Scattergl if len(x) > gl_threshold else go.Scatter)(x=x, **kwargs)
 
     # --row1: add price and signals traces
-    fig.add_trace(go.Scatter(x=hdf.index, name="Close Price", y=hdf['close'], line=dict(color="grey")), row=1, col=1)  # fmt: off
-    fig.add_trace(go.Scatter(x=hdf.index, name="Long", y=np.where((hdf["long"]) | (hdf["long"].shift(1)), hdf['close'], None), line_color="blue"), row=1, col=1)  # fmt: off
-    fig.add_trace(go.Scatter(x=hdf.index, name="Short", y=np.where((hdf["short"]) | (hdf["short"].shift(1)), hdf['close'], None), line_color="red"), row=1, col=1)  # fmt: off
+    close = hdf["close"].to_numpy()
+    close_positions = downsample_indices(close, max_points, downsample)
+    x, y = _line(index, close, close_positions)
+    fig.add_trace(trace(x, name="Close Price", y=y, line=dict(color="grey")), row=1, col=1)  # fmt: off
+    x, y = _line(index, close, _segments(close_positions, *_intervals(trades, hdf, "long")))
+    fig.add_trace(trace(x, name="Long", y=y, line_color="blue"), row=1, col=1)  # fmt: off
+    x, y = _line(index, close, _segments(close_positions, *_intervals(trades, hdf, "short")))
+    fig.add_trace(trace(x, name="Short", y=y, line_color="red"), row=1, col=1)  # fmt: off
 
     # --row2: add balance and equity traces
-    fig.add_trace(go.Scatter(x=hdf.index, name="Balance", y=hdf['balance'],  line=dict(color="green")), row=2, col=1)  # fmt: off
-    fig.add_trace(go.Scatter(x=hdf.index, name="Equity", y=hdf['equity'], line=dict(color="orange", width=0.5), visible='legendonly'), row=2, col=1)  # fmt: off
-    fig.add_trace(go.Scatter(x=hdf.index, name="Buy & Hold", y=hdf['buy_hold'], line=dict(color="grey", width=0.7, dash="dot"), visible='legendonly'), row=2, col=1)  # fmt: off
+    x, y = series("balance")
+    fig.add_trace(trace(x, name="Balance", y=y,  line=dict(color="green")), row=2, col=1)  # fmt: off
+    x, y = series("equity")
+    equity_line = dict(color="orange", width=0.5)
+    fig.add_trace(trace(x, name="Equity", y=y, line=equity_line, visible="legendonly"), row=2, col=1)
+    x, y = series("buy_hold")
+    hold_line = dict(color="grey", width=0.7, dash="dot")
+    fig.add_trace(trace(x, name="Buy & Hold", y=y, line=hold_line, visible="legendonly"), row=2, col=1)
 
     # --row3: add signals traces
     if show_signals:
-        fig.add_trace(go.Scatter(x=hdf.index, name="Signal", y=hdf['signal'], line=dict(color="black", width=1), mode="lines"), row=3, col=1)  # fmt: off
+        x, y = series("signal")
+        fig.add_trace(trace(x, name="Signal", y=y, line=dict(color="black", width=1), mode="lines"), row=3, col=1)  # fmt: off
 
     # --settings
     # fig.for_each_xaxis(lambda axis: axis.title.update(font=dict(size=10)))
@@ -72,7 +205,9 @@ def plot_basic(
     fig.layout.annotations[1].font = dict(size=12)
 
     # update the plot layout
-    fig.update_layout(width=w, height=h, title_text=title, font_color="blue", title_font_color="black", font=dict(size=11, color="Black"))  # fmt: off
+    fig.update_layout(
+        width=w, height=h, title_text=title, font_color="blue", title_font_color="black", font=dict(size=11, color="Black")
+    )
     fig.update_layout(yaxis3=dict(range=[-1, 1], dtick=1))
     fig.update_layout(hovermode="x unified")
     fig.update_traces(xaxis="x2")
@@ -86,28 +221,33 @@ def plot_basic(
     footer_result += f"buy & hold: {hold_final_str} ({hold_perc}%)<br>"
 
     # display the plot footer
-    fig.add_annotation( text=footer_result, showarrow=False, x=0.0, y=-0.15, xref="paper", yref="paper", xanchor="left", yanchor="bottom", xshift=-1, yshift=-5, font=dict(size=10, color="grey"), align="left")  # fmt: off
+    fig.add_annotation(
+        text=footer_result,
+        showarrow=False,
+        x=0.0,
+        y=-0.15,
+        xref="paper",
+        yref="paper",
+        xanchor="left",
+        yanchor="bottom",
+        xshift=-1,
+        yshift=-5,
+        font=dict(size=10, color="grey"),
+        align="left",
+    )
     fig.update_layout(margin=dict(l=30, r=10, t=50, b=100))
 
     # show the plot
     fig.show()
 
 
-def plot_thumbnail(
-    history: pd.DataFrame,
-    params: dict,
-    stats: dict,
-    title: str = "Backtest",
-    w: int = 4,
-    h: int = 1,
-):
-    _s = "&#36;"
+def _thumbnail_payload(history: pd.DataFrame, initial_balance: float, stats, title: str = None, points: int = None) -> dict:
+    """helper function: what a thumbnail shows, the balance downsampled to about `points` points"""
     hdf = history
 
-    # calculate balance final percentage and string representation
-    balance_start = params.initial_balance
+    # calculate balance final percentage
+    balance_start = initial_balance
     balance_end = hdf.iloc[-1]["balance"]
-    balance_final_str = str(f"{_s}{hdf.iloc[-1]['balance']:,.2f}")
     balance_final_perc = round(((balance_end / balance_start) - 1) * 100, 2)
 
     color = "green" if balance_final_perc > 0 else "red"
@@ -118,17 +258,33 @@ def plot_thumbnail(
     if title:
         text = f"{title} {text}"
 
-    plt.figure(figsize=(w, h))
-    plt.plot(hdf.index, hdf["balance"], color=color)
-
     if isinstance(stats, pd.Series):
         max_drawdown = round(stats["Max. Drawdown [%]"], 2)
         avg_drawdown = round(stats["Avg. Drawdown [%]"], 2)
         text2 = text2 + f"\n{max_drawdown}%\n(avg:{avg_drawdown})"
-        # plt.annotate(f"{max_drawdown}%", xy=(1, 1), xycoords="axes fraction")
 
-    plt.annotate(text, xy=(0, 1), xycoords="axes fraction", size=10)
-    plt.annotate(text2, xy=(0, 0.5), xycoords="axes fraction", color="grey", size=8)
+    balance = hdf["balance"].to_numpy()
+    positions = downsample_indices(balance, points)
+    return {"x": hdf.index[positions], "y": balance[positions], "color": color, "text": text, "text2": text2}
+
+
+def plot_thumbnail(
+    history: pd.DataFrame,
+    params: dict,
+    stats: dict,
+    title: str = "Backtest",
+    w: int = 4,
+    h: int = 1,
+):
+    import matplotlib.pyplot as plt
+
+    thumbnail = _thumbnail_payload(history, params.initial_balance, stats, title)
+
+    plt.figure(figsize=(w, h))
+    plt.plot(thumbnail["x"], thumbnail["y"], color=thumbnail["color"])
+
+    plt.annotate(thumbnail["text"], xy=(0, 1), xycoords="axes fraction", size=10)
+    plt.annotate(thumbnail["text2"], xy=(0, 0.5), xycoords="axes fraction", color="grey", size=8)
 
     plt.axis("off")
     plt.show()
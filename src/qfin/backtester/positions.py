@@ -0,0 +1,128 @@
+"""
+Open positions of an account.
+
+The positions are stored in arrays indexed by slot. When a position is closed, its slot
+goes back to a free-list and the next position reuses it, so opening and closing are
+O(1) whatever the number of positions held. The slots are also chained in opening order
+(a doubly linked list), which gives the oldest / newest positions for FIFO / LIFO closes
+without scanning. All the positions are marked to market together with vectorized
+operations.
+
+i.e:
+    bt = Backtester(dataset=df, hedging=True)
+    for broker in bt.run():
+        broker.buy(value=100)  # one more lot
+        broker.close_lots(3, policy="fifo")
+        broker.account_main.opened_trades.pl(broker.state.last_price)  # profit / loss per position
+"""
+
+import numpy as np
+
+
+class PositionStore:
+    """Open trades by slot, with O(1) add / remove and opening order."""
+
+    def __init__(self, capacity: int = 64):
+        self.trades = [None] * capacity
+        self.is_long = np.zeros(capacity, dtype=bool)
+        # free slots keep a zero value / commission and a price of 1, so they add nothing to the marks
+        self.entry_value = np.zeros(capacity)
+        self.entry_price = np.ones(capacity)
+        self.commission = np.zeros(capacity)
+        self.__prev = [-1] * capacity
+        self.__next = [-1] * capacity
+        self.__free = list(range(capacity - 1, -1, -1))
+        self.__head = -1  # oldest position
+        self.__tail = -1  # newest position
+        self.__count = 0
+        self.__size = 0  # slots used so far, the marks only look at them
+
+    def __len__(self):
+        return self.__count
+
+    def __contains__(self, trade) -> bool:
+        slot = getattr(trade, "slot", None)
+        return slot is not None and self.trades[slot] is trade
+
+    def __iter__(self):
+        return self.ordered()
+
+    def ordered(self, reverse: bool = False):
+        """Open trades from the oldest (or the newest) one."""
+        slot = self.__tail if reverse else self.__head
+        links = self.__prev if reverse else self.__next
+        while slot != -1:
+            following = links[slot]  # read first, the trade may be closed by the caller
+            yield self.trades[slot]
+            slot = following
+
+    def __grow(self):
+        capacity = len(self.trades)
+        self.trades += [None] * capacity
+        self.__prev += [-1] * capacity
+        self.__next += [-1] * capacity
+        self.__free += range(2 * capacity - 1, capacity - 1, -1)
+        self.is_long = np.r_[self.is_long, np.zeros(capacity, dtype=bool)]
+        self.entry_value = np.r_[self.entry_value, np.zeros(capacity)]
+        self.entry_price = np.r_[self.entry_price, np.ones(capacity)]
+        self.commission = np.r_[self.commission, np.zeros(capacity)]
+
+    def add(self, trade):
+        if not self.__free:
+            self.__grow()
+        slot = self.__free.pop()
+        trade.slot = slot
+        self.trades[slot] = trade
+        self.is_long[slot] = trade.is_long
+        self.entry_value[slot] = trade.entry_value
+        self.entry_price[slot] = trade.entry_price
+        self.commission[slot] = trade.commissions
+
+        self.__prev[slot] = self.__tail
+        self.__next[slot] = -1
+        if self.__tail == -1:
+            self.__head = slot
+        else:
+            self.__next[self.__tail] = slot
+        self.__tail = slot
+        self.__count += 1
+        self.__size = max(self.__size, slot + 1)
+
+    def remove(self, trade):
+        if trade not in self:
+            raise ValueError("the trade is not open")
+        slot = trade.slot
+        trade.slot = None
+        self.trades[slot] = None
+        self.entry_value[slot] = 0.0
+        self.entry_price[slot] = 1.0
+        self.commission[slot] = 0.0
+
+        prev, next_ = self.__prev[slot], self.__next[slot]
+        if prev == -1:
+            self.__head = next_
+        else:
+            self.__next[prev] = next_
+        if next_ == -1:
+            self.__tail = prev
+        else:
+            self.__prev[next_] = prev
+        self.__free.append(slot)
+        self.__count -= 1
+
+    def pl(self, price: float) -> np.ndarray:
+        """Profit / loss of every slot at `price` (0 for the free slots), see `Trade.pl_value`."""
+        n = self.__size
+        value, entry = self.entry_value[:n], self.entry_price[:n]
+        perc = np.where(self.is_long[:n], price / entry, entry / price)
+        return value * (perc - 1)
+
+    def commissions(self) -> float:
+        """Commissions spent on the open trades."""
+        return self.commission[: self.__size].sum() if self.__count else 0
+
+    def open_value(self, price: float) -> float:
+        """Profit / loss less the commissions of all the open trades at `price`."""
+        if not self.__count:
+            return 0
+        return (self.pl(price) - self.commission[: self.__size]).sum()
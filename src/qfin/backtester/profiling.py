@@ -0,0 +1,201 @@
+"""
+Opt-in instrumentation of backtest runs.
+
+With `Backtester(..., profile=True)` (or a `Profiler`), the engine methods of the run
+are wrapped with timers and a report is built at the end of the run:
+
+    phases:   engine vs strategy time, set_next_bar / refresh / skip_bars / order matching,
+              history / trades / stats
+    counters: bars, bars visited / yielded, trades opened / closed, orders placed / filled,
+              garbage collections, peak traced memory (`memory=True`, slow)
+
+The report of a run is sent to the sinks (any callable taking the report dict, see
+`log_sink` and `json_sink`) once the results are read too: by `report()`, at the end
+of a `with profiler:` block, or when the next run starts. A run ended early (break,
+error, `stop_when`) is reported the same way. Without profiling nothing is wrapped,
+so there is no overhead.
+
+i.e:
+    bt = Backtester(dataset=df, profile=Profiler(sinks=[log_sink(), json_sink("./runs.jsonl")]))
+    for broker in bt.run():
+        with bt.profiler.timer("strategy.signals"):
+            ...
+    bt.stats()
+    bt.profiler.report()  # with the stats time, sent to the sinks
+"""
+
+import functools
+import gc
+import json
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def log_sink(logger: logging.Logger = logger, level: int = logging.INFO):
+    """Sink logging a one-line summary of the report."""
+
+    def sink(report: dict):
+        phases = " ".join(f"{name}={phase['seconds']:.3f}s" for name, phase in report["phases"].items())
+        counters = " ".join(f"{name}={value}" for name, value in report["counters"].items())
+        logger.log(level, f"backtest {report['seconds']:.3f}s {phases} {counters}")
+
+    return sink
+
+
+def json_sink(path: str):
+    """Sink appending the report as one JSON line to `path`."""
+
+    def sink(report: dict):
+        with open(path, "a") as f:
+            f.write(json.dumps(report, default=str) + "\n")
+
+    return sink
+
+
+class Profiler:
+    """Timers and counters of a backtest run."""
+
+    def __init__(self, sinks: list = None, memory: bool = False):
+        """
+        Args:
+            sinks (list, optional): callables receiving the report of each run, see `report`. Defaults to None.
+            memory (bool, optional): trace the peak memory of the run with tracemalloc (slow). Defaults to False.
+        """
+        self.sinks = list(sinks or [])
+        self.memory = memory
+        self.pending = False  # a finished run not sent to the sinks yet
+        self.reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.pending:
+            self.emit()
+
+    def reset(self):
+        self.timers = {}  # name -> [nanoseconds, calls]
+        self.counters = {}
+        self.seconds = 0.0
+
+    def add(self, name: str, nanoseconds: int, calls: int = 1):
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [nanoseconds, calls]
+        else:
+            timer[0] += nanoseconds
+            timer[1] += calls
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, name: str):
+        """Time a block, i.e. a part of the strategy body."""
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter_ns() - start)
+
+    def wrap(self, obj, method: str, name: str = None):
+        """Time every call of `obj.method` (the instance attribute shadows the class method)."""
+        function = getattr(obj, method)
+        name = name or f"{type(obj).__name__.lower()}.{method}"
+        add, clock = self.add, time.perf_counter_ns
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add(name, clock() - start)
+
+        setattr(obj, method, timed)
+
+    def instrument(self, broker):
+        """Wrap the engine methods of a broker."""
+        for method in ("set_next_bar", "skip_bars", "refresh"):
+            self.wrap(broker, method)
+        self.wrap(broker.account_main.orders, "match", "orders.match")
+
+    def iterate(self, backtester, bars):
+        """Time a run generator: the time inside the generator is the engine, the time outside is the strategy."""
+        if self.pending:
+            self.emit()
+        self.reset()
+        collections = sum(stat["collections"] for stat in gc.get_stats())
+        if self.memory:
+            tracemalloc.start()
+
+        clock = time.perf_counter_ns
+        engine = strategy = yielded = 0
+        began = resumed = clock()
+        try:
+            for broker in bars:
+                paused = clock()
+                engine += paused - resumed
+                yielded += 1
+                yield broker
+                resumed = clock()
+                strategy += resumed - paused
+            engine += clock() - resumed
+        finally:
+            self.seconds = (clock() - began) / 1e9
+            self.add("engine", engine, 1)
+            self.add("strategy", strategy, yielded)
+            self.counters["bars_yielded"] = yielded
+            self.counters["gc_collections"] = sum(stat["collections"] for stat in gc.get_stats()) - collections
+            if self.memory:
+                self.counters["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self.__count_run(backtester)
+            self.pending = True
+
+    def __count_run(self, backtester):
+        broker = getattr(backtester, "broker", None)
+        if broker is None:
+            return
+        account = broker.account_main
+        counters = self.counters
+        counters["bars"] = broker.state.total_bar
+        counters["bars_visited"] = self.timers.get("broker.set_next_bar", [0, 0])[1]
+        counters["trades_opened"] = len(account.closed_trades) + len(account.opened_trades)
+        counters["trades_closed"] = len(account.closed_trades)
+        counters["orders_placed"] = account.orders.placed
+        counters["orders_filled"] = account.orders.filled
+
+    def report(self) -> dict:
+        """The timers (seconds, calls) and counters, the timers of nested phases include each other.
+
+        The first call after a run sends the report to the sinks.
+        """
+        if self.pending:
+            return self.emit()
+        return self.__report()
+
+    def __report(self) -> dict:
+        phases = {name: {"seconds": ns / 1e9, "calls": calls} for name, (ns, calls) in self.timers.items()}
+        return {"seconds": self.seconds, "phases": phases, "counters": dict(self.counters)}
+
+    def to_frame(self) -> pd.DataFrame:
+        """The timers as a dataframe, with their share of the run time."""
+        frame = pd.DataFrame(self.__report()["phases"]).T
+        frame["calls"] = frame["calls"].astype("int64")
+        frame["pct"] = frame["seconds"] / (self.seconds or float("nan")) * 100
+        return frame
+
+    def emit(self) -> dict:
+        """Send the report to the sinks, and return it."""
+        self.pending = False
+        report = self.__report()
+        for sink in self.sinks:
+            sink(report)
+        return report
@@ -0,0 +1,185 @@
+"""
+Headless batch rendering of backtest thumbnails.
+
+The runs are reduced to small payloads in the calling process (the balance downsampled
+to about 2 points per pixel, and the texts of the thumbnail). A pool of processes then
+draws them on the Agg canvas, with no display and no pyplot. Each worker creates its
+figure once and for each thumbnail only updates the line data and the texts before
+writing the file. A contact sheet is one PNG grid, and the workers write their tiles
+straight into a shared memory-mapped image.
+
+i.e:
+    runs = {name: (bt.history(), bt.stats()) for name, bt in sweep.items()}
+    paths = render_thumbnails(runs, "./thumbnails", fmt="png", page=True)
+    render_contact_sheet(runs, "./sweep.png", columns=8)
+"""
+
+import html
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from .plot import _thumbnail_payload
+
+_figures = {}  # figure of this process by (w, h, dpi), reused for every thumbnail
+
+
+def _figure(w: float, h: float, dpi: int):
+    key = (w, h, dpi)
+    if key not in _figures:
+        figure = Figure(figsize=(w, h), dpi=dpi)
+        FigureCanvasAgg(figure)
+        ax = figure.add_subplot()
+        (line,) = ax.plot([], [])
+        text = ax.annotate("", xy=(0, 1), xycoords="axes fraction", size=10)
+        text2 = ax.annotate("", xy=(0, 0.5), xycoords="axes fraction", color="grey", size=8)
+        ax.axis("off")
+        _figures[key] = (figure, ax, line, text, text2)
+    return _figures[key]
+
+
+def _draw(thumbnail: dict, w: float, h: float, dpi: int) -> Figure:
+    figure, ax, line, text, text2 = _figure(w, h, dpi)
+    line.set_data(thumbnail["x"], thumbnail["y"])
+    line.set_color(thumbnail["color"])
+    ax.relim()
+    ax.autoscale_view()
+    text.set_text(thumbnail["text"])
+    text2.set_text(thumbnail["text2"])
+    return figure
+
+
+def _render_files(jobs: list, w: float, h: float, dpi: int, fmt: str) -> int:
+    for thumbnail, path in jobs:
+        _draw(thumbnail, w, h, dpi).savefig(path, format=fmt, dpi=dpi)
+    return len(jobs)
+
+
+def _render_tiles(jobs: list, w: float, h: float, dpi: int, sheet_path: str) -> int:
+    sheet = np.load(sheet_path, mmap_mode="r+")
+    height, width = int(h * dpi), int(w * dpi)
+    for thumbnail, row, column in jobs:
+        figure = _draw(thumbnail, w, h, dpi)
+        figure.canvas.draw()
+        tile = np.asarray(figure.canvas.buffer_rgba())
+        sheet[row * height : (row + 1) * height, column * width : (column + 1) * width] = tile[:height, :width]
+    sheet.flush()
+    return len(jobs)
+
+
+def _thumbnails(runs, w: float, dpi: int, titles: bool) -> dict:
+    """helper function: payloads of the runs {name: (history, stats)}, the x values as numbers"""
+    thumbnails = {}
+    for name, (history, stats) in dict(runs).items():
+        thumbnail = _thumbnail_payload(
+            history, history["balance"].iloc[0], stats, str(name) if titles else None, points=int(2 * w * dpi)
+        )
+        x = thumbnail["x"]
+        thumbnail["x"] = x.asi8.astype(np.float64) if isinstance(x, pd.DatetimeIndex) else np.arange(len(x), dtype=np.float64)
+        thumbnails[name] = thumbnail
+    return thumbnails
+
+
+def _run(function, jobs: list, processes: int, *args):
+    """helper function: call `function(chunk, *args)` over chunks of the jobs in a process pool"""
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(jobs) < 2:
+        return function(jobs, *args)
+
+    size = max(1, -(-len(jobs) // (processes * 4)))
+    chunks = [jobs[i : i + size] for i in range(0, len(jobs), size)]
+    with ProcessPoolExecutor(max_workers=min(processes, len(chunks))) as pool:
+        return sum(pool.map(function, chunks, *([arg] * len(chunks) for arg in args)))
+
+
+def render_thumbnails(
+    runs,
+    directory: str,
+    fmt: str = "png",
+    w: float = 4,
+    h: float = 1,
+    dpi: int = 100,
+    processes: int = None,
+    titles: bool = True,
+    page: bool = False,
+) -> dict:
+    """Render a thumbnail file per run, without a display.
+
+    Args:
+        runs: {name: (history, stats)} (or pairs), the results of `Backtester.history()` / `Backtester.stats()`.
+        directory (str): output folder.
+        fmt (str, optional): "png" or "svg" (any matplotlib format). Defaults to "png".
+        w (float, optional): width in inches. Defaults to 4.
+        h (float, optional): height in inches. Defaults to 1.
+        dpi (int, optional): resolution. Defaults to 100.
+        processes (int, optional): worker processes. Defaults to the number of CPUs.
+        titles (bool, optional): write the run name before its return. Defaults to True.
+        page (bool, optional): also write an `index.html` review page with the thumbnails and stats. Defaults to False.
+
+    Returns:
+        dict: {name: file path}
+    """
+    os.makedirs(directory, exist_ok=True)
+    runs = dict(runs)
+    thumbnails = _thumbnails(runs, w, dpi, titles)
+    paths = {name: os.path.join(directory, f"{str(name).replace(os.sep, '_')}.{fmt}") for name in thumbnails}
+    _run(_render_files, [(thumbnails[name], paths[name]) for name in thumbnails], processes, w, h, dpi, fmt)
+
+    if page:
+        review_page({name: stats for name, (_, stats) in runs.items()}, paths, os.path.join(directory, "index.html"))
+    return paths
+
+
+def render_contact_sheet(
+    runs,
+    path: str,
+    columns: int = 5,
+    w: float = 4,
+    h: float = 1,
+    dpi: int = 100,
+    processes: int = None,
+    titles: bool = True,
+) -> str:
+    """Render the thumbnails of all the runs in one PNG grid, row by row in the order of `runs`."""
+    from matplotlib.image import imsave
+
+    thumbnails = _thumbnails(runs, w, dpi, titles)
+    rows = -(-len(thumbnails) // columns)
+    height, width = int(h * dpi), int(w * dpi)
+
+    with tempfile.TemporaryDirectory(prefix="qfin-sheet-") as tmp:
+        sheet_path = os.path.join(tmp, "sheet.npy")
+        sheet = np.lib.format.open_memmap(sheet_path, mode="w+", dtype=np.uint8, shape=(rows * height, columns * width, 4))
+        sheet[:] = 255
+        sheet.flush()
+        jobs = [(thumbnail, k // columns, k % columns) for k, thumbnail in enumerate(thumbnails.values())]
+        _run(_render_tiles, jobs, processes, w, h, dpi, sheet_path)
+        imsave(path, sheet)
+        del sheet
+    return path
+
+
+def review_page(stats: dict, paths: dict, path: str, columns: list = None) -> str:
+    """Write an HTML page with the thumbnail and a few statistics of every run."""
+    columns = columns or ["Equity Return [%]", "Max. Drawdown [%]", "Sharpe Ratio", "Win Rate [%]", "Total Trades"]
+    directory = os.path.dirname(os.path.abspath(path))
+
+    rows = []
+    for name, thumbnail in paths.items():
+        run_stats = stats.get(name)
+        cells = "".join(
+            f"<td>{run_stats[c]:.2f}</td>" if isinstance(run_stats, pd.Series) and c in run_stats.index else "<td></td>"
+            for c in columns
+        )
+        source = html.escape(os.path.relpath(thumbnail, directory))
+        rows.append(f"<tr><td>{html.escape(str(name))}</td><td><img src='{source}'></td>{cells}</tr>")
+
+    header = "".join(f"<th>{html.escape(c)}</th>" for c in ["Run", "Balance", *columns])
+    with open(path, "w") as f:
+        f.write(f"<html><body><table><tr>{header}</tr>{''.join(rows)}</table></body></html>")
+    return path
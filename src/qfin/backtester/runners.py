@@ -1,10 +1,12 @@
 from qfin.backtester.backtester import Backtester
+from qfin.backtester.events import on_change
 
 
 def bt_signal_change(dataset, **karg):
     bt = Backtester(dataset=dataset, **karg)
 
-    for broker in bt.run():
+    # only the bars where the signal changes can trade, the other ones are skipped
+    for broker in bt.run(events=[on_change("signal")]):
         current_bar = broker.state.data.iloc[-1]
         previous_bar = broker.state.data.iloc[-2]
 
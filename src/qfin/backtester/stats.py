@@ -48,6 +48,80 @@ def _round_timedelta(value, period):
     return value.ceil(resolution)
 
 
+def _segment_reduce(ufunc, values: np.ndarray, start: np.ndarray, end: np.ndarray, empty: float) -> np.ndarray:
+    """Reduce values[start:end] of every segment (segments may overlap), `empty` for the empty ones."""
+    if not len(start):
+        return np.empty(0)
+    # reduceat over interleaved (start, end) pairs reduces values[start:end] at the even positions,
+    # the extra element makes `end == len(values)` a valid index
+    values = np.r_[values, empty]
+    bounds = np.column_stack([np.minimum(start, len(values) - 1), end]).ravel()
+    reduced = ufunc.reduceat(values, bounds)[::2]
+    return np.where(end > start, reduced, empty)
+
+
+def excursions(trades: pd.DataFrame, high: np.ndarray, low: np.ndarray) -> pd.DataFrame:
+    """Add the excursion metrics to a trades dataframe, for all the trades at once.
+
+    The bars of a trade are the ones after its entry bar up to its exit bar (a trade opened on the
+    close does not see its entry bar range), and the entry / exit prices count as reached prices.
+
+    Added columns:
+        bars_held: exit bar - entry bar
+        mfe_price, mae_price: best / worst price reached, in the trade direction
+        mfe_pct, mae_pct: return at that price (same formula as `return_pct`)
+        mfe, mae: profit / loss at that price in cash units
+        bars_to_mfe, bars_to_mae: bars from the entry to the first bar reaching it
+    """
+    trades = trades.copy()
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    is_long = trades["is_long"].to_numpy(dtype=bool)
+    entry_bar = trades["entry_bar"].to_numpy(dtype=np.int64)
+    exit_bar = trades["exit_bar"].to_numpy(dtype=np.int64)
+    entry_price = trades["entry_price"].to_numpy(dtype=np.float64)
+    exit_price = trades["exit_price"].to_numpy(dtype=np.float64)
+    start, end = entry_bar + 1, exit_bar + 1
+
+    highest = np.fmax(_segment_reduce(np.maximum, high, start, end, -np.inf), np.fmax(entry_price, exit_price))
+    lowest = np.fmin(_segment_reduce(np.minimum, low, start, end, np.inf), np.fmin(entry_price, exit_price))
+    best = np.where(is_long, highest, lowest)
+    worst = np.where(is_long, lowest, highest)
+
+    def pct(price):
+        return np.where(is_long, price / entry_price, entry_price / price) - 1
+
+    # first bar reaching the best / worst price: the bars of all the trades laid end to end
+    lengths = np.maximum(end - start, 0)
+    offsets = np.cumsum(lengths) - lengths
+    segment = np.repeat(np.arange(len(trades)), lengths)
+    bars = np.arange(lengths.sum()) - np.repeat(offsets, lengths) + np.repeat(start, lengths)
+    long_bars = is_long[segment]
+    held = lengths > 0
+    never = np.iinfo(np.int64).max
+
+    def bars_to(price, favorable: bool):
+        reached = np.where(long_bars == favorable, high[bars] >= price[segment], low[bars] <= price[segment])
+        first = np.full(len(trades), never)
+        if held.any():
+            first[held] = np.minimum.reduceat(np.where(reached, bars, never), offsets[held])
+        # not reached by a bar range: the entry price (0 bars) or else the exit price
+        fallback = np.where(price == entry_price, entry_bar, exit_bar)
+        return np.where(first == never, fallback, first) - entry_bar
+
+    entry_value = trades["entry_value"].to_numpy(dtype=np.float64)
+    trades["bars_held"] = exit_bar - entry_bar
+    trades["mfe_price"] = best
+    trades["mae_price"] = worst
+    trades["mfe_pct"] = pct(best)
+    trades["mae_pct"] = pct(worst)
+    trades["mfe"] = entry_value * trades["mfe_pct"]
+    trades["mae"] = entry_value * trades["mae_pct"]
+    trades["bars_to_mfe"] = bars_to(best, favorable=True)
+    trades["bars_to_mae"] = bars_to(worst, favorable=False)
+    return trades
+
+
 def stats(history, trades, risk_free_rate=5):
     """Compute the statistics."""
     indexs = history.index
@@ -0,0 +1,405 @@
+"""
+Parameter sweeps spread over several processes and nodes through a job queue.
+
+A study is a list of job descriptors, plain JSON dicts (dataset path, strategy, params),
+put into a queue by the coordinator. Workers on any node pull the jobs, run the strategy
+and push back a compact result row (the parameters and the stats). A worker holds a lease
+on its job and renews it with heartbeats while the job runs: the job of a worker that
+dies is claimed again when its lease expires, and a failed job is retried up to
+`max_attempts` times. The throughput grows with the number of workers.
+
+`SQLiteQueue` is the local implementation, a SQLite file in WAL mode. It is shared by
+the processes of a node, or by the nodes of a cluster through a file system with working
+locks. Other queues implement the `JobQueue` methods. The dataset paths must be
+readable from every worker.
+
+i.e:
+    queue = SQLiteQueue("./study.db")
+    jobs = study_jobs(["./data/spx.csv"], "bt_signal_change", grid={"commission": [0.001, 0.0005]})
+    queue.put(jobs, study="commission")
+
+    # on every node
+    run_workers(SQLiteQueue("./study.db"), processes=8)
+
+    queue.results("commission")  # a dataframe, one row per job
+
+    qfin-sweep submit study.toml study.db    # batch config (see qfin-bt) with a [grid] table
+    qfin-sweep work study.db --processes 8
+    qfin-sweep status study.db
+    qfin-sweep results study.db --output results.csv  # or .parquet (needs pyarrow)
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+
+from ._sqlite import Transaction
+from .batch import _json_value, _path, load_config, load_dataset, plan_jobs, require_parquet, resolve_strategy
+
+logger = logging.getLogger(__name__)
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+
+def study_jobs(
+    datasets: list, strategy: str, grid: dict = None, params: dict = None, columns: list = None, store: str = None
+) -> list:
+    """Job descriptors of every dataset and every combination of the `grid` values.
+
+    Args:
+        datasets (list): dataset paths (CSV or Parquet).
+        strategy (str): strategy name, see `qfin.backtester.batch.resolve_strategy`.
+        grid (dict, optional): parameter -> list of values. Defaults to None (one job per dataset).
+        params (dict, optional): parameters common to all the jobs. Defaults to None.
+        columns (list, optional): dataset columns to read. Defaults to all.
+        store (str, optional): folder of an `ExperimentStore`, the jobs already run are read from it. Defaults to None.
+    """
+    jobs = []
+    for path in datasets:
+        name = os.path.splitext(os.path.basename(path))[0]
+        job = {"name": name, "dataset": os.path.abspath(path), "strategy": strategy, "params": dict(params or {})}
+        jobs.append({**job, "columns": columns, "store": store})
+    return expand_grid(jobs, grid)
+
+
+def expand_grid(jobs: list, grid: dict = None) -> list:
+    """helper function: one copy of each job per combination of the grid values"""
+    if not grid:
+        return jobs
+    names = list(grid)
+    expanded = []
+    for job in jobs:
+        for values in itertools.product(*(grid[name] for name in names)):
+            expanded.append({**job, "params": {**job["params"], **dict(zip(names, values))}})
+    return expanded
+
+
+class JobQueue(ABC):
+    """Interface of the sweep queues, see `SQLiteQueue`."""
+
+    @abstractmethod
+    def put(self, jobs: list, study: str = "default") -> list:
+        """Add job descriptors, return their ids."""
+
+    @abstractmethod
+    def claim(self, worker: str):
+        """Lease the next job to a worker, return (id, descriptor) or None when there is nothing to run."""
+
+    @abstractmethod
+    def heartbeat(self, job: int, worker: str) -> bool:
+        """Renew the lease of a running job, False if the worker lost it."""
+
+    @abstractmethod
+    def complete(self, job: int, worker: str, result: dict):
+        """Store the result of a job run by `worker`."""
+
+    @abstractmethod
+    def fail(self, job: int, worker: str, error: str):
+        """Put the job back in the queue, or mark it failed after `max_attempts` attempts."""
+
+    @abstractmethod
+    def counts(self, study: str = None) -> dict:
+        """Number of jobs by status."""
+
+    @abstractmethod
+    def results(self, study: str = None):
+        """The result rows of the finished jobs, as a dataframe."""
+
+
+class SQLiteQueue(JobQueue):
+    """Job queue in a SQLite file, safe for concurrent workers."""
+
+    def __init__(self, path: str, lease: float = 60.0, max_attempts: int = 3):
+        """
+        Args:
+            path (str): database file, created if needed.
+            lease (float, optional): seconds a job stays leased without heartbeat. Defaults to 60.
+            max_attempts (int, optional): runs of a job before it is marked failed. Defaults to 3.
+        """
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.__local = threading.local()
+        with self.__transaction() as db:
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY,
+                    study TEXT NOT NULL,
+                    descriptor TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    lease_until REAL,
+                    result TEXT,
+                    error TEXT,
+                    seconds REAL
+                )"""
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+
+    def __getstate__(self):
+        # the connections are not sent to the worker processes, each one opens its own
+        return {"path": self.path, "lease": self.lease, "max_attempts": self.max_attempts}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __connection(self) -> sqlite3.Connection:
+        db = getattr(self.__local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.__local.db = db
+        return db
+
+    def __transaction(self):
+        return Transaction(self.__connection())
+
+    def put(self, jobs: list, study: str = "default") -> list:
+        with self.__transaction() as db:
+            first = db.execute("SELECT COALESCE(MAX(id), 0) FROM jobs").fetchone()[0] + 1
+            db.executemany(
+                "INSERT INTO jobs (study, descriptor, status) VALUES (?, ?, ?)",
+                ((study, json.dumps(job, default=str), PENDING) for job in jobs),
+            )
+        return list(range(first, first + len(jobs)))
+
+    def claim(self, worker: str):
+        now = time.time()
+        with self.__transaction() as db:
+            # the jobs of dead workers: retried, or failed when out of attempts
+            db.execute(
+                "UPDATE jobs SET status = ?, error = 'lease expired', worker = NULL"
+                " WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (FAILED, RUNNING, now, self.max_attempts),
+            )
+            row = db.execute(
+                "SELECT id, descriptor FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?) ORDER BY id LIMIT 1",
+                (PENDING, RUNNING, now),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                (RUNNING, worker, now + self.lease, row[0]),
+            )
+        return row[0], json.loads(row[1])
+
+    def heartbeat(self, job: int, worker: str) -> bool:
+        with self.__transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = ?",
+                (time.time() + self.lease, job, worker, RUNNING),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job: int, worker: str, result: dict):
+        with self.__transaction() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, result = ?, seconds = ?, worker = ?, error = NULL WHERE id = ? AND status != ?",
+                (DONE, json.dumps(result), result.get("seconds"), worker, job, DONE),
+            )
+
+    def fail(self, job: int, worker: str, error: str):
+        with self.__transaction() as db:
+            db.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, worker = NULL"
+                " WHERE id = ? AND worker = ? AND status = ?",
+                (self.max_attempts, FAILED, PENDING, error, job, worker, RUNNING),
+            )
+
+    def counts(self, study: str = None) -> dict:
+        where, args = ("WHERE study = ?", (study,)) if study else ("", ())
+        rows = self.__connection().execute(f"SELECT status, COUNT(*) FROM jobs {where} GROUP BY status", args)
+        return {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0, **dict(rows.fetchall())}
+
+    def failures(self, study: str = None) -> list:
+        """(id, descriptor, error) of the failed jobs."""
+        where, args = ("AND study = ?", (study,)) if study else ("", ())
+        rows = self.__connection().execute(f"SELECT id, descriptor, error FROM jobs WHERE status = ? {where}", (FAILED, *args))
+        return [(job, json.loads(descriptor), error) for job, descriptor, error in rows]
+
+    def results(self, study: str = None):
+        import pandas as pd
+
+        where, args = ("AND study = ?", (study,)) if study else ("", ())
+        rows = self.__connection().execute(
+            f"SELECT id, study, result FROM jobs WHERE status = ? {where} ORDER BY id", (DONE, *args)
+        )
+        records = [{"job": job, "study": name, **json.loads(result)} for job, name, result in rows]
+        return pd.DataFrame(records).set_index("job") if records else pd.DataFrame()
+
+
+_datasets = {}  # dataset of the last job of this process, (path, columns) -> dataframe
+_stores = {}  # experiment stores of this process by folder
+
+
+def _dataset(job: dict):
+    key = (job["dataset"], json.dumps(job.get("columns")))
+    if key not in _datasets:
+        # the jobs of a study mostly share their dataset, keep only the last one
+        _datasets.clear()
+        _datasets[key] = load_dataset(job["dataset"], job.get("columns"))
+    return _datasets[key]
+
+
+def run_job(job: dict) -> dict:
+    """Run a job descriptor and return its result row: the name, dataset, parameters, stats and whether it was cached."""
+    start = time.perf_counter()
+    params = job.get("params", {})
+    store = job.get("store")
+    if store is not None:
+        from .experiments import ExperimentStore
+
+        if store not in _stores:
+            _stores[store] = ExperimentStore(store)
+        store = _stores[store]
+        key = store.key(job["strategy"], job["dataset"], params, job.get("columns"))
+        experiment = store.get(key)
+        if experiment is None:
+            bt = resolve_strategy(job["strategy"])(_dataset(job), **params)
+            experiment = store.put(key, bt, job["strategy"], job["dataset"], params, seconds=time.perf_counter() - start)
+        stats, cached = experiment.stats.items(), experiment.cached
+    else:
+        stats, cached = resolve_strategy(job["strategy"])(_dataset(job), **params).stats().items(), False
+
+    return {
+        "name": job.get("name"),
+        "dataset": job["dataset"],
+        **{f"param.{name}": value for name, value in params.items()},
+        **{name: _json_value(value) for name, value in stats if not name.startswith("_")},
+        "cached": cached,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def run_worker(queue: JobQueue, worker: str = None, heartbeat: float = None, poll: float = 1.0, wait: bool = False) -> int:
+    """Pull and run jobs until the queue is empty, return the number of jobs run.
+
+    Args:
+        queue (JobQueue): the queue of the study.
+        worker (str, optional): worker id. Defaults to host:pid:random.
+        heartbeat (float, optional): seconds between lease renewals. Defaults to a third of the queue lease.
+        poll (float, optional): seconds between claims when the queue is empty. Defaults to 1.
+        wait (bool, optional): keep polling when the queue is empty, for jobs put later. Defaults to False.
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    heartbeat = heartbeat or getattr(queue, "lease", 60.0) / 3
+    done = 0
+    while True:
+        claimed = queue.claim(worker)
+        if claimed is None:
+            counts = queue.counts()
+            if not wait and not counts[PENDING] and not counts[RUNNING]:
+                return done
+            time.sleep(poll)
+            continue
+
+        job, descriptor = claimed
+        stop = threading.Event()
+        beats = threading.Thread(target=_heartbeats, args=(queue, job, worker, heartbeat, stop), daemon=True)
+        beats.start()
+        try:
+            result = run_job(descriptor)
+        except Exception:
+            logger.warning(f"job {job} failed on {worker}", exc_info=True)
+            queue.fail(job, worker, traceback.format_exc(limit=5))
+        else:
+            queue.complete(job, worker, result)
+            done += 1
+        finally:
+            stop.set()
+            beats.join()
+
+
+def _heartbeats(queue: JobQueue, job: int, worker: str, interval: float, stop: threading.Event):
+    while not stop.wait(interval):
+        if not queue.heartbeat(job, worker):
+            logger.warning(f"{worker} lost the lease of job {job}")
+            return
+
+
+def run_workers(queue: JobQueue, processes: int = None, **kwargs) -> int:
+    """Run `processes` workers on this node (default: the number of CPUs), return the number of jobs run."""
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        return run_worker(queue, **kwargs)
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(run_worker, queue, **kwargs) for _ in range(processes)]
+        return sum(future.result() for future in futures)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="qfin-sweep", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="put the jobs of a config into the queue")
+    submit.add_argument("config", help="qfin-bt config (TOML or JSON), with a [grid] table: parameter -> values")
+    submit.add_argument("queue", help="queue database")
+    submit.add_argument("--study", help="study name (default: the config file name)")
+    submit.add_argument("--store", help="ExperimentStore folder, the jobs already run are read from it (default: config 'store')")
+
+    work = commands.add_parser("work", help="run workers until the queue is empty")
+    work.add_argument("queue")
+    work.add_argument("-p", "--processes", type=int, help="worker processes (default: the CPU count)")
+    work.add_argument("--wait", action="store_true", help="keep waiting for new jobs")
+    work.add_argument("--lease", type=float, default=60.0, help="seconds before the job of a silent worker is run again")
+
+    status = commands.add_parser("status", help="count the jobs by status")
+    status.add_argument("queue")
+    status.add_argument("--study")
+
+    results = commands.add_parser("results", help="print or write the result rows")
+    results.add_argument("queue")
+    results.add_argument("--study")
+    results.add_argument("--output", help="write the results to this .csv / .parquet (needs pyarrow) file")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    if args.command == "submit":
+        config = load_config(args.config)
+        store = args.store or config.get("store")
+        store = store and os.path.abspath(store if args.store else _path(config, store))
+        jobs = [
+            {**{key: job[key] for key in ("name", "dataset", "strategy", "params", "columns")}, "store": store}
+            for job in expand_grid(plan_jobs(config), config.get("grid"))
+        ]
+        study = args.study or os.path.splitext(os.path.basename(args.config))[0]
+        SQLiteQueue(args.queue).put(jobs, study)
+        print(f"{len(jobs)} jobs put in {args.queue} ({study})")
+    elif args.command == "work":
+        start = time.perf_counter()
+        done = run_workers(SQLiteQueue(args.queue, lease=args.lease), args.processes, wait=args.wait)
+        print(f"{done} jobs run in {time.perf_counter() - start:.1f}s")
+    elif args.command == "status":
+        queue = SQLiteQueue(args.queue)
+        print(" ".join(f"{name}={count}" for name, count in queue.counts(args.study).items()))
+        for job, descriptor, error in queue.failures(args.study):
+            print(f"job {job} {descriptor['name']} {descriptor['params']}: {error.strip().splitlines()[-1]}")
+    else:
+        frame = SQLiteQueue(args.queue).results(args.study)
+        if args.output is None:
+            print(frame.to_string())
+        elif args.output.endswith(".parquet"):
+            require_parquet()
+            frame.to_parquet(args.output)
+        else:
+            frame.to_csv(args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
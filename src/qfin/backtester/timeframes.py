@@ -0,0 +1,138 @@
+"""
+Higher timeframes of a base-resolution dataset.
+
+The aggregated OHLCV bars are built once with vectorized group boundaries, together
+with a map from every base bar to the last higher-timeframe bar that is *completed*
+at that bar, so a strategy reads the higher timeframe in O(1) without look-ahead.
+The bar still forming is updated incrementally as the base bars arrive.
+
+i.e:
+    bt = Backtester(dataset=df_5min, timeframes={"h4": "4h", "d1": "1D"})
+    for broker in bt.run():
+        h4 = broker.timeframe("h4")
+        trend_up = h4.last("close") > h4.last("close", n=2)
+        forming_high = h4.forming["high"]
+"""
+
+import numpy as np
+import pandas as pd
+
+_ohlcv = ["open", "high", "low", "close", "volume"]
+
+
+def _group_bounds(index: pd.DatetimeIndex, rule):
+    """Return (group start position of each group, group label, group end time) for a time rule."""
+    offset = pd.tseries.frequencies.to_offset(rule)
+    try:
+        delta = pd.Timedelta(offset.nanos, unit="ns")
+        labels = index.floor(delta)
+        ends = labels + delta
+    except ValueError:
+        # calendar rules (W, M, Q, Y) are not fixed durations
+        periods = index.to_period(offset)
+        labels = periods.start_time
+        ends = periods.end_time + pd.Timedelta(1, unit="ns")
+
+    keys = labels.asi8
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return starts, labels[starts], ends[starts]
+
+
+class Timeframe:
+    """Aggregated bars of one higher timeframe and the per base bar lookup."""
+
+    def __init__(self, dataset: pd.DataFrame, rule, close_column: str = "close"):
+        """
+        Args:
+            dataset (pd.DataFrame): base-resolution dataset, sorted index.
+            rule (str | int): pandas frequency (i.e. "4h", "1D", "W") or a number of base bars.
+            close_column (str, optional): close column, used for missing open/high/low. Defaults to "close".
+        """
+        self.rule = rule
+        n = len(dataset)
+        close = dataset[close_column].to_numpy(dtype=np.float64)
+        base = {c: dataset[c].to_numpy(dtype=np.float64) if c in dataset.columns else close for c in _ohlcv[:4]}
+        base["close"] = close
+        base["volume"] = dataset["volume"].to_numpy(dtype=np.float64) if "volume" in dataset.columns else np.zeros(n)
+        self.base = base
+
+        if isinstance(rule, int):
+            starts = np.arange(0, n, rule)
+            labels = dataset.index[starts]
+            lengths = np.diff(np.r_[starts, n])
+            # a group of N bars is completed on its N-th bar
+            completed_at = np.where(lengths == rule, starts + lengths - 1, n)
+        else:
+            index = pd.DatetimeIndex(dataset.index)
+            starts, labels, ends = _group_bounds(index, rule)
+            lengths = np.diff(np.r_[starts, n])
+            last = starts + lengths - 1
+            # a group is completed on its last base bar when that bar closes at (or after) the group end,
+            # otherwise only when the next group starts
+            base_period = pd.Series(index[-100:]).diff().median() if n > 1 else pd.Timedelta(0)
+            closes_group = (index[last] + base_period) >= ends
+            completed_at = np.where(closes_group, last, last + 1)
+
+        self.group: np.ndarray = np.repeat(np.arange(len(starts)), lengths)
+        self.completed: np.ndarray = np.searchsorted(completed_at, np.arange(n), side="right") - 1
+        self.starts = starts
+
+        ends = starts + lengths
+        values = {
+            "open": base["open"][starts],
+            "high": np.maximum.reduceat(base["high"], starts) if n else base["high"],
+            "low": np.minimum.reduceat(base["low"], starts) if n else base["low"],
+            "close": base["close"][ends - 1],
+            "volume": np.add.reduceat(base["volume"], starts) if n else base["volume"],
+        }
+        self.values = values
+        self.bars = pd.DataFrame(values, index=labels, copy=False)
+
+        self.current = -1  # position of the last completed bar
+        self.forming = {}
+        self.__bar = -1
+        self.__group = -1
+
+    def __len__(self):
+        return len(self.bars)
+
+    def set_bar(self, index: int):
+        """Move to base bar `index`: O(1) lookup of the last completed bar, incremental forming bar."""
+        base = self.base
+        group = self.group[index]
+        self.current = self.completed[index]
+
+        if group != self.__group or index != self.__bar + 1:
+            # new group (or a jump): start the forming bar from the group first base bar
+            start = self.starts[group]
+            self.forming = {
+                "open": base["open"][start],
+                "high": base["high"][start : index + 1].max(),
+                "low": base["low"][start : index + 1].min(),
+                "close": base["close"][index],
+                "volume": base["volume"][start : index + 1].sum(),
+            }
+        else:
+            forming = self.forming
+            forming["high"] = max(forming["high"], base["high"][index])
+            forming["low"] = min(forming["low"], base["low"][index])
+            forming["close"] = base["close"][index]
+            forming["volume"] += base["volume"][index]
+
+        self.__group = group
+        self.__bar = index
+
+    def last(self, column: str = "close", n: int = 1):
+        """Value of the n-th last completed bar (n=1 the last one), NaN if there is none yet."""
+        position = self.current - n + 1
+        return self.values[column][position] if position >= 0 else np.nan
+
+    @property
+    def time(self):
+        """Label of the last completed bar, None if there is none yet."""
+        return self.bars.index[self.current] if self.current >= 0 else None
+
+    def data(self, n: int = 10) -> pd.DataFrame:
+        """The last `n` completed bars."""
+        end = self.current + 1
+        return self.bars.iloc[max(end - n, 0) : end]
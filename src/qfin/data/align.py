@@ -0,0 +1,82 @@
+"""
+As-of alignment of low-frequency series (macro, fundamentals) onto trading bars.
+
+Every bar gets the last value whose date (plus an optional publication lag) is
+at or before the bar time, so no value is used before it was known.
+
+i.e:
+    macro = fred_many(["M2SL", "CPIAUCSL"])
+    df = df.join(asof_align(df.index, macro, lag={"M2SL": "28D", "CPIAUCSL": "14D"}))
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _split_series(frames) -> dict:
+    """Normalize the input to {name: pd.Series} with the missing values dropped."""
+    if isinstance(frames, pd.Series):
+        frames = {frames.name: frames}
+    elif isinstance(frames, pd.DataFrame):
+        frames = {name: frames[name] for name in frames.columns}
+    elif isinstance(frames, (list, tuple)):
+        frames = {name: frame[name] for frame in frames for name in frame.columns}
+
+    result = {}
+    for name, frame in frames.items():
+        if isinstance(frame, pd.DataFrame):
+            for column in frame.columns:
+                key = name if len(frame.columns) == 1 else f"{name}_{column}"
+                result[key] = frame[column].dropna()
+        else:
+            result[name] = frame.dropna()
+    return result
+
+
+def asof_align(index, frames, lag=None) -> pd.DataFrame:
+    """Align any number of series onto `index` in one pass.
+
+    Series sharing the same dates (i.e. monthly FRED series) are located with a single
+    `np.searchsorted` and gathered together.
+
+    Args:
+        index (pd.DatetimeIndex): bars to align onto, i.e. `Backtester` dataset index (must be sorted).
+        frames (dict | list | pd.DataFrame | pd.Series): series or single/multi column frames,
+            like the output of `fred_many` or a list of `fred` frames.
+        lag (str | pd.Timedelta | dict, optional): publication lag added to the series dates,
+            one for all series or a dict per series name. Defaults to None (no lag).
+
+    Returns:
+        pd.DataFrame: one float column per series on `index` (NaN before the first known value)
+    """
+    series = _split_series(frames)
+    index = pd.DatetimeIndex(index)
+    unit = index.unit  # compare in the unit of the bars, no conversion of the (long) bar index
+    bars = index.asi8
+    out = np.empty((len(series), len(bars)))  # one contiguous row per series
+
+    # group the series by their effective (lagged) dates
+    groups = {}
+    for k, (name, values) in enumerate(series.items()):
+        values = values.sort_index()
+        dates = pd.DatetimeIndex(values.index)
+        shift = lag.get(name) if isinstance(lag, dict) else lag
+        if shift is not None:
+            dates = dates + pd.Timedelta(shift)
+        dates = dates.as_unit(unit).asi8
+        key = (len(dates), dates.tobytes())
+        groups.setdefault(key, (dates, [], []))
+        groups[key][1].append(k)
+        groups[key][2].append(values.to_numpy(dtype=np.float64))
+
+    for dates, columns, values in groups.values():
+        if not len(dates):
+            out[columns] = np.nan
+            continue
+        pos = np.searchsorted(dates, bars, side="right") - 1
+        first = np.searchsorted(pos, 0)  # bars are sorted, so are the positions
+        for column, column_values in zip(columns, values):
+            out[column, :first] = np.nan
+            np.take(column_values, pos[first:], out=out[column, first:])
+
+    return pd.DataFrame(out.T, index=index, columns=list(series), copy=False)
@@ -0,0 +1,203 @@
+"""
+Streaming bar builder from trades / ticks.
+
+Ticks are consumed chunk by chunk (from a file or any iterable of dataframes): the
+bar boundaries of a chunk are found with vectorized operations, the bars are
+aggregated with `reduceat`, and the last (possibly unfinished) bar is carried over
+to the next chunk, so memory stays at the size of one chunk.
+
+Bar types:
+    time:   bars of a fixed duration (size="7min") aligned on the epoch, labeled by their start time
+    tick:   bars of `size` trades
+    volume: a bar ends where the cumulative traded volume crosses a multiple of `size`
+    dollar: same with the traded value (price x volume)
+
+i.e:
+    for bars in build_bars("./trades.csv", kind="dollar", size=5_000_000, chunksize=1_000_000):
+        ...
+    build_bars("./trades.csv", kind="volume", size=100, store=store, symbol="BTCUSD", interval="v100")
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+_columns = ["open", "high", "low", "close", "volume", "trades"]
+
+
+def read_ticks(path: str, chunksize: int = 1_000_000, **kwargs):
+    """Iterate over the ticks of a CSV or Parquet file, `chunksize` rows at a time."""
+    if str(path).endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize, **kwargs)
+
+
+class BarBuilder:
+    """Builds bars from consecutive chunks of ticks."""
+
+    def __init__(
+        self,
+        kind: str = "time",
+        size=None,
+        time: str = "time",
+        price: str = "price",
+        volume: str = "volume",
+        time_unit: str = None,
+    ):
+        """
+        Args:
+            kind (str, optional): "time", "tick", "volume" or "dollar". Defaults to "time".
+            size: bar duration for time bars (i.e. "7min"), trades / volume / value per bar otherwise.
+            time (str, optional): time column, the index is used when there is no such column. Defaults to "time".
+            price (str, optional): price column. Defaults to "price".
+            volume (str, optional): volume column (optional for time/tick bars). Defaults to "volume".
+            time_unit (str, optional): unit of numeric timestamps, i.e. "ms". Defaults to None (parsed by pandas).
+        """
+        if kind not in ("time", "tick", "volume", "dollar"):
+            raise ValueError(f"unknown bar kind '{kind}'")
+        if size is None:
+            raise ValueError("'size' is required")
+
+        self.kind = kind
+        self.size = pd.Timedelta(size).value if kind == "time" else float(size)
+        self.time = time
+        self.price = price
+        self.volume = volume
+        self.time_unit = time_unit
+
+        self.__total = 0.0  # trades / volume / value consumed so far (tick, volume and dollar bars)
+        self.__partial = None  # (bar id, time label, values) of the unfinished last bar
+        self.__tz = None  # timezone of the tick times, kept on the bars
+
+    def __ticks(self, ticks: pd.DataFrame):
+        times = ticks[self.time] if self.time in ticks.columns else ticks.index.to_series()
+        times = pd.to_datetime(times, unit=self.time_unit) if self.time_unit else pd.to_datetime(times)
+        times = pd.DatetimeIndex(times)
+        self.__tz = times.tz
+        times = times.as_unit("ns").asi8  # UTC when the times have a timezone
+        price = ticks[self.price].to_numpy(dtype=np.float64)
+        if self.volume in ticks.columns:
+            volume = ticks[self.volume].to_numpy(dtype=np.float64)
+        else:
+            volume = np.ones(len(price))
+        return times, price, volume
+
+    def __bar_ids(self, times, price, volume):
+        if self.kind == "time":
+            return times // self.size
+
+        if self.kind == "tick":
+            amount = np.ones(len(price))
+        elif self.kind == "volume":
+            amount = volume
+        else:
+            amount = price * volume
+
+        # the tick crossing a multiple of `size` still belongs to the bar it completes
+        cumulative = self.__total + np.cumsum(amount)
+        before = np.concatenate(([self.__total], cumulative[:-1]))  # total before each tick
+        self.__total = cumulative[-1]
+        return np.floor(before / self.size).astype(np.int64)
+
+    def update(self, ticks: pd.DataFrame) -> pd.DataFrame:
+        """Add a chunk of ticks (in time order) and return the bars completed so far."""
+        if not len(ticks):
+            return self.__frame([], np.empty((0, len(_columns))))
+
+        times, price, volume = self.__ticks(ticks)
+        ids = self.__bar_ids(times, price, volume)
+
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        ends = np.r_[starts[1:], len(ids)]
+        values = np.column_stack(
+            [
+                price[starts],
+                np.maximum.reduceat(price, starts),
+                np.minimum.reduceat(price, starts),
+                price[ends - 1],
+                np.add.reduceat(volume, starts),
+                ends - starts,
+            ]
+        )
+        bar_ids = ids[starts]
+        labels = bar_ids * self.size if self.kind == "time" else times[ends - 1]
+
+        # merge the bar carried over from the previous chunk
+        if self.__partial is not None:
+            partial_id, _, partial = self.__partial
+            if bar_ids[0] == partial_id:
+                first = values[0]
+                values[0] = [
+                    partial[0],
+                    max(partial[1], first[1]),
+                    min(partial[2], first[2]),
+                    first[3],
+                    partial[4] + first[4],
+                    partial[5] + first[5],
+                ]
+            else:
+                bar_ids = np.r_[partial_id, bar_ids]
+                labels = np.r_[self.__partial[1], labels]
+                values = np.vstack([partial, values])
+
+        # the last bar may continue in the next chunk
+        self.__partial = (bar_ids[-1], labels[-1], values[-1].copy())
+        return self.__frame(labels[:-1], values[:-1])
+
+    def flush(self) -> pd.DataFrame:
+        """Return the unfinished last bar (end of the data)."""
+        if self.__partial is None:
+            return self.__frame([], np.empty((0, len(_columns))))
+        _, label, values = self.__partial
+        self.__partial = None
+        return self.__frame([label], values[None, :])
+
+    def __frame(self, labels, values) -> pd.DataFrame:
+        index = pd.DatetimeIndex(np.asarray(labels, dtype="datetime64[ns]"), name="date")
+        if self.__tz is not None:
+            index = index.tz_localize("UTC").tz_convert(self.__tz)
+        bars = pd.DataFrame(values, index=index, columns=_columns, copy=False)
+        bars["trades"] = bars["trades"].astype(np.int64)
+        return bars
+
+
+def build_bars(
+    ticks, kind: str = "time", size=None, chunksize: int = 1_000_000, store=None, symbol=None, interval=None, **kwargs
+):
+    """Build bars from ticks in one streaming pass.
+
+    Args:
+        ticks: CSV/Parquet path or an iterable of tick dataframes.
+        kind (str, optional): "time", "tick", "volume" or "dollar". Defaults to "time".
+        size: bar size, see `BarBuilder`.
+        chunksize (int, optional): ticks read per chunk from a file. Defaults to 1_000_000.
+        store (DatasetStore, optional): append the bars to `store` as (symbol, interval) instead of yielding them.
+        **kwargs: column names / time unit, see `BarBuilder`.
+
+    Returns:
+        generator of bar dataframes, or None when writing to `store`
+    """
+    builder = BarBuilder(kind=kind, size=size, **kwargs)
+    chunks = read_ticks(ticks, chunksize) if isinstance(ticks, (str, os.PathLike)) else ticks
+
+    def bars():
+        for chunk in chunks:
+            completed = builder.update(chunk)
+            if len(completed):
+                yield completed
+        last = builder.flush()
+        if len(last):
+            yield last
+
+    if store is None:
+        return bars()
+
+    if (symbol, interval) in store:
+        store.delete(symbol, interval)
+    for completed in bars():
+        store.append(symbol, interval, completed)
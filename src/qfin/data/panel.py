@@ -0,0 +1,79 @@
+"""
+Aligned multi-symbol price panel.
+
+All symbols share one DatetimeIndex and the prices live in a single array
+shaped (field x time x symbol), so a universe is held once in memory and
+per-symbol / per-field frames are views of that array, not copies.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class Panel:
+    """OHLCV panel of many symbols on a shared index.
+
+    i.e:
+        panel.values.shape         # (5, n_bars, n_symbols)
+        panel.frame("^SPX")        # open/high/low/close/volume of one symbol (views)
+        panel.field("close")       # close of every symbol, symbols as columns (view)
+    """
+
+    def __init__(self, index: pd.DatetimeIndex, symbols: list, fields: list, values: np.ndarray):
+        if values.shape != (len(fields), len(index), len(symbols)):
+            raise ValueError(f"values shape {values.shape} does not match (fields, index, symbols)")
+
+        self.index = index
+        self.symbols = list(symbols)
+        self.fields = list(fields)
+        self.values = values
+        self.__symbol_loc = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __iter__(self):
+        return iter(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol in self.__symbol_loc
+
+    def __getitem__(self, symbol) -> pd.DataFrame:
+        return self.frame(symbol)
+
+    def __repr__(self):
+        return f"Panel(fields={self.fields}, bars={len(self.index)}, symbols={len(self.symbols)}, dtype={self.values.dtype})"
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes
+
+    def items(self):
+        """Iterate over (symbol, frame) pairs."""
+        for symbol in self.symbols:
+            yield symbol, self.frame(symbol)
+
+    def frame(self, symbol: str, trim: bool = True) -> pd.DataFrame:
+        """Fields of one symbol as a dataframe whose columns are views of the panel.
+
+        Args:
+            symbol (str): symbol name.
+            trim (bool, optional): drop the leading/trailing bars without close price
+                (before listing, after delisting), still without copying. Defaults to True.
+
+        Returns:
+            pd.DataFrame: can be given to `Backtester(..., copy=False)`.
+        """
+        j = self.__symbol_loc[symbol]
+        start, end = 0, len(self.index)
+
+        if trim and "close" in self.fields:
+            valid = np.flatnonzero(~np.isnan(self.values[self.fields.index("close"), :, j]))
+            start, end = (valid[0], valid[-1] + 1) if len(valid) else (0, 0)
+
+        data = {field: self.values[f, start:end, j] for f, field in enumerate(self.fields)}
+        return pd.DataFrame(data, index=self.index[start:end], copy=False)
+
+    def field(self, name: str) -> pd.DataFrame:
+        """One field of every symbol (time x symbol), a view of the panel."""
+        return pd.DataFrame(self.values[self.fields.index(name)], index=self.index, columns=self.symbols, copy=False)
@@ -0,0 +1,184 @@
+"""
+Local columnar dataset store, partitioned by symbol and interval.
+
+    <root>/<symbol>/<interval>/_index.npy
+    <root>/<symbol>/<interval>/<column>.npy
+    <root>/<symbol>/<interval>/meta.json
+
+Every column is a plain `.npy` file opened memory-mapped, so a dataset is not read
+into memory when opened: only the pages of the columns actually used are loaded,
+and processes reading the same files share the OS page cache.
+
+i.e:
+    store = DatasetStore("./datastore")
+    store.write("SPX", "1d", df)
+    bt = Backtester.from_store(store, "SPX", "1d", columns=["close", "signal"])
+"""
+
+import json
+import os
+import shutil
+import struct
+
+import numpy as np
+import pandas as pd
+
+_index_file = "_index.npy"
+_meta_file = "meta.json"
+_header_size = 128  # fixed .npy header size, so the shape can be rewritten in place on append
+
+
+def _npy_header(dtype: np.dtype, length: int) -> bytes:
+    """helper function: .npy v1.0 header padded to `_header_size` bytes"""
+    header = f"{{'descr': {np.lib.format.dtype_to_descr(dtype)!r}, 'fortran_order': False, 'shape': ({length},), }}"
+    header = header.ljust(_header_size - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+def _column_array(values) -> np.ndarray:
+    """helper function: numeric and datetime columns as they are (UTC with a timezone), anything else as fixed-width strings"""
+    if getattr(values, "tz", None) is not None:
+        values = values.tz_convert("UTC").tz_localize(None)
+    values = np.asarray(values)
+    if values.dtype.kind in "biufcmM":
+        return values
+    return values.astype(str)
+
+
+def _write_column(path: str, values: np.ndarray):
+    with open(path, "wb") as f:
+        f.write(_npy_header(values.dtype, len(values)))
+        f.write(np.ascontiguousarray(values).tobytes())
+
+
+def _append_column(path: str, values: np.ndarray) -> int:
+    with open(path, "r+b") as f:
+        if np.lib.format.read_magic(f) != (1, 0):
+            raise ValueError(f"{path} was not written by DatasetStore, it can not be appended")
+        shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        if f.tell() != _header_size:
+            raise ValueError(f"{path} was not written by DatasetStore, it can not be appended")
+        wider = np.promote_types(dtype, values.dtype) if dtype.kind in "US" else dtype
+        if wider == dtype:
+            values = np.ascontiguousarray(values.astype(dtype, copy=False))
+            f.seek(0, os.SEEK_END)
+            f.write(values.tobytes())
+            f.seek(0)
+            f.write(_npy_header(dtype, shape[0] + len(values)))
+    if wider != dtype:
+        _widen_column(path, values, wider)
+    return shape[0] + len(values)
+
+
+def _widen_column(path: str, values: np.ndarray, dtype: np.dtype):
+    """helper function: rewrite a string column with a larger width, so longer values are never truncated"""
+    stored = np.load(path, mmap_mode="r")
+    tmp = f"{path}.tmp-{os.getpid()}"
+    _write_column(tmp, np.concatenate([stored.astype(dtype), values.astype(dtype)]))
+    del stored
+    os.replace(tmp, path)
+
+
+class DatasetStore:
+    """Memory-mapped columnar datasets by symbol and interval."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, symbol: str, interval: str) -> str:
+        return os.path.join(self.root, symbol.replace("/", "_"), str(interval))
+
+    def __contains__(self, key) -> bool:
+        symbol, interval = key
+        return os.path.exists(os.path.join(self.path(symbol, interval), _meta_file))
+
+    def symbols(self) -> list:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def intervals(self, symbol: str) -> list:
+        path = os.path.join(self.root, symbol.replace("/", "_"))
+        return sorted(name for name in os.listdir(path) if os.path.exists(os.path.join(path, name, _meta_file)))
+
+    def meta(self, symbol: str, interval: str) -> dict:
+        with open(os.path.join(self.path(symbol, interval), _meta_file)) as f:
+            return json.load(f)
+
+    def columns(self, symbol: str, interval: str) -> list:
+        return self.meta(symbol, interval)["columns"]
+
+    def __write_meta(self, path, df, length):
+        tz = getattr(df.index, "tz", None)
+        meta = {"columns": list(map(str, df.columns)), "index": df.index.name, "tz": tz and str(tz), "length": length}
+        with open(os.path.join(path, _meta_file), "w") as f:
+            json.dump(meta, f)
+
+    def write(self, symbol: str, interval: str, df: pd.DataFrame):
+        """Write (or replace) a dataset, one file per column."""
+        path = self.path(symbol, interval)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        _write_column(os.path.join(tmp_path, _index_file), _column_array(df.index))
+        for column in df.columns:
+            _write_column(os.path.join(tmp_path, f"{column}.npy"), _column_array(df[column].to_numpy()))
+        self.__write_meta(tmp_path, df, len(df))
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    def append(self, symbol: str, interval: str, df: pd.DataFrame):
+        """Append rows from the last stored bar on (same columns), writing only the new data.
+
+        A string column is rewritten when the new values are longer than its width.
+        """
+        if (symbol, interval) not in self:
+            return self.write(symbol, interval, df)
+        if not len(df):
+            return
+
+        path = self.path(symbol, interval)
+        columns = self.columns(symbol, interval)
+        if list(map(str, df.columns)) != columns:
+            raise ValueError(f"columns {list(df.columns)} do not match the stored columns {columns}")
+
+        new_index = _column_array(df.index)
+        index = np.load(os.path.join(path, _index_file), mmap_mode="r")
+        if len(index) and new_index[0] < index[-1]:
+            raise ValueError(f"rows must not start before the last stored bar {index[-1]}")
+        del index
+
+        length = _append_column(os.path.join(path, _index_file), new_index)
+        for column in df.columns:
+            _append_column(os.path.join(path, f"{column}.npy"), _column_array(df[column].to_numpy()))
+        self.__write_meta(path, df, length)
+
+    def open(self, symbol: str, interval: str, columns: list = None, start: int = 0, end: int = None) -> pd.DataFrame:
+        """Open a dataset memory-mapped, nothing is read or copied until it is used.
+
+        Args:
+            symbol (str): symbol name.
+            interval (str): interval name.
+            columns (list, optional): columns to open. Defaults to all.
+            start (int, optional): first bar (position). Defaults to 0.
+            end (int, optional): end bar (position, excluded). Defaults to the last bar.
+
+        Returns:
+            pd.DataFrame: read-only columns backed by the files, use `Backtester(..., copy=False)`.
+        """
+        path = self.path(symbol, interval)
+        meta = self.meta(symbol, interval)
+        columns = meta["columns"] if columns is None else columns
+
+        index = np.load(os.path.join(path, _index_file), mmap_mode="r")[start:end]
+        data = {column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r")[start:end] for column in columns}
+
+        index = pd.Index(index, name=meta["index"], copy=False)
+        if meta.get("tz"):
+            index = index.tz_localize("UTC").tz_convert(meta["tz"])
+        return pd.DataFrame(data, index=index, copy=False)
+
+    def delete(self, symbol: str, interval: str):
+        shutil.rmtree(self.path(symbol, interval), ignore_errors=True)
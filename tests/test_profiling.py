@@ -0,0 +1,48 @@
+import os
+
+import pandas as pd
+
+from qfin.backtester.backtester import Backtester
+from qfin.backtester.profiling import Profiler
+
+_dataset = os.path.join(os.path.dirname(__file__), "..", "examples", "data", "_^spx.csv")
+
+
+def _backtester(reports: list) -> Backtester:
+    dataset = pd.read_csv(_dataset, index_col=0, parse_dates=[0])
+    return Backtester(dataset=dataset, profile=Profiler(sinks=[reports.append]))
+
+
+def test_report_after_an_early_break_includes_the_post_run_calls():
+    reports = []
+    bt = _backtester(reports)
+    for broker in bt.run():
+        if broker.state.current_bar == 50:
+            break
+    bt.history()
+    assert reports == []
+
+    report = bt.profiler.report()
+    assert reports == [report]
+    assert report["counters"]["bars_yielded"] == 50
+    assert report["phases"]["backtester.history"]["calls"] == 1
+
+    bt.profiler.report()
+    assert len(reports) == 1
+
+
+def test_unreported_run_is_sent_when_the_next_run_starts():
+    reports = []
+    bt = _backtester(reports)
+    for _ in bt.run():
+        pass
+    bt.stats()
+    for _ in bt.run():
+        break
+    assert len(reports) == 1
+    assert "backtester.stats" in reports[0]["phases"]
+
+    with bt.profiler:
+        pass
+    assert len(reports) == 2
+    assert reports[1]["counters"]["bars_yielded"] == 1